@@ -1,19 +1,489 @@
-import re
+import heapq
 import math
+import os
+import shutil
 import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from operator import itemgetter
+
+import numpy
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				os.pardir, "common"))
+
+from cache import LRUCache
+from docstore import DocumentStore, split_file
+from fuzzy import FuzzyIndex
+from impacts import ImpactIndex
+from metrics import Metrics, peak_rss
+from positions import PositionIndex, is_wildcard, parse_query
+from segment import (Lexicon, LexiconEncoder, SegmentWriter, read_segment,
+	wildcard_regex, write_segment)
+from batch import report_stats, result_writer, run_batch
+from tokenizer import STOPWORDS, Tokenizer
+
+# Identifies a segment file written by InvertedIndex.save.
+SEGMENT_MAGIC = b"IIBM2503"
+
+# Identifies a run file written by build_streaming.
+RUN_MAGIC = b"IIBMRUN2"
+
+# Estimated memory of a buffered posting (record id and term frequency) and
+# of a buffered word (string, dict slot and two arrays), in bytes.
+POSTING_BYTES = 8
+WORD_BYTES = 250
+
+# Records per in-memory segment of records added at runtime, and the number
+# of full segments at which they are merged in the background.
+SEGMENT_SIZE = 1000
+MERGE_SEGMENTS = 4
+
+# Number of query results kept by process_query.
+RESULT_CACHE_SIZE = 1024
+
+# Tolerance for comparing score upper bounds, which are summed in a
+# different order than the scores themselves.
+SCORE_SLACK = 1e-9
+
+# Top-k queries use WAND (see top_k) only with at least that many lists and
+# postings in all; otherwise summing all scores and selecting the top-k is
+# faster, as WAND cannot skip enough. WAND also gives up once it moved the
+# lists by more than one in WAND_MOVE_RATIO of their postings.
+WAND_MIN_TERMS = 4
+WAND_MIN_POSTINGS = 50000
+WAND_MOVE_RATIO = 16
+
+# Number of decoded inverted lists kept by SegmentInvertedLists.
+LIST_CACHE_SIZE = 256
+
+# Number of results per query in batch mode, unless --top is given.
+BATCH_K = 10
+
+# Most words a keyword with wildcards expands to (the first ones in order).
+MAX_EXPANSIONS = 1024
+
+# Factor by which the scores of a correction of a misspelled keyword are
+# lowered, once per edit (see correct).
+FUZZY_WEIGHT = 0.5
+
+# Command line options that cannot be combined with the option of the key.
+CONFLICTING_OPTIONS = {
+	"memory-limit": ("positions", "fuzzy", "impacts", "quantize", "shards"),
+	"shards": ("metrics", "fuzzy", "quantize"),
+	"quantize": ("impacts",),
+}
+
+
+def bm25_scores(term_freqs, doc_lengths, idf, avdl, b, k):
+	"""
+	The BM25 scores of postings, given their term frequencies, the lengths
+	of their documents and the idf of their term (all NumPy arrays, or a
+	number for idf).
+
+	>>> bm25_scores(numpy.array([1, 2]), numpy.array([2.0, 4.0]), 1.0, 3.0,
+	...     b=0, k=float("inf")).tolist()
+	[1.0, 2.0]
+	"""
+	tf = term_freqs.astype(numpy.float64)
+	a = 1 - b + (b * doc_lengths / avdl)
+	if (k > 0):
+		tf2 = tf * (1 + (1/k)) / (a + (tf/k))
+	else:
+		tf2 = numpy.ones_like(tf)
+	return tf2 * idf
+
+
+def quantize_scores(scores, bits):
+	"""
+	Round scores (a NumPy array) to unsigned integers of the given number of
+	bits, 8 or 16, in steps of the largest score divided by the largest
+	integer. Return the integers and the step.
+
+	>>> levels, step = quantize_scores(numpy.array([0.0, 0.5, 2.0]), 8)
+	>>> levels.tolist(), levels.dtype.name, round(step * 255, 3)
+	([0, 64, 255], 'uint8', 2.0)
+	"""
+	if (bits not in (8, 16)):
+		raise ValueError("scores are quantized to 8 or 16 bits, not %s" % bits)
+	dtype = numpy.uint8 if bits == 8 else numpy.uint16
+	largest = float(scores.max()) if len(scores) > 0 else 0.0
+	step = largest / numpy.iinfo(dtype).max if largest > 0 else 1.0
+	return numpy.rint(scores / step).astype(dtype), step
+
+
+def count_terms(words):
+	"""
+	The term frequencies of the words (terms) of a record, in order of
+	first occurrence.
+
+	>>> count_terms(Tokenizer().tokens("Movie\\tA short, short film."))
+	{'movie': 1, 'a': 1, 'short': 2, 'film': 1}
+	"""
+	term_freqs = {}
+	for word in words:
+		term_freqs[word] = term_freqs.get(word, 0) + 1
+	return term_freqs
+
+
+def write_run(postings, file_name):
+	"""
+	Write buffered postings (word -> array of record ids, array of term
+	frequencies) to a run file, sorted by word.
+	"""
+	terms, term_offsets = Lexicon.encode(postings)
+	posting_offsets = array("Q", [0])
+	ids, tfs = array("I"), array("I")
+	for word in sorted(postings):
+		ids.extend(postings[word][0])
+		tfs.extend(postings[word][1])
+		posting_offsets.append(len(ids))
+	write_segment(file_name, RUN_MAGIC, {
+		"terms": terms, "term_offsets": term_offsets,
+		"posting_offsets": posting_offsets, "ids": ids, "tfs": tfs})
+
+
+def build_partial_index(file_name, start, end, positions=False, tokenizer=None):
+	"""
+	Read the records in the given byte range of the file into raw columns,
+	with record ids starting at 1 (run in a worker process by read_parallel).
+	"""
+	ii = InvertedIndex(tokenizer=tokenizer)
+	ii.positions = PositionIndex() if positions else None
+	ii.read_range(file_name, start, end)
+	return (ii.terms, ii.term_offsets, ii.record_ids, ii.term_freqs,
+			ii.length_of_docs, ii.documents,
+			ii.positions.to_arrays() if positions else None)
+
+
+def batch_query(ii, query, k=BATCH_K):
+	"""
+	The top-k [record id, score] pairs of a query line, which may contain
+	phrases (run in a worker process by run_batch).
+
+	>>> ii = InvertedIndex()
+	>>> ii.read_from_file("example.txt")
+	>>> [record_id for record_id, score in batch_query(ii, "Short, FILM", 2)]
+	[4, 3]
+	"""
+	keywords, phrases = parse_query(query, ii.tokenizer)
+	return [[int(record_id), float(score)]
+			for record_id, score in ii.process_query(keywords, k=k, phrases=phrases)]
+
+
+def batch_tsv(query, result):
+	"""
+	One line per result of batch_query: query, rank, record id, score.
+
+	>>> list(batch_tsv("short film", [[4, 1.5], [3, 0.25]]))
+	['short film\\t1\\t4\\t1.5', 'short film\\t2\\t3\\t0.25']
+	"""
+	for rank, (record_id, score) in enumerate(result, 1):
+		yield "%s\t%d\t%d\t%r" % (query, rank, record_id, score)
+
+
+def check_arguments(arguments, options):
+	"""
+	What is wrong with the command line, given the arguments without the
+	options of the form --name=value, or None if nothing is.
+
+	>>> check_arguments(["Inverted_Index.py", "corpus.txt"], {"quantize": "8"})
+	>>> check_arguments(["Inverted_Index.py", "corpus.txt"], {"quantize": "4"})
+	'--quantize must be 8 or 16'
+	>>> check_arguments(["Inverted_Index.py", "corpus.txt"],
+	...                 {"quantize": "8", "impacts": ""})
+	'--quantize does not work with --impacts'
+	>>> check_arguments(["Inverted_Index.py", "corpus.txt", "index"],
+	...                 {"shards": "2"})
+	'--shards does not work with <index-file>'
+	>>> check_arguments(["Inverted_Index.py", "corpus.txt"], {"processes": "0"})
+	'--processes must be a positive number'
+	>>> check_arguments(["Inverted_Index.py", "corpus.txt", "index"],
+	...                 {"batch": "queries.txt", "top": "x"})
+	'--top must be a positive number'
+	"""
+	if (len(arguments) < 2 or len(arguments) > 5):
+		return "need <file> [<b> <k>] [<index-file>]"
+	has_index_file = len(arguments) in (3, 5)
+	if (options.get("quantize", "8") not in ("8", "16")):
+		return "--quantize must be 8 or 16"
+	if (not options.get("shards", "1").isdigit()):
+		return "--shards must be a number"
+	processes = options.get("processes", "1")
+	if (not processes.isdigit() or int(processes) < 1):
+		return "--processes must be a positive number"
+	top = options.get("top", "1")
+	if (not top.isdigit() or int(top) < 1):
+		return "--top must be a positive number"
+	for name, others in CONFLICTING_OPTIONS.items():
+		for other in others:
+			if (name in options and other in options):
+				return "--%s does not work with --%s" % (name, other)
+	if ("shards" in options and has_index_file):
+		return "--shards does not work with <index-file>"
+	if ("memory-limit" in options and not has_index_file):
+		return "--memory-limit needs <index-file>"
+	if ("batch" in options and "shards" not in options and not has_index_file):
+		return "--batch needs <index-file> (or --shards)"
+	return None
+
+
+def count_merged(args, result):
+	""" Counters of one call of accumulate or merge (see Metrics). """
+	inverted_lists = args[0] if len(args) == 1 else args
+	return {"lists_merged": len(inverted_lists),
+			"candidates_scored": len(result),
+			"postings_touched": sum(len(inverted_list)
+									for inverted_list in inverted_lists)}
+
+
+def count_top_k(args, result):
+	""" Counters of one call of top_k or top_k_sums: its lists and postings. """
+	return {"lists_merged": len(args[0]),
+			"top_k_postings": sum(len(inverted_list) for inverted_list in args[0])}
+
+
+def count_scored(args, result):
+	""" Counters of one call of score_postings or live_postings. """
+	return {"postings_scored": len(result)}
+
+
+# The stages timed by InvertedIndex.enable_metrics: method name, stage
+# name, counters function, whether to keep a latency histogram.
+METRIC_STAGES = [
+	("read_range", "build.read", lambda args, result: {"records_read": result}, False),
+	("read_parallel", "build.read_parallel", None, False),
+	("set_columns", "build.sort", None, False),
+	("score", "build.score", None, False),
+	("write_runs", "build.runs", None, False),
+	("merge_runs", "build.merge_runs", None, False),
+	("compact", "compact", None, False),
+	("merge_into_main", "compact.merge_into_main", None, False),
+	("save", "save", None, False),
+	("load", "load", None, False),
+	("process_query", "query", lambda args, result: {"queries": 1}, True),
+	("expand", "query.expand", None, False),
+	("correct", "query.correct", None, False),
+	("rank", "query.rank", None, False),
+	("score_postings", "query.score_postings", count_scored, False),
+	("live_postings", "query.live_postings", count_scored, False),
+	("accumulate", "query.accumulate", count_merged, False),
+	("top_k", "query.top_k", count_top_k, False),
+	("top_k_sums", "query.top_k_sums", count_top_k, False),
+	("merge", "merge", count_merged, False),
+	("render_output", "render", None, False),
+]
+
+
+class MemorySegment:
+	"""
+	The raw postings of records added at runtime, which have consecutive
+	ids starting at first_id. Once full, a segment is only read.
+
+	>>> segment = MemorySegment(5)
+	>>> segment.add({"short": 2, "film": 1}), segment.add({"film": 1})
+	(5, 6)
+	>>> [x.tolist() for x in segment.raw_postings("film")]
+	[[5, 6], [1, 1]]
+	"""
+
+	def __init__(self, first_id):
+		self.first_id = first_id
+		self.postings = {}  # Word -> array of record ids, array of term frequencies.
+		self.length_of_docs = array("I")
+
+	def add(self, term_freqs):
+		""" Add the next record, given its term frequencies, and return its id. """
+		record_id = self.first_id + len(self.length_of_docs)
+		for word, term_freq in term_freqs.items():
+			columns = self.postings.get(word)
+			if (columns is None):
+				columns = self.postings[word] = (array("I"), array("I"))
+			columns[0].append(record_id)
+			columns[1].append(term_freq)
+		self.length_of_docs.append(sum(term_freqs.values()))
+		return record_id
+
+	def raw_postings(self, word):
+		"""
+		Copies of the record ids and term frequencies of the word, as NumPy
+		arrays.
+		"""
+		columns = self.postings.get(word)
+		if (columns is None):
+			return None
+		return (numpy.array(columns[0], dtype=numpy.uint32),
+				numpy.array(columns[1], dtype=numpy.uint32))
+
+	def __len__(self):
+		return len(self.length_of_docs)
+
+	@classmethod
+	def merge(cls, segments, deleted):
+		"""
+		One segment with the records of consecutive segments, leaving out the
+		postings of deleted records.
+
+		>>> first, second = MemorySegment(1), MemorySegment(3)
+		>>> ids = first.add({"a": 1}), first.add({"a": 2, "b": 1}), second.add({"b": 3})
+		>>> merged = MemorySegment.merge([first, second], {2})
+		>>> len(merged), [x.tolist() for x in merged.raw_postings("b")]
+		(3, [[3], [3]])
+		"""
+		merged = cls(segments[0].first_id)
+		for segment in segments:
+			merged.length_of_docs.extend(segment.length_of_docs)
+			for word, (record_ids, term_freqs) in segment.postings.items():
+				for record_id, term_freq in zip(record_ids, term_freqs):
+					if (record_id not in deleted):
+						columns = merged.postings.get(word)
+						if (columns is None):
+							columns = merged.postings[word] = (array("I"), array("I"))
+						columns[0].append(record_id)
+						columns[1].append(term_freq)
+		return merged
+
+
+def expand_words(inverted_lists, pattern, limit=MAX_EXPANSIONS):
+	"""
+	The words of the inverted lists (a dict or SegmentInvertedLists) that
+	match a pattern with wildcards, in sorted order; at most limit of them.
+
+	>>> expand_words({"film": [(2, 1.0)], "films": [(1, 1.0)]}, "fil?")
+	['film']
+	"""
+	if (isinstance(inverted_lists, SegmentInvertedLists)):
+		return inverted_lists.lexicon.expand(pattern, limit)
+	return sorted(filter(wildcard_regex(pattern).fullmatch,
+						 inverted_lists))[:limit]
+
+
+class SegmentInvertedLists(Mapping):
+	"""
+	Read-only inverted lists backed by the columns of a segment, memory-
+	mapped or, after score, in memory. The words are in a front-coded
+	Lexicon, and the list of (record_id, score) tuples of a word is only
+	built when it is looked up. The last cache_size lists built are kept,
+	as frequent words come back in many queries; they must not be modified.
+	"""
+
+	def __init__(self, arrays, cache_size=LIST_CACHE_SIZE):
+		self.arrays = arrays
+		self.lexicon = Lexicon(arrays["terms"], arrays["term_offsets"])
+		self.lists = LRUCache(cache_size)
+		#Quantized scores are given as integers and their step instead
+		self.step = arrays["score_step"][0] if "score_step" in arrays else None
+
+	def __getitem__(self, word):
+		inverted_list = self.lists.get(word)
+		if (inverted_list is not None):
+			return inverted_list
+		i = self.lexicon.index(word)
+		if (i < 0):
+			raise KeyError(word)
+		start, end = self.arrays["posting_offsets"][i:i + 2]
+		if (self.step is None):
+			scores = self.arrays["scores"][start:end].tolist()
+		else:
+			levels = self.arrays["score_levels"][start:end]
+			scores = (numpy.asarray(levels, dtype=numpy.float64) * self.step).tolist()
+		inverted_list = list(zip(self.arrays["ids"][start:end].tolist(), scores))
+		self.lists.put(word, inverted_list)
+		return inverted_list
+
+	def __contains__(self, word):
+		return self.lexicon.index(word) >= 0
+
+	def __iter__(self):
+		return iter(self.lexicon)
+
+	def __len__(self):
+		return len(self.lexicon)
+
 
 class InvertedIndex:
-	def __init__(self):
+	def __init__(self, cache_size = RESULT_CACHE_SIZE, tokenizer = None):
 	        """
-	        Start with empty nverted index.
+	        Start with empty nverted index, caching the results of up to
+	        cache_size queries. Records are split into words by the tokenizer
+	        (a default Tokenizer if not given), which is saved with the index.
 	        """
+	        self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
 	        self.inverted_lists = {}
 	        self.length_of_docs = []  # Length of document.
-	        self.records = []  # Tuple for storing title and description.
+	        self.documents = DocumentStore()  # Title and description by record id.
+	        self.max_scores = {}  # Largest score in each inverted list.
+	        # Records added and deleted at runtime, see add_document.
+	        self.segments = []
+	        self.deleted = frozenset()
+	        self.stale = False  # Whether the scores in inverted_lists are outdated.
+	        self.lock = threading.Lock()
+	        self.compaction_lock = threading.Lock()
+	        self.compaction = None
+	        self.results = LRUCache(cache_size)  # See process_query.
+	        self.metrics = None  # See enable_metrics.
+	        self.positions = None  # Token positions, see read_from_file.
+	        self.fuzzy = None  # Typo-tolerant lookup of the words, see read_from_file.
+	        self.impacts = None  # Postings in order of score, see read_from_file.
+	        self.score_bits = None  # Bits per quantized score, see quantize.
+	        # Statistics of the whole collection, see set_collection.
+	        self.collection = None
 
+	def enable_metrics(self, metrics=None):
+		"""
+		Time the stages of building, querying and rendering (see
+		METRIC_STAGES) and count records, queries, merged lists, touched
+		postings and scored candidates in metrics (a new Metrics by default),
+		which is returned. Until then, and after disable_metrics, no time is
+		spent on measuring.
 
-	def read_from_file(self,file_name, b = None, k = None):
+		>>> ii = InvertedIndex()
+		>>> metrics = ii.enable_metrics()
+		>>> ii.read_from_file("example.txt")
+		>>> [record_id for record_id, score in ii.process_query(["short", "film"])]
+		[4, 3, 2]
+		>>> stats = metrics.to_dict()
+		>>> sorted(stats["timers"])
+		['build.read', 'build.score', 'query', 'query.accumulate', 'query.rank']
+		>>> stats["counters"]
+		... # doctest: +NORMALIZE_WHITESPACE
+		{'candidates_scored': 3, 'lists_merged': 2, 'postings_touched': 4,
+		 'queries': 1, 'records_read': 4}
+		>>> ii.disable_metrics()
 		"""
+		self.disable_metrics()
+		self.metrics = Metrics() if metrics is None else metrics
+		for name, stage, counters, histogram in METRIC_STAGES:
+			self.metrics.instrument(self, name, stage, counters, histogram)
+		return self.metrics
+
+	def disable_metrics(self):
+		""" Stop measuring (the measurements stay in the Metrics object). """
+		if (self.metrics is not None):
+			self.metrics.uninstrument(self)
+			self.metrics = None
+
+
+	def read_from_file(self,file_name, b = None, k = None, processes = 1,
+			positions = False, fuzzy = False, impacts = False,
+			quantize = None):
+		"""
+		Read the file into raw columns, in parallel with more than one
+		process (see read_parallel), and compute the BM25 scores. With
+		positions, the positions of the words in each record are kept too,
+		for phrase queries; with fuzzy, a FuzzyIndex of the words, for
+		misspelled queries; with impacts, an ImpactIndex of the scores, for
+		top-k queries that stop early (see process_query). With quantize (8
+		or 16), the scores are kept as integers of that many bits, see
+		quantize; this does not go with impacts, which need the exact scores.
+
 		>>> ii = InvertedIndex()
         >>> ii.read_from_file("example.txt", b=0, k=float("inf"))
         >>> r_list = sorted(ii.inverted_lists.items())
@@ -45,58 +515,373 @@ class InvertedIndex:
 		 ('short', [(3, '1.106'), (4, '1.313')])]
 		"""
 
+		if (impacts and quantize is not None):
+			raise ValueError("impacts need the exact scores, not quantized ones")
 		if (b == None):	#Setting b and k values
 			b = 0.75
 			k = 1.75
 		else:
 			b = b
 			k = k
-		with open(file_name , encoding ="utf-8") as file:
-		    record_id = 0
-		    for line in file:
-		    	record_id += 1
-		    	doc_length = 0
-		    	words = re.split("[^a-zA-Z]+", line)
-		    	for word in words:
-		        	if (len(word) > 0):
-		           		word = word.lower()
-		           		doc_length += 1
-		           		if (word not in self.inverted_lists):
-		           			self.inverted_lists[word] = [(record_id, 1)]
-		           			continue
-		   	       		exist = self.inverted_lists[word][-1] #Checking if record exists
-		   	       		if (exist[0] == record_id):	#if True ad 1 in TF
-		   	       			self.inverted_lists[word][-1] = (record_id, exist[1] + 1)
-		   	       		else:
-		           			self.inverted_lists[word].append((record_id, 1))
-		    	
-		    	#Saving all the records as tuples
-		    	self.records.append(tuple(line.split("\t")))
-		    	#Length of each record/doc
-		    	self.length_of_docs.append(doc_length)
-		    	
-		   	#Total Documents
-		    n = len(self.records)
-
-		    #Average Length
-		    avdl = sum(self.length_of_docs)/n
-
-		    #print (b, k)
-
-		    #BM25 Scores implementation
-		    for word, inverted_list in self.inverted_lists.items():
-		    	for i, (record_id, tf) in enumerate(inverted_list):
-		    		doc_length = self.length_of_docs[record_id - 1]
-		    		a = 1 - b + (b * doc_length / avdl)		    		
-		    		if (k > 0):
-		    			tf2 = tf * (1 + (1/k)) / (a + (tf/k))
-		    		else:
-		    			tf2 = 1
-		    		#Document Frequency
-		    		doc_freq = len(self.inverted_lists[word])
-		    		inverted_list[i] = (record_id, tf2 * math.log(n / doc_freq , 2))
-		    		# print(inverted_list)
+		self.segments, self.deleted, self.stale = [], frozenset(), False
+		self.results.clear()
+		self.positions = PositionIndex() if positions else None
+		if (processes > 1):
+			self.read_parallel(file_name, processes)
+		else:
+			self.read_range(file_name)
+
+		#BM25 Scores implementation
+		self.impacts = None
+		self.score_bits = quantize
+		self.score(b, k)
+		self.fuzzy = FuzzyIndex.build(self.terms) if fuzzy else None
+		if (impacts):
+			self.impacts = ImpactIndex.build(self.term_offsets, self.record_ids,
+											 self.scores)
+
+	def read_range(self, file_name, start=0, end=None):
+		"""
+		Read the records in the given byte range of the file into the raw
+		columns (terms, term_offsets, record_ids, term_freqs, length_of_docs)
+		and return their number. Does not compute any scores.
+		"""
+		self.inverted_lists = {}
+		self.length_of_docs = []
+		record_id = 0
+		positions = self.positions
+		tokens = self.tokenizer.tokens
+		for line in self.documents.read_lines(file_name, start, end):
+			record_id += 1
+			words = tokens(line)
+			if (positions is not None):
+				positions.add(record_id, words)
+			for word in words:
+				if (word not in self.inverted_lists):
+					self.inverted_lists[word] = [(record_id, 1)]
+					continue
+				exist = self.inverted_lists[word][-1] #Checking if record exists
+				if (exist[0] == record_id):	#if True ad 1 in TF
+					self.inverted_lists[word][-1] = (record_id, exist[1] + 1)
+				else:
+					self.inverted_lists[word].append((record_id, 1))
+
+			#Length of each record/doc
+			self.length_of_docs.append(len(words))
+
+		#Keep the raw postings as columns: all record ids and term frequencies,
+		#term after term in sorted order, with the offset of each term's
+		#postings. The terms go into a front-coded Lexicon.
+		terms = sorted(self.inverted_lists)
+		num_postings = [len(self.inverted_lists[word]) for word in terms]
+		self.term_offsets = numpy.zeros(len(terms) + 1, dtype=numpy.int64)
+		numpy.cumsum(num_postings, out=self.term_offsets[1:])
+		postings = numpy.fromiter(chain.from_iterable(chain.from_iterable(
+				map(self.inverted_lists.get, terms))),
+			dtype=numpy.int64, count=2 * int(self.term_offsets[-1]))
+		postings = postings.reshape(-1, 2)
+		self.record_ids = postings[:, 0].astype(numpy.uint32)
+		self.term_freqs = postings[:, 1].astype(numpy.uint32)
+		self.terms = self.term_ids = Lexicon(*Lexicon.encode(terms))
+		self.length_of_docs = numpy.array(self.length_of_docs, dtype=numpy.uint32)
+		return record_id
+
+	def read_parallel(self, file_name, processes):
+		"""
+		Split the file into one byte range per process, read the ranges in a
+		process pool and merge their columns: terms get their id in order of
+		first occurrence and record ids are shifted by the number of records
+		before them, then a stable sort by term id restores the serial
+		layout. Gives the same columns (and scores) as a serial read.
+
+		>>> serial, parallel = InvertedIndex(), InvertedIndex()
+		>>> serial.read_from_file("example.txt")
+		>>> parallel.read_from_file("example.txt", processes=2)
+		>>> list(parallel.terms) == list(serial.terms)
+		True
+		>>> parallel.inverted_lists == serial.inverted_lists
+		True
+		>>> parallel.documents.get(4)
+		'Movie\\tShort animated short film.'
+		"""
+		chunks = split_file(file_name, processes)
+		self.documents = DocumentStore()
+		self.documents.file_name = file_name
+		term_ids = {}
+		term_columns, id_columns, freq_columns, length_columns = [], [], [], []
+
+		num_records = 0
+		with ProcessPoolExecutor(processes) as executor:
+			partial_indexes = executor.map(
+					build_partial_index, [file_name] * len(chunks),
+					[start for start, _ in chunks], [end for _, end in chunks],
+					[self.positions is not None] * len(chunks),
+					[self.tokenizer] * len(chunks))
+			for (terms, term_offsets, record_ids, term_freqs, length_of_docs,
+					documents, position_arrays) in partial_indexes:
+				if (position_arrays is not None):
+					self.positions.extend(
+						PositionIndex.from_arrays(position_arrays), num_records)
+				global_ids = numpy.array([term_ids.setdefault(word, len(term_ids))
+					for word in terms], dtype=numpy.int64)
+				term_columns.append(numpy.repeat(global_ids, numpy.diff(term_offsets)))
+				id_columns.append(record_ids + numpy.uint32(num_records))
+				freq_columns.append(term_freqs)
+				length_columns.append(length_of_docs)
+				self.documents.extend(documents)
+				num_records += len(documents)
+		self.set_columns(list(term_ids), numpy.concatenate(term_columns),
+			numpy.concatenate(id_columns), numpy.concatenate(freq_columns))
+		self.length_of_docs = numpy.concatenate(length_columns)
+		return num_records
+
+	def set_columns(self, terms, term_column, record_ids, term_freqs):
+		"""
+		Set the raw columns from postings in record order, given the term id
+		(into terms) of each posting. The term ids are renumbered in sorted
+		order of the terms, then a stable sort by term id groups the postings
+		by term and keeps each group in record order. Terms without postings
+		are dropped.
+		"""
+		num_postings = numpy.bincount(term_column, minlength=len(terms))
+		if (not num_postings.all()):
+			kept = num_postings > 0
+			term_column = (numpy.cumsum(kept) - 1)[term_column]
+			terms = [word for word, keep in zip(terms, kept.tolist()) if keep]
+			num_postings = num_postings[kept]
+		by_term = sorted(range(len(terms)), key=terms.__getitem__)
+		sorted_ids = numpy.empty(len(terms), dtype=numpy.int64)
+		sorted_ids[by_term] = numpy.arange(len(terms))
+		term_column = sorted_ids[term_column]
+		num_postings = num_postings[by_term]
+		order = numpy.argsort(term_column, kind="stable")
+		self.terms = self.term_ids = Lexicon(*Lexicon.encode(terms))
+		self.record_ids = record_ids[order]
+		self.term_freqs = term_freqs[order]
+		self.term_offsets = numpy.zeros(len(terms) + 1, dtype=numpy.int64)
+		numpy.cumsum(num_postings, out=self.term_offsets[1:])
+
+
+	def score(self, b, k):
+		"""
+		Compute the BM25 scores of all postings from the raw columns kept by
+		read_from_file, in one vectorized pass, and rebuild the inverted lists
+		from them, as SegmentInvertedLists over the columns (see freeze), and
+		the ImpactIndex if there is one. Call again to re-score with
+		different b and k without reading the file again.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt", b=0.75, k=1.75)
+		>>> ii.score(b=0, k=float("inf"))
+		>>> [(num, '%.3f' %term) for num, term in ii.inverted_lists["animated"]]
+		[(1, '0.415'), (2, '0.415'), (4, '0.415')]
+		"""
+		self.b, self.k = b, k
+		self.results.clear()
+
+		#Total Documents and Average Length (of the records not deleted)
+		length_of_docs = numpy.asarray(self.length_of_docs, dtype=numpy.float64)
+		self.count_live()
+		n = self.num_docs
+
+		#Document Frequency of every term, repeated for each of its postings
+		#(one log per term, with math.log like a per-posting loop would)
+		doc_freqs = numpy.diff(self.term_offsets)
+		collection_freqs = doc_freqs if self.collection is None else self.collection[2]
+		idf = [math.log(n / doc_freq , 2) for doc_freq in collection_freqs.tolist()]
+		idf = numpy.repeat(numpy.array(idf, dtype=numpy.float64), doc_freqs)
+
+		doc_lengths = length_of_docs[self.record_ids.astype(numpy.int64) - 1]
+		scores = bm25_scores(self.term_freqs, doc_lengths, idf, self.avdl, b, k)
+
+		if (self.score_bits is None):
+			self.scores = scores
+		else:
+			self.scores = None
+			self.score_levels, self.score_step = quantize_scores(
+				scores, self.score_bits)
+		self.inverted_lists = self.freeze()
+		#Upper bounds for top-k retrieval, computed on first use
+		self.max_scores = {}
+		if (self.impacts is not None):
+			self.impacts = ImpactIndex.build(self.term_offsets, self.record_ids, scores)
 
+	def freeze(self):
+		"""
+		The inverted lists over the sorted columns (lexicon, posting offsets,
+		record ids and scores), like those of a loaded index. Per term, this
+		takes a few bytes of front-coded lexicon and an offset instead of a
+		string, a dict slot and a list of tuples; a list is only built when
+		its word is looked up.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> lists = ii.inverted_lists
+		>>> len(lists), "film" in lists, "doc" in lists
+		(6, True, False)
+		"""
+		return SegmentInvertedLists(dict({
+			"terms": self.terms.blob, "term_offsets": self.terms.offsets,
+			"posting_offsets": self.term_offsets, "ids": self.record_ids},
+			**self.score_arrays()))
+
+	def score_arrays(self):
+		""" The scores as arrays for SegmentInvertedLists and save. """
+		if (self.score_bits is None):
+			return {"scores": numpy.asarray(self.scores, dtype=numpy.float64)}
+		return {"score_levels": self.score_levels,
+				"score_step": array("d", [self.score_step])}
+
+	def quantize(self, bits):
+		"""
+		Keep the scores as unsigned integers of the given number of bits, 8
+		or 16 (see quantize_scores), or as floats again with None, scored
+		anew from the raw columns. Quantized scores take 1 or 2 bytes per
+		posting instead of 8, and process_query sums them as integers, see
+		rank_quantized; the scores of the lists are the integers times the
+		step, within half a step of the exact ones.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> exact = ii.process_query(["short", "film"])
+		>>> ii.quantize(8)
+		>>> result = ii.process_query(["short", "film"])
+		>>> [(record_id, "%.2f" % score) for record_id, score in result]
+		[(4, '2.18'), (3, '1.11'), (2, '0.97')]
+		>>> ii.quantize(None)
+		>>> ii.process_query(["short", "film"]) == exact
+		True
+		"""
+		if (self.impacts is not None and bits is not None):
+			raise ValueError("impacts need the exact scores, not quantized ones")
+		if (bits is not None):
+			quantize_scores(numpy.zeros(0), bits)
+		self.score_bits = bits
+		self.score(self.b, self.k)
+
+	def count_live(self):
+		"""
+		Count the records that are not deleted and their total length, which
+		give n and avdl for BM25. The lengths are summed as integers, so avdl
+		does not depend on the order of the records. A shard takes them from
+		its collection instead.
+		"""
+		if (self.collection is not None):
+			self.set_stats(*self.collection[:2])
+			return
+		num_docs = len(self.length_of_docs)
+		total_length = int(numpy.sum(self.length_of_docs, dtype=numpy.int64))
+		for segment in self.segments:
+			num_docs += len(segment)
+			total_length += sum(segment.length_of_docs)
+		for record_id in self.deleted:
+			total_length -= self.doc_length(record_id)
+		self.set_stats(num_docs - len(self.deleted), total_length)
+
+	def set_stats(self, num_docs, total_length):
+		""" Set n, the total length and avdl of the records not deleted. """
+		self.num_docs, self.total_length = num_docs, total_length
+		self.avdl = total_length / num_docs if num_docs > 0 else 0.0
+
+	def set_collection(self, num_docs, total_length, doc_freqs):
+		"""
+		Make the index (read with read_range) a shard of a larger collection
+		of records: from now on, BM25 scores use the number of records, the
+		total length and the document frequencies (a NumPy array, one per
+		term in order) of the whole collection, so they equal those of an
+		index of all records (see shards.ShardedIndex). A shard cannot add
+		or delete records.
+		"""
+		self.collection = (num_docs, total_length, doc_freqs)
+
+	def doc_length(self, record_id):
+		""" The length of the record with the given id, in any segment. """
+		if (record_id <= len(self.length_of_docs)):
+			return int(self.length_of_docs[record_id - 1])
+		for segment in self.segments:
+			if (record_id < segment.first_id + len(segment)):
+				return segment.length_of_docs[record_id - segment.first_id]
+		raise KeyError(record_id)
+
+	def raw_postings(self, word):
+		"""
+		The record ids and term frequencies of the word, as NumPy arrays.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> [x.tolist() for x in ii.raw_postings("short")]
+		[[3, 4], [1, 2]]
+		"""
+		i = self.term_ids.get(word)
+		if (i is None):
+			return None
+		start, end = int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+		return self.record_ids[start:end], self.term_freqs[start:end]
+
+	def score_postings(self, word, b, k):
+		"""
+		Score the inverted list of the word with the given b and k, from the
+		raw term frequencies and the statistics of the whole index. Gives the
+		same scores as score(b, k) would, without touching other words.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt", b=0.75, k=1.75)
+		>>> postings = ii.score_postings("animated", 0, float("inf"))
+		>>> [(num, '%.3f' %term) for num, term in postings]
+		[(1, '0.415'), (2, '0.415'), (4, '0.415')]
+		"""
+		record_ids, term_freqs = self.raw_postings(word)
+		length_of_docs = numpy.asarray(self.length_of_docs)
+		doc_lengths = length_of_docs[record_ids.astype(numpy.int64) - 1]
+		doc_lengths = doc_lengths.astype(numpy.float64)
+		doc_freq = len(record_ids)
+		if (self.collection is not None):
+			doc_freq = int(self.collection[2][self.term_ids.get(word)])
+		idf = math.log(self.num_docs / doc_freq , 2)
+		scores = bm25_scores(term_freqs, doc_lengths, idf, self.avdl, b, k)
+		return list(zip(record_ids.tolist(), scores.tolist()))
+
+
+	def live_postings(self, word, b, k):
+		"""
+		The inverted list of the word over the main index and all in-memory
+		segments, without deleted records, scored with b and k and the
+		current statistics (n, df and avdl of the records not deleted).
+		"""
+		parts = []
+		with self.lock:
+			raw = self.raw_postings(word)
+			if (raw is not None):
+				record_ids, term_freqs = raw
+				length_of_docs = numpy.asarray(self.length_of_docs)
+				parts.append((record_ids, term_freqs,
+							  length_of_docs[record_ids.astype(numpy.int64) - 1]))
+			for segment in self.segments:
+				raw = segment.raw_postings(word)
+				if (raw is not None):
+					record_ids, term_freqs = raw
+					length_of_docs = numpy.array(segment.length_of_docs,
+												 dtype=numpy.uint32)
+					offsets = record_ids.astype(numpy.int64) - segment.first_id
+					parts.append((record_ids, term_freqs,
+								  length_of_docs[offsets]))
+			n, avdl, deleted = self.num_docs, self.avdl, self.deleted
+		if (len(parts) == 0):
+			return []
+
+		record_ids, term_freqs, doc_lengths = (numpy.concatenate(column)
+											   for column in zip(*parts))
+		if (len(deleted) > 0):
+			live = ~numpy.isin(record_ids, numpy.fromiter(
+				deleted, dtype=numpy.uint32, count=len(deleted)))
+			record_ids, term_freqs = record_ids[live], term_freqs[live]
+			doc_lengths = doc_lengths[live]
+		if (len(record_ids) == 0):
+			return []
+		idf = math.log(n / len(record_ids) , 2)
+		scores = bm25_scores(term_freqs, doc_lengths.astype(numpy.float64), idf,
+							 avdl, b, k)
+		return list(zip(record_ids.tolist(), scores.tolist()))
 
 	def merge(self, list1, list2):
 		"""
@@ -108,12 +893,15 @@ class InvertedIndex:
         >>> merged = ii.merge([(3, 1.7), (5, 3.2), (7, 4.1)], [(1, 2.3), (5, 1.3)])
         >>> [(title, "%.1f" % term) for title, term in merged]
         [(1, '2.3'), (3, '1.7'), (5, '4.5'), (7, '4.1')]
+
+        >>> ii.merge([(0, 1.0), (2, 1.0)], [(0, 2.0)])
+        [(0, 3.0), (2, 1.0)]
         """
 		i , j = 0 , 0
 		result = []
 
 		while (i < len(list1) and j < len(list2)):
-			if (i < list1[i][0]  and list1[i][0] == list2[j][0]):
+			if (list1[i][0] == list2[j][0]):
 				result.append((list1[i][0], list1[i][1] + list2[j][1]))
 				i += 1
 				j += 1
@@ -131,44 +919,853 @@ class InvertedIndex:
 
 		return result
 		
-	def process_query(self, query_Keywords):
+	def process_query(self, query_Keywords, k=None, b=None, k1=None, phrases=()):
 		"""
+		Return the records containing at least one keyword, sorted by the sum
+		of their BM25 scores. With k, only the top-k are computed, using WAND
+		for long lists of many keywords (see top_k and WAND_MIN_TERMS), or
+		score-at-a-time if the index has an ImpactIndex (see rank_impacts);
+		the result equals the first k of the full ranking.
+
+		The scores computed at build time are used, unless b or k1 are given:
+		then the query's lists are scored with these BM25 parameters (the
+		other one as at build time), see score_postings. After records were
+		added or deleted, the lists are scored at query time, see
+		live_postings.
+
+		A keyword with wildcards (* for any string, ? for any one character)
+		stands for all words it expands to, at most MAX_EXPANSIONS of them
+		(see expand), as if each one was a keyword.
+
+		If the index has a FuzzyIndex, a keyword that is in no inverted list
+		is replaced by the words closest to it, with lower scores (see
+		correct).
+
+		If the index keeps positions, only records that contain all phrases
+		(words, slop) are ranked, see rank_phrases and positions.parse_query;
+		the words of the phrases must be keywords too. Without positions,
+		phrases are ignored.
+
+		The keywords are processed in sorted order, so the same keywords in
+		any order have the same result, and results are cached by keywords,
+		k, b, k1 and phrases (see self.results). The cache is cleared
+		whenever the index changes.
+
+		>>> ii = InvertedIndex()
+		>>> ii.inverted_lists = {
+		... "foo": [(1, 0.2), (3, 0.6)],
+		... "bar": [(1, 0.4), (2, 0.7), (3, 0.5)],
+		... "baz": [(2, 0.1)]}
+		>>> result = ii.process_query(["foo", "bar"])
+		>>> [(title, "%.1f" % term) for title, term in result]
+		[(3, '1.1'), (2, '0.7'), (1, '0.6')]
+		>>> result = ii.process_query(["foo", "bar"], k=2)
+		>>> [(title, "%.1f" % term) for title, term in result]
+		[(3, '1.1'), (2, '0.7')]
+
 		>>> ii = InvertedIndex()
-        >>> ii.inverted_lists = {
-        ... "foo": [(1, 0.2), (3, 0.6)],
-        ... "bar": [(1, 0.4), (2, 0.7), (3, 0.5)],
-        ... "baz": [(2, 0.1)]}
-        >>> result = ii.process_query(["foo", "bar"])
-        >>> [(title, "%.1f" % term) for title, term in result]
-        [(3, '1.1'), (2, '0.7'), (1, '0.6')]
+		>>> ii.read_from_file("example.txt", b=0.75, k=1.75)
+		>>> result = ii.process_query(["animated"], b=0, k1=float("inf"))
+		>>> [(title, "%.3f" % term) for title, term in result]
+		[(1, '0.415'), (2, '0.415'), (4, '0.415')]
+		>>> ii.process_query(["film", "short"]) == ii.process_query(["short", "film"])
+		True
+		>>> ii.results.stats()
+		{'hits': 1, 'misses': 2, 'size': 2, 'max_size': 1024}
+		>>> ii.process_query(["anim*"]) == ii.process_query(["animated", "animation"])
+		True
+
+		>>> ii.read_from_file("example.txt", fuzzy=True)
+		>>> result = ii.process_query(["shrot", "film"])
+		>>> [(title, "%.3f" % term) for title, term in result]
+		[(4, '1.519'), (2, '0.969'), (3, '0.553')]
+		>>> result = ii.process_query(["short", "film"])
+		>>> [(title, "%.3f" % term) for title, term in result]
+		[(4, '2.176'), (3, '1.106'), (2, '0.969')]
+
+		>>> ii.read_from_file("example.txt", impacts=True)
+		>>> keywords = ["short", "movie", "film"]
+		>>> ii.process_query(keywords, k=2) == ii.process_query(keywords)[:2]
+		True
+		"""
+		keywords = sorted(keyword for keyword in query_Keywords if len(keyword) > 0)
+		phrases = tuple((tuple(words), slop) for words, slop in phrases) \
+			if self.positions is not None else ()
+		key = (tuple(keywords), k, b, k1, phrases)
+		generation = self.results.generation
+		result = self.results.get(key)
+		if (result is None):
+			result = self.rank(keywords, k, b, k1, phrases)
+			self.results.put(key, result, generation)
+		return list(result)
+
+	def rank(self, query_Keywords, k=None, b=None, k1=None, phrases=()):
+		"""
+		The result of process_query for the given keywords, without the cache.
 		"""
 		query_res = []
+		query_words = []
 
 		#If user enters nothing
 		if (len(query_Keywords) < 0):
 			return []
 
+		rescore = b is not None or k1 is not None
+		live = self.stale
+		if (rescore or live):
+			b = self.b if b is None else b
+			k1 = self.k if k1 is None else k1
+
+		if (any(map(is_wildcard, query_Keywords))):
+			query_Keywords = list(dict.fromkeys(chain.from_iterable(
+				self.expand(keyword) if is_wildcard(keyword) else [keyword]
+				for keyword in query_Keywords)))
+		weights = {}
+		if (self.fuzzy is not None):
+			query_Keywords, weights = self.correct(query_Keywords)
+
+		if (self.score_bits is not None and not (rescore or live)
+				and len(phrases) == 0 and len(weights) == 0):
+			return self.rank_quantized(query_Keywords, k)
+		if (k is not None and self.impacts is not None
+				and not (rescore or live) and len(phrases) == 0):
+			return self.rank_impacts(query_Keywords, weights, k)
+
 		for keyword in query_Keywords:
-			if (keyword in self.inverted_lists):
-				query_res.append(self.inverted_lists[keyword])
+			if (live):
+				inverted_list = self.live_postings(keyword, b, k1)
+				if (len(inverted_list) > 0):
+					query_res.append(inverted_list)
+					query_words.append(keyword)
+			elif (keyword in self.inverted_lists):
+				if (rescore):
+					query_res.append(self.score_postings(keyword, b, k1))
+				else:
+					query_res.append(self.inverted_lists[keyword])
+				query_words.append(keyword)
 
 		if (len(query_res) == 0):
 			return []
 
-		#Assigning first value to compute the merge with remaining
-		merged = query_res[0]
-		for i in range(1, len(query_res)):
-			merged = self.merge(merged, query_res[i])
-
-		# Filtering out 0 BM25 scores in list
-		filter_merged = []
-		for tuplee in merged:
-			if (tuplee != 0):
-				filter_merged.append(tuplee)
-		# print(filter_merged)
-		sorted_result = sorted(filter_merged, key = lambda rec:rec[1], reverse = True)
+		if (len(weights) > 0):
+			query_res = [[(record_id, score * weights[keyword])
+						  for record_id, score in inverted_list]
+						 if keyword in weights else inverted_list
+						 for keyword, inverted_list in zip(query_words, query_res)]
+
+		if (len(phrases) > 0):
+			return self.rank_phrases(query_res, query_words, phrases, k)
+
+		if (k is not None and (len(query_res) < WAND_MIN_TERMS or
+				sum(map(len, query_res)) < WAND_MIN_POSTINGS)):
+			return self.top_k_sums(query_res, k)
+		if (k is not None):
+			if (rescore or live):
+				max_scores = [max(score for _, score in inverted_list)
+							  for inverted_list in query_res]
+			else:
+				max_scores = [self.max_score(keyword, inverted_list)
+							  if keyword not in weights
+							  else max(score for _, score in inverted_list)
+							  for keyword, inverted_list
+							  in zip(query_words, query_res)]
+			return self.top_k(query_res, max_scores, k)
+
+		#Sum up the scores of all lists in one pass, then rank by score
+		#(ties by record id, as a stable sort of the merged list would).
+		scores = self.accumulate(query_res)
+		sorted_result = sorted(sorted(scores.items()), key = itemgetter(1),
+							   reverse = True)
 		return 	sorted_result
 
+	def rank_impacts(self, keywords, weights, k):
+		"""
+		The top-k of rank, score-at-a-time: the ImpactIndex gives the k best
+		records (and any tied with them) after reading only the highest
+		scores of the keywords' lists, see ImpactIndex.top_records. Their
+		scores are then summed from the lists in record order, in keyword
+		order, so the result equals that of top_k. Unlike top_k, the time
+		depends on how many high scores the lists have, not on their length.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt", impacts=True)
+		>>> result = ii.rank_impacts(["film", "short"], {}, 2)
+		>>> [(record_id, "%.3f" % score) for record_id, score in result]
+		[(4, '2.176'), (3, '1.106')]
+		"""
+		words = [word for word in keywords if self.term_ids.get(word) is not None]
+		if (len(words) == 0 or k <= 0):
+			return []
+		terms = [self.term_ids.get(word) for word in words]
+		record_ids = self.impacts.top_records(
+			terms, k, len(self.length_of_docs) + 1,
+			[weights.get(word, 1.0) for word in words], SCORE_SLACK)
+
+		scores = numpy.zeros(len(record_ids))
+		for word, term in zip(words, terms):
+			start = int(self.term_offsets[term])
+			end = int(self.term_offsets[term + 1])
+			term_ids = self.record_ids[start:end]
+			i = numpy.minimum(numpy.searchsorted(term_ids, record_ids),
+							  len(term_ids) - 1)
+			found = term_ids[i] == record_ids
+			term_scores = self.scores[start:end][i[found]]
+			if (word in weights):
+				term_scores = term_scores * weights[word]
+			scores[found] += term_scores
+		#A stable sort keeps ties by record id, as in the full ranking.
+		result = sorted(zip(record_ids.tolist(), scores.tolist()),
+						key=itemgetter(1), reverse=True)
+		return result[:k]
+
+	def rank_quantized(self, keywords, k=None):
+		"""
+		rank over quantized scores, with integers only and no tuples: the
+		postings of all keywords are concatenated, sorted by record id and
+		the integer scores of each record summed at once (a merge of all
+		lists in NumPy). Records are ranked by the sums, ties by record id,
+		and with k only the top-k are sorted. The scores are the sums times
+		the step.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt", quantize=16)
+		>>> result = ii.rank_quantized(["film", "short", "film"], 2)
+		>>> [(record_id, "%.3f" % score) for record_id, score in result]
+		[(4, '3.039'), (2, '1.938')]
+		"""
+		terms = [term for term in map(self.term_ids.get, keywords)
+				 if term is not None]
+		if (len(terms) == 0 or (k is not None and k <= 0)):
+			return []
+		spans = [(int(self.term_offsets[term]), int(self.term_offsets[term + 1]))
+				 for term in terms]
+		record_ids = numpy.concatenate(
+			[self.record_ids[start:end] for start, end in spans])
+		levels = numpy.concatenate(
+			[self.score_levels[start:end] for start, end in spans])
+		order = numpy.argsort(record_ids, kind="stable")
+		record_ids = record_ids[order]
+		if (len(terms) > 1):
+			#The first posting of each record (record ids start at 1)
+			changes = numpy.diff(record_ids, prepend=numpy.uint32(0))
+			starts = numpy.flatnonzero(changes != 0)
+		else:
+			starts = numpy.arange(len(record_ids))
+		sums = numpy.add.reduceat(levels[order].astype(numpy.int64), starts)
+		record_ids = record_ids[starts]
+
+		if (k is not None and k < len(sums)):
+			kept = sums >= numpy.partition(sums, -k)[-k]
+			record_ids, sums = record_ids[kept], sums[kept]
+		ranking = numpy.lexsort((record_ids, -sums))
+		if (k is not None):
+			ranking = ranking[:k]
+		scores = sums[ranking] * self.score_step
+		return list(zip(record_ids[ranking].tolist(), scores.tolist()))
+
+	def expand(self, pattern):
+		"""
+		The words of the index, including those of records added at runtime,
+		that match a pattern with wildcards (see expand_words).
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> ii.expand("*ed"), ii.expand("?o*")
+		(['animated'], ['movie', 'non'])
+		"""
+		with self.lock:
+			words = expand_words(self.inverted_lists, pattern)
+			regex = wildcard_regex(pattern)
+			for segment in self.segments:
+				words += filter(regex.fullmatch, segment.postings)
+		return sorted(set(words))[:MAX_EXPANSIONS]
+
+	def correct(self, keywords):
+		"""
+		The keywords, with each one (without wildcards) that is in no
+		inverted list replaced by the words of the FuzzyIndex closest to it,
+		and the weight of each replacement word: FUZZY_WEIGHT per edit. A
+		word that is a keyword itself keeps its full weight.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt", fuzzy=True)
+		>>> ii.correct(["short", "flim", "animatoin", "xyzzy"])
+		(['short', 'film', 'animation', 'xyzzy'], {'film': 0.5, 'animation': 0.5})
+		"""
+		with self.lock:
+			segments = self.segments
+		words, weights = [], {}
+		for keyword in keywords:
+			if (is_wildcard(keyword) or keyword in self.inverted_lists
+					or any(keyword in segment.postings for segment in segments)):
+				words.append(keyword)
+				continue
+			matches = self.fuzzy.closest(keyword)
+			if (len(matches) == 0):
+				words.append(keyword)
+			for word, distance in matches:
+				words.append(word)
+				weights[word] = max(weights.get(word, 0), FUZZY_WEIGHT ** distance)
+		for keyword in keywords:
+			weights.pop(keyword, None)
+		return list(dict.fromkeys(words)), weights
+
+	def rank_phrases(self, inverted_lists, words, phrases, k=None):
+		"""
+		Rank the records that contain all phrases, given the inverted lists
+		of the words. The candidates are the records in the lists of all
+		phrase words (intersected, shortest list first); only their
+		positions are checked. The matches are scored like accumulate does,
+		in list order, so they rank exactly as in the full ranking.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt", positions=True)
+		>>> [record_id for record_id, _ in ii.process_query(["short", "film"])]
+		[4, 3, 2]
+		>>> keywords, phrases = parse_query('"short film"')
+		>>> result = ii.process_query(keywords, phrases=phrases)
+		>>> result == ii.process_query(keywords)[:1]
+		True
+		>>> keywords, phrases = parse_query('"animated film"')
+		>>> result = ii.process_query(keywords, phrases=phrases)
+		>>> [record_id for record_id, _ in result]
+		[2]
+		>>> keywords, phrases = parse_query('"animated film"~1')
+		>>> result = ii.process_query(keywords, phrases=phrases)
+		>>> [record_id for record_id, _ in result]
+		[2, 4]
+		"""
+		record_id_of = itemgetter(0)
+
+		def find(inverted_list, record_id, start=0):
+			i = bisect_left(inverted_list, record_id, start, key=record_id_of)
+			return i, i < len(inverted_list) and inverted_list[i][0] == record_id
+
+		phrase_words = {word for phrase, _ in phrases for word in phrase}
+		if (not phrase_words <= set(words)):
+			return []
+		phrase_lists = sorted((inverted_lists[words.index(word)]
+							   for word in phrase_words), key=len)
+		candidates = [record_id for record_id, _ in phrase_lists[0]]
+		for inverted_list in phrase_lists[1:]:
+			kept, start = [], 0
+			for record_id in candidates:
+				start, found = find(inverted_list, record_id, start)
+				if (found):
+					kept.append(record_id)
+			candidates = kept
+
+		result = []
+		for record_id in self.positions.filter(candidates, phrases):
+			score = 0
+			for inverted_list in inverted_lists:
+				i, found = find(inverted_list, record_id)
+				if (found):
+					score += inverted_list[i][1]
+			result.append((record_id, score))
+		#A stable sort keeps ties by record id, as in the full ranking.
+		result.sort(key=itemgetter(1), reverse=True)
+		return result if k is None else result[:k]
+
+	def accumulate(self, inverted_lists):
+		"""
+		Sum the scores of each record over all given lists in a single pass,
+		term at a time. Scores are added in list order, exactly like folding
+		merge over the lists.
+
+		>>> ii = InvertedIndex()
+		>>> scores = ii.accumulate([[(1, 2.0), (5, 3.0)], [(1, 1.5), (2, 1.0)]])
+		>>> sorted(scores.items())
+		[(1, 3.5), (2, 1.0), (5, 3.0)]
+		"""
+		if (len(inverted_lists) == 0):
+			return {}
+		scores = dict(inverted_lists[0])
+		for inverted_list in inverted_lists[1:]:
+			for record_id, score in inverted_list:
+				if (record_id in scores):
+					scores[record_id] += score
+				else:
+					scores[record_id] = score
+		return scores
+
+	def merge_all(self, inverted_lists):
+		"""
+		Merge any number of lists at once; same result as folding merge.
+
+		>>> ii = InvertedIndex()
+		>>> merged = ii.merge_all([[(1, 2.1), (5, 3.2)], [(1, 1.7), (2, 1.3)],
+		...						[(5, 0.8)]])
+		>>> [(title, "%.1f" % term) for title, term in merged]
+		[(1, '3.8'), (2, '1.3'), (5, '4.0')]
+		"""
+		return sorted(self.accumulate(inverted_lists).items())
+
+	def max_score(self, word, inverted_list):
+		"""
+		The largest score in the inverted list of the given word. Computed at
+		build time, or on first use (e.g. for a loaded index).
+		"""
+		if (word not in self.max_scores):
+			self.max_scores[word] = max(score for _, score in inverted_list)
+		return self.max_scores[word]
+
+	def top_k(self, inverted_lists, max_scores, k):
+		"""
+		The k records with the highest score sums, by WAND: the lists are kept
+		ordered by their current record id, and a record is only scored if the
+		max scores of all lists up to it can beat the current k-th best score.
+		All other lists are moved past it by binary search. Ties are broken
+		by smaller record id first, as in the (stable) full ranking.
+		Each step only takes out and puts back the lists that moved. Once
+		they moved by more than one in WAND_MOVE_RATIO of all postings, too
+		little is skipped, and the rest is done by top_k_sums.
+
+		>>> ii = InvertedIndex()
+		>>> lists = [[(1, 0.2), (3, 0.6), (8, 0.1)], [(2, 0.7), (3, 0.5)]]
+		>>> ii.top_k(lists, [0.6, 0.7], 2)
+		[(3, 1.1), (2, 0.7)]
+		>>> ii.top_k(lists, [0.6, 0.7], 0)
+		[]
+		>>> lists = [[(i, 0.1) for i in range(1, 200)], [(7, 2.0), (50, 3.0)]]
+		>>> ii.top_k(lists, [0.1, 3.0], 1)
+		[(50, 3.1)]
+		"""
+		if (k <= 0):
+			return []
+		heap = []  # The best (score, -record_id) so far, the worst on top.
+		positions = [0] * len(inverted_lists)
+		record_id_of = itemgetter(0)
+		# The (current record id, list) of each list not at its end, in order.
+		cursors = sorted((inverted_list[0][0], i)
+			for i, inverted_list in enumerate(inverted_lists) if len(inverted_list) > 0)
+		threshold = None
+		budget = sum(map(len, inverted_lists)) // WAND_MOVE_RATIO
+
+		while (len(cursors) > 0):
+			# Find the first list at which the score upper bound beats the
+			# threshold; its record is the pivot.
+			upper_bound = 0
+			pivot = None
+			for j, (_, i) in enumerate(cursors):
+				upper_bound += max_scores[i]
+				if (threshold is None or upper_bound + SCORE_SLACK > threshold):
+					pivot = j
+					break
+			if (pivot is None):
+				break
+			pivot_id = cursors[pivot][0]
+
+			if (cursors[0][0] == pivot_id):
+				# All lists before the pivot are on it: score it fully, in
+				# keyword order (as merge does), which is their order here.
+				moved = cursors[:bisect_left(cursors, (pivot_id + 1,))]
+				score = 0
+				for _, i in moved:
+					score += inverted_lists[i][positions[i]][1]
+					positions[i] += 1
+				if (threshold is None):
+					heapq.heappush(heap, (score, -pivot_id))
+				elif (score > threshold):
+					heapq.heapreplace(heap, (score, -pivot_id))
+				if (len(heap) == k):
+					threshold = heap[0][0]
+			else:
+				# Skip the lists before the pivot to the pivot record.
+				moved = cursors[:pivot]
+				for _, i in moved:
+					positions[i] = bisect_left(inverted_lists[i], pivot_id,
+						positions[i], key=record_id_of)
+			del cursors[:len(moved)]
+			budget -= len(moved)
+			if (budget < 0):
+				return self.top_k_sums(inverted_lists, k)
+			for _, i in moved:
+				if (positions[i] < len(inverted_lists[i])):
+					insort(cursors, (inverted_lists[i][positions[i]][0], i))
+
+		return [(-neg_id, score) for score, neg_id in sorted(heap, reverse=True)]
+
+	def top_k_sums(self, inverted_lists, k):
+		"""
+		The k records with the highest score sums, like top_k, from the sums
+		of all scores (see accumulate).
+
+		>>> ii = InvertedIndex()
+		>>> lists = [[(1, 0.2), (3, 0.6), (8, 0.1)], [(2, 0.7), (3, 0.5)]]
+		>>> ii.top_k_sums(lists, 2), ii.top_k_sums(lists, 0)
+		([(3, 1.1), (2, 0.7)], [])
+		"""
+		scores = self.accumulate(inverted_lists)
+		return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+	def add_document(self, record):
+		"""
+		Add a record (a line of the corpus) at runtime and return its id. It
+		goes to the newest in-memory segment; once there are MERGE_SEGMENTS
+		full ones, they are merged in a background thread (see compact).
+		From then on, queries score their lists with the statistics of all
+		records that are not deleted, so they rank exactly like an index
+		rebuilt from these records.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> ii.add_document("Movie\\tAn animated film.")
+		5
+		>>> ii.delete_document(2)
+		>>> import os, tempfile
+		>>> file_name = os.path.join(tempfile.mkdtemp(), "records.txt")
+		>>> with open(file_name, "w") as file:
+		...     print("\\n".join(ii.documents.get_all([1, 3, 4, 5])), file=file)
+		>>> rebuilt = InvertedIndex()
+		>>> rebuilt.read_from_file(file_name)
+		>>> expected = [([1, 3, 4, 5][i - 1], score) for i, score in
+		...     rebuilt.process_query(["animated", "film"])]
+		>>> ii.process_query(["animated", "film"]) == expected
+		True
+		>>> ii.compact(full=True)
+		>>> ii.process_query(["animated", "film"]) == expected
+		True
+		"""
+		words = self.tokenizer.tokens(record)
+		term_freqs = count_terms(words)
+		with self.lock:
+			if (len(self.segments) == 0
+					or len(self.segments[-1]) >= SEGMENT_SIZE):
+				#Replace the list, so queries can keep using the old one
+				self.segments = self.segments + [
+					MemorySegment(len(self.documents) + 1)]
+				if (len(self.segments) > MERGE_SEGMENTS
+						and (self.compaction is None
+							 or not self.compaction.is_alive())):
+					self.compaction = threading.Thread(target=self.compact,
+													   daemon=True)
+					self.compaction.start()
+			record_id = self.segments[-1].add(term_freqs)
+			if (self.positions is not None):
+				self.positions.add(record_id, words)
+			self.documents.append(record.rstrip("\r\n"))
+			self.stale = True
+			self.results.clear()
+			self.set_stats(self.num_docs + 1,
+						   self.total_length + sum(term_freqs.values()))
+		return record_id
+
+	def delete_document(self, record_id):
+		"""
+		Delete the record with the given id at runtime. It is marked as
+		deleted (a tombstone): it is left out of query results and of the
+		statistics, and its postings are dropped by compact.
+		"""
+		with self.lock:
+			if (record_id < 1 or record_id > len(self.documents)
+					or record_id in self.deleted):
+				raise KeyError(record_id)
+			self.deleted = self.deleted | {record_id}
+			self.stale = True
+			self.results.clear()
+			self.set_stats(self.num_docs - 1,
+						   self.total_length - self.doc_length(record_id))
+
+	def compact(self, full = False):
+		"""
+		Merge the full in-memory segments into one, leaving out the postings
+		of deleted records. Queries keep using the old segments until the new
+		one is in place. With full, merge all segments into the main index
+		and score it instead (queries wait meanwhile); then queries use the
+		precomputed scores again.
+		"""
+		with self.compaction_lock:
+			if (full):
+				with self.lock:
+					if (self.stale):
+						self.merge_into_main()
+				return
+
+			with self.lock:
+				segments = self.segments[:-1]
+				deleted = self.deleted
+			if (len(segments) < 2):
+				return
+			merged = MemorySegment.merge(segments, deleted)
+			with self.lock:
+				self.segments = [merged] + self.segments[len(segments):]
+
+	def merge_into_main(self):
+		"""
+		Append the postings of all segments to the raw columns, drop those of
+		deleted records, and score the result.
+		"""
+		terms = list(self.terms)
+		term_ids = {word: i for i, word in enumerate(terms)}
+		term_columns = [numpy.repeat(numpy.arange(len(terms), dtype=numpy.int64),
+									 numpy.diff(self.term_offsets).astype(numpy.int64))]
+		id_columns = [numpy.asarray(self.record_ids, dtype=numpy.uint32)]
+		freq_columns = [numpy.asarray(self.term_freqs, dtype=numpy.uint32)]
+		length_columns = [numpy.asarray(self.length_of_docs, dtype=numpy.uint32)]
+		for segment in self.segments:
+			for word, (record_ids, term_freqs) in segment.postings.items():
+				term_id = term_ids.setdefault(word, len(term_ids))
+				term_columns.append(numpy.full(len(record_ids), term_id,
+											   dtype=numpy.int64))
+				id_columns.append(numpy.array(record_ids, dtype=numpy.uint32))
+				freq_columns.append(numpy.array(term_freqs, dtype=numpy.uint32))
+			length_columns.append(numpy.array(segment.length_of_docs,
+											  dtype=numpy.uint32))
+
+		term_column = numpy.concatenate(term_columns)
+		record_ids = numpy.concatenate(id_columns)
+		term_freqs = numpy.concatenate(freq_columns)
+		if (len(self.deleted) > 0):
+			live = ~numpy.isin(record_ids, numpy.fromiter(
+				self.deleted, dtype=numpy.uint32, count=len(self.deleted)))
+			term_column, record_ids = term_column[live], record_ids[live]
+			term_freqs = term_freqs[live]
+		self.set_columns(list(term_ids), term_column, record_ids, term_freqs)
+		self.length_of_docs = numpy.concatenate(length_columns)
+		self.segments = []
+		self.stale = False
+		self.score(self.b, self.k)
+		if (self.fuzzy is not None):
+			self.fuzzy = FuzzyIndex.build(self.terms)
+
+	def build_streaming(self, file_name, index_file, memory_limit,
+						b = None, k = None, verbose = False):
+		"""
+		Build the index of a file that need not fit in memory directly into
+		index_file, then load it from there. Postings are buffered until
+		their estimated size reaches memory_limit bytes and then written to
+		disk as a run sorted by term (see write_runs). The runs are merged
+		term by term into the segment (see merge_runs), so only one inverted
+		list is in memory at a time, besides the length and offset of every
+		record. Gives the same index as read_from_file followed by save.
+
+		>>> import os, tempfile
+		>>> file_name = os.path.join(tempfile.mkdtemp(), "example.idx")
+		>>> ii = InvertedIndex()
+		>>> ii.build_streaming("example.txt", file_name, memory_limit=1000)
+		>>> ii2 = InvertedIndex()
+		>>> ii2.read_from_file("example.txt")
+		>>> sorted(ii.inverted_lists.items()) == sorted(ii2.inverted_lists.items())
+		True
+		>>> ii.process_query(["short", "film"]) == ii2.process_query(["short", "film"])
+		True
+		>>> empty_file = os.path.join(os.path.dirname(file_name), "empty.txt")
+		>>> open(empty_file, "w").close()
+		>>> ii.build_streaming(empty_file, file_name, memory_limit=1000)
+		>>> len(ii.inverted_lists), ii.avdl, ii.process_query(["film"])
+		(0, 0.0, [])
+		"""
+		if (b == None):	#Setting b and k values
+			b = 0.75
+			k = 1.75
+		run_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(index_file)))
+		try:
+			runs = self.write_runs(file_name, run_dir, memory_limit)
+			if (verbose):
+				print("%d records, %d runs, peak RSS %.1f MB" % (len(self.documents),
+					  len(runs), peak_rss() / 2**20), file=sys.stderr)
+			self.merge_runs(runs, index_file, b, k)
+		finally:
+			shutil.rmtree(run_dir)
+		if (verbose):
+			print("Index written, peak RSS %.1f MB" % (peak_rss() / 2**20),
+				  file=sys.stderr)
+		self.load(index_file)
+
+	def write_runs(self, file_name, run_dir, memory_limit):
+		"""
+		First pass of build_streaming: read the records and whenever the
+		buffered postings reach memory_limit bytes (estimated), write them
+		to a new run file in run_dir. Return the run files in record order.
+		"""
+		self.documents = DocumentStore()
+		self.length_of_docs = array("I")
+		runs = []
+		postings, buffered_bytes = {}, 0
+		record_id = 0
+		for line in self.documents.read_lines(file_name):
+			record_id += 1
+			term_freqs = count_terms(self.tokenizer.tokens(line))
+			self.length_of_docs.append(sum(term_freqs.values()))
+
+			for word, term_freq in term_freqs.items():
+				columns = postings.get(word)
+				if (columns is None):
+					columns = postings[word] = (array("I"), array("I"))
+					buffered_bytes += WORD_BYTES + len(word)
+				columns[0].append(record_id)
+				columns[1].append(term_freq)
+			buffered_bytes += POSTING_BYTES * len(term_freqs)
+
+			if (buffered_bytes >= memory_limit):
+				runs.append(os.path.join(run_dir, "run%d" % len(runs)))
+				write_run(postings, runs[-1])
+				postings, buffered_bytes = {}, 0
+		if (len(postings) > 0):
+			runs.append(os.path.join(run_dir, "run%d" % len(runs)))
+			write_run(postings, runs[-1])
+		return runs
+
+	def merge_runs(self, runs, index_file, b, k):
+		"""
+		Second pass of build_streaming: k-way merge of the (memory-mapped)
+		runs by term. The postings of a term are concatenated in run order,
+		scored and appended to the segment, which is written like save does.
+		"""
+		length_of_docs = numpy.asarray(self.length_of_docs, dtype=numpy.float64)
+		n = len(length_of_docs)
+		avdl = length_of_docs.sum() / n if n > 0 else 0.0
+
+		runs = [read_segment(run, RUN_MAGIC) for run in runs]
+		#The terms of each run, decoded one block at a time.
+		run_terms = [Lexicon(run["terms"], run["term_offsets"]).terms() for run in runs]
+		heap = []
+		for r, terms in enumerate(run_terms):
+			term = next(terms, None)
+			if (term is not None):
+				heap.append((term, r, 0))
+		heapq.heapify(heap)
+
+		segment = SegmentWriter(index_file, SEGMENT_MAGIC, {
+			"terms": "B", "term_offsets": "Q", "posting_offsets": "Q",
+			"ids": "I", "tfs": "I", "scores": "d", "bm25_params": "d",
+			"length_of_docs": "I", "deleted": "I", "doc_blocks": "B",
+			"doc_offsets": "Q", "doc_count": "Q", "tokenizer": "B"})
+		encoder = LexiconEncoder()
+		term_offset = posting_offset = 0
+		segment.append("posting_offsets", array("Q", [0]))
+		while (len(heap) > 0):
+			term = heap[0][0]
+			ids, tfs = [], []
+			while (len(heap) > 0 and heap[0][0] == term):
+				_, r, i = heap[0]
+				start, end = runs[r]["posting_offsets"][i:i + 2]
+				ids.append(runs[r]["ids"][start:end])
+				tfs.append(runs[r]["tfs"][start:end])
+				next_term = next(run_terms[r], None)
+				if (next_term is not None):
+					heapq.heapreplace(heap, (next_term, r, i + 1))
+				else:
+					heapq.heappop(heap)
+			ids = numpy.concatenate(ids)
+			tfs = numpy.concatenate(tfs)
+
+			idf = math.log(n / len(ids) , 2)
+			doc_lengths = length_of_docs[ids.astype(numpy.int64) - 1]
+			scores = bm25_scores(tfs, doc_lengths, idf, avdl, b, k)
+
+			if (encoder.starts_block()):
+				segment.append("term_offsets", array("Q", [term_offset]))
+			code = encoder.encode(term)
+			term_offset += len(code)
+			posting_offset += len(ids)
+			segment.append("terms", code)
+			segment.append("posting_offsets", array("Q", [posting_offset]))
+			segment.append("ids", ids)
+			segment.append("tfs", tfs)
+			segment.append("scores", scores)
+
+		segment.append("term_offsets", array("Q", [term_offset]))
+		segment.append("bm25_params", array("d", [b, k]))
+		segment.append("length_of_docs", self.length_of_docs)
+		doc_offset = 0
+		segment.append("doc_offsets", array("Q", [0]))
+		for block in self.documents.compressed_blocks():
+			doc_offset += len(block)
+			segment.append("doc_blocks", block)
+			segment.append("doc_offsets", array("Q", [doc_offset]))
+		segment.append("doc_count", array("Q", [len(self.documents)]))
+		segment.append("tokenizer", self.tokenizer.to_config())
+		segment.close()
+
+	def save(self, file_name):
+		"""
+		Write the index to a binary segment: the sorted lexicon, the offsets
+		of each inverted list into contiguous arrays of record ids, term
+		frequencies and BM25 scores, the BM25 parameters, the document
+		lengths, the records, compressed, and the options of the tokenizer.
+
+		>>> import os, tempfile
+		>>> file_name = os.path.join(tempfile.mkdtemp(), "example.idx")
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> ii.save(file_name)
+		>>> ii2 = InvertedIndex()
+		>>> ii2.load(file_name)
+		>>> sorted(ii2.inverted_lists.items()) == sorted(ii.inverted_lists.items())
+		True
+		>>> ii2.process_query(["short", "film"]) == ii.process_query(["short", "film"])
+		True
+		>>> ii2.documents.get(3) == ii.documents.get(3)
+		True
+		>>> ii2.process_query(["film"], b=0.5) == ii.process_query(["film"], b=0.5)
+		True
+		"""
+
+		if (self.stale):
+			self.compact(full=True)
+
+		#The columns are sorted by term, so they are written as they are.
+		arrays = {
+			"terms": self.terms.blob, "term_offsets": self.terms.offsets,
+			"posting_offsets": array("Q", self.term_offsets.tolist()),
+			"ids": numpy.asarray(self.record_ids, dtype=numpy.uint32),
+			"tfs": numpy.asarray(self.term_freqs, dtype=numpy.uint32),
+			"bm25_params": array("d", [self.b, self.k]),
+			"length_of_docs": numpy.asarray(self.length_of_docs, dtype=numpy.uint32),
+			"deleted": array("I", sorted(self.deleted))}
+		arrays.update(self.score_arrays())
+		arrays.update(self.documents.to_arrays())
+		arrays["tokenizer"] = self.tokenizer.to_config()
+		if (self.positions is not None):
+			arrays.update(self.positions.to_arrays())
+		if (self.fuzzy is not None):
+			arrays.update(self.fuzzy.to_arrays())
+		if (self.impacts is not None):
+			arrays.update(self.impacts.to_arrays())
+		write_segment(file_name, SEGMENT_MAGIC, arrays)
+
+	def load(self, file_name):
+		"""
+		Memory-map an index written by save. Nothing is read or decoded up
+		front, so this takes constant time and processes loading the same
+		file share its pages.
+		"""
+
+		arrays = read_segment(file_name, SEGMENT_MAGIC)
+		self.segments, self.stale = [], False
+		self.results.clear()
+		self.deleted = frozenset(arrays["deleted"].tolist()
+								 if "deleted" in arrays else ())
+		self.inverted_lists = SegmentInvertedLists(arrays)
+		self.max_scores = {}
+		self.length_of_docs = numpy.asarray(arrays["length_of_docs"])
+		self.documents = DocumentStore.from_arrays(arrays)
+		self.tokenizer = (Tokenizer.from_config(arrays["tokenizer"])
+						  if "tokenizer" in arrays else Tokenizer())
+		self.positions = (PositionIndex.from_arrays(arrays)
+						  if "pos_ids" in arrays else None)
+		self.fuzzy = (FuzzyIndex.from_arrays(arrays)
+					  if "fuzzy_entries" in arrays else None)
+		self.impacts = (ImpactIndex.from_arrays(arrays)
+						if "impact_ids" in arrays else None)
+
+		#Raw postings, for scoring with other BM25 parameters
+		self.terms = self.term_ids = self.inverted_lists.lexicon
+		self.term_offsets = numpy.asarray(arrays["posting_offsets"])
+		self.record_ids = numpy.asarray(arrays["ids"])
+		self.term_freqs = numpy.asarray(arrays["tfs"])
+		if ("score_levels" in arrays):
+			self.scores = None
+			self.score_levels = numpy.asarray(arrays["score_levels"])
+			self.score_step = arrays["score_step"][0]
+			self.score_bits = 8 * self.score_levels.itemsize
+		else:
+			self.scores = numpy.asarray(arrays["scores"])
+			self.score_bits = None
+		self.b, self.k = arrays["bm25_params"]
+		self.count_live()
 
 	def render_output(self, result, keywords, k=3):
 	        """
@@ -184,7 +1781,7 @@ class InvertedIndex:
 	        # Output at most k matching records.
 	        for i in range(min(len(result), k)):
 	        	record_id, term_freq = result[i]
-	        	title, desc = self.records[record_id - 1]  # ids are 1-based.
+	        	title, desc = self.documents.get(record_id).split("\t")
 
 	            # Highlight the keywords in the title in bold and red.
 	        	#title = re.sub(p, "\033[0m\033[1;31m\\1\033[0m\033[1m", title)
@@ -201,29 +1798,138 @@ class InvertedIndex:
 
 if __name__ == "__main__":
 
-	if (len(sys.argv) < 2):
-		print ("Usage: python3 inverted_index.py <file> [Optional:<b> <k>] ")
+	#Options of the form --name=value
+	options = {}
+	for arg in sys.argv[1:]:
+		if (arg.startswith("--")):
+			name, _, value = arg[2:].partition("=")
+			options[name] = value
+			sys.argv.remove(arg)
+
+	error = check_arguments(sys.argv, options)
+	if (error is not None):
+		print ("Error: %s." % error)
+		print ("Usage: python3 inverted_index.py <file> [Optional:<b> <k>]"
+			   " [Optional:<index-file>] [Optional:--memory-limit=<MB>]")
+		print ("       [Optional:--processes=<n>] [Optional:--batch=<query-file>"
+			   " [--format=tsv|jsonl] [--top=<n>]] [Optional:--metrics=<json-file>]")
+		print ("       [Optional:--positions]"
+			   " [Optional:--fuzzy] [Optional:--impacts]"
+			   " [Optional:--quantize=8|16] [Optional:--stopwords] [Optional:--stem]")
+		print ("The index is loaded from <index-file> if it exists, otherwise built"
+			   " from <file> and saved there.")
+		print ("With --processes=<n>, the index is built by n processes (default 1)"
+			   " and the --batch queries are answered by n processes (default the")
+		print ("number of CPUs).")
+		print ("With --memory-limit, the index is built on disk using at most about"
+			   " that much memory for postings (needs <index-file>).")
+		print ("With --batch, the queries of <query-file> (one per line) are"
+			   " answered by a pool of processes sharing the memory-mapped"
+			   " <index-file>;")
+		print ("the top-n results (default %d) are written to stdout as"
+			   " TSV (query, rank, record id, score) or JSON lines, the"
+			   " throughput and latencies to stderr." % BATCH_K)
+		print ("With --positions, the index keeps the positions of the words, for"
+			   " \"phrase\" and \"proximity\"~<n> queries (not with --memory-limit).")
+		print ("Query words may contain wildcards: * for any string, ? for any one"
+			   " character.")
+		print ("With --fuzzy, a query word that is not in the index is replaced by"
+			   " the words closest to it, within two typos, with lower scores (not"
+			   " with --memory-limit).")
+		print ("With --impacts, the postings are also kept in order of score, so"
+			   " top-n queries stop once the top n are known (not with"
+			   " --memory-limit).")
+		print ("With --quantize, the scores are kept as 8- or 16-bit integers and"
+			   " summed as such, in less memory and time (not with --memory-limit,")
+		print ("--impacts or --shards).")
+		print ("With --stopwords, very frequent English words are left out, and with"
+			   " --stem, plurals are reduced to the singular; a loaded index keeps"
+			   " the options it was built with.")
+		print ("With --metrics, the time spent per stage, counters and the query"
+			   " latency histogram of this process are written to <json-file> after"
+			   " the build and after each query.")
+		print ("With --shards=<n>, the records of <file> are split into n shards,"
+			   " each indexed and queried in its own process (not with <index-file>,")
+		print ("--memory-limit, --metrics or --fuzzy); the time each shard spends on"
+			   " a query is printed, and with --batch its latencies too.")
 		sys.exit()
 
+	#Optional RAM cap in MB for building the index on disk
+	memory_limit = None
+	if ("memory-limit" in options):
+		memory_limit = float(options["memory-limit"]) * 2**20
+	batch_file = options.get("batch")
+	metrics_file = options.get("metrics")
+	shards = int(options["shards"]) if "shards" in options else None
+	quantize = int(options["quantize"]) if "quantize" in options else None
+	#In batch mode stdout holds the results only
+	log = sys.stderr if batch_file is not None else sys.stdout
+
 	file_name = sys.argv[1]
-	if (len(sys.argv) > 2):
+	if (len(sys.argv) > 3):
 		b = float(sys.argv[2])
 		k = float(sys.argv[3])
 	else:
 		b = None
 		k = None
+	index_file = sys.argv[-1] if len(sys.argv) in (3, 5) else None
 
-	print("Reading from file  '%s' ." %file_name) 
-	ii = InvertedIndex()
-	ii.read_from_file(file_name)
+	tokenizer = Tokenizer(
+		stopwords=STOPWORDS if "stopwords" in options else (),
+		stem=(options["stem"] or "plural") if "stem" in options else None)
+	ii = InvertedIndex(tokenizer=tokenizer)
+	if (metrics_file is not None):
+		ii.enable_metrics()
+	if (shards is not None):
+		#Imported here, as shards imports this module
+		from shards import ShardedIndex, report_shards
+		from shards import run_batch as run_sharded_batch
+		print("Reading from file  '%s' into %d shards ." %(file_name, shards), file=log)
+		ii = ShardedIndex(shards, tokenizer=tokenizer)
+		ii.read_from_file(file_name, b, k, positions="positions" in options,
+			impacts="impacts" in options)
+	elif (index_file is not None and os.path.exists(index_file)):
+		print("Loading index from '%s' ." %index_file, file=log)
+		ii.load(index_file)
+	else:
+		print("Reading from file  '%s' ." %file_name, file=log) 
+		if (memory_limit is not None):
+			ii.build_streaming(file_name, index_file, memory_limit, b, k, verbose=True)
+		else:
+			ii.read_from_file(file_name, b, k,
+				processes=int(options.get("processes", 1)),
+				positions="positions" in options, fuzzy="fuzzy" in options,
+				impacts="impacts" in options, quantize=quantize)
+			if (index_file is not None):
+				ii.save(index_file)
 
-	print("Inverted Index, BM25 Scores calculated.\n")
+	print("Inverted Index, BM25 Scores calculated.\n", file=log)
+	if (metrics_file is not None):
+		ii.metrics.dump(metrics_file)
+
+	if (batch_file is not None):
+		write = result_writer(options.get("format", "tsv"), batch_tsv)
+		answer = partial(batch_query, k=int(options.get("top", BATCH_K)))
+		if (shards is not None):
+			stats = run_sharded_batch(ii, answer, batch_file, write)
+			ii.close()
+			report_stats(stats)
+			report_shards(stats)
+			sys.exit()
+		del ii
+		processes = int(options.get("processes", os.cpu_count()))
+		stats = run_batch(InvertedIndex, index_file, answer, batch_file, write,
+						  processes)
+		report_stats(stats)
+		sys.exit()
 
 	while (True):
 	 	input_query = input("Please Enter the keyword query: ")
 
-	 	keywords = [x.lower().strip() for x in re.split("[^A-Za-z]+", input_query)]
+	 	keywords, phrases = parse_query(input_query, ii.tokenizer)
 	 	print(keywords)
-	 	result	= ii.process_query(keywords)
+	 	result	= ii.process_query(keywords, phrases=phrases)
 	 	#print(result)
 	 	ii.render_output(result, keywords)
+	 	if (metrics_file is not None):
+	 		ii.metrics.dump(metrics_file)
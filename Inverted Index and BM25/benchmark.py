@@ -0,0 +1,125 @@
+import os
+import random
+import sys
+import time
+from operator import itemgetter
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				os.pardir, "common"))
+
+from batch import batch_stats
+from bench import bench_index, print_suite_usage, run_suite, time_fuzzy
+from impacts import ImpactIndex
+from Inverted_Index import InvertedIndex
+from synthetic import make_queries
+
+# Number of results of the top-k queries of the suite.
+SUITE_K = 10
+
+
+def random_list(num_records, density):
+	""" A sorted inverted list, each record picked with the given probability. """
+
+	return [(i, random.random()) for i in range(1, num_records + 1)
+			if random.random() < density]
+
+
+def best_time(function, arguments, repeats=3):
+	""" Best wall time of calling the function on all arguments, in seconds. """
+
+	best = float("inf")
+	for _ in range(repeats):
+		start = time.perf_counter()
+		for argument in arguments:
+			function(argument)
+		best = min(best, time.perf_counter() - start)
+	return best
+
+
+def bench_merge(num_records, num_queries=10):
+	"""
+	Compare ranking by folding merge over the lists of a query (as
+	process_query used to) with the single-pass accumulation, for queries
+	of 2 to 10 terms.
+	"""
+
+	ii = InvertedIndex()
+
+	def fold(inverted_lists):
+		merged = inverted_lists[0]
+		for inverted_list in inverted_lists[1:]:
+			merged = ii.merge(merged, inverted_list)
+		return sorted(merged, key=lambda rec: rec[1], reverse=True)
+
+	def single_pass(inverted_lists):
+		scores = ii.accumulate(inverted_lists)
+		return sorted(sorted(scores.items()), key=itemgetter(1), reverse=True)
+
+	densities = [0.3, 0.1, 0.03, 0.01, 0.003]
+	pool = [random_list(num_records, random.choice(densities))
+			for _ in range(30)]
+
+	print("%-6s %12s %12s %12s %8s" % ("terms", "postings", "fold",
+		  "single pass", "speedup"))
+	for num_terms in range(2, 11):
+		queries = [random.sample(pool, num_terms) for _ in range(num_queries)]
+		postings = sum(len(x) for query in queries for x in query)
+		fold_time = best_time(fold, queries)
+		merge_time = best_time(single_pass, queries)
+		assert all(fold(query) == single_pass(query) for query in queries)
+		print("%-6d %12d %11.3fs %11.3fs %7.1fx" % (num_terms, postings,
+			  fold_time, merge_time, fold_time / merge_time))
+
+
+def bench_scale(num_records, num_queries, directory):
+	"""
+	The rows of bench_index for the BM25 index of a synthetic corpus with
+	num_records records, and the latencies of num_queries synthetic
+	queries on the loaded index (without the result cache), for the top
+	SUITE_K, for the full ranking and for the top SUITE_K with an
+	ImpactIndex (built on the loaded index), and of the FuzzyIndex of its
+	words. Run in a fresh process by bench_suite.
+	"""
+
+	result, ii = bench_index(InvertedIndex, "bm25", num_records, directory)
+	queries = [ii.tokenizer.tokens(query) for query in make_queries(num_queries)]
+	for name, k in (("top_k", SUITE_K), ("ranked", None),
+					("top_k_impacts", SUITE_K)):
+		if (name == "top_k_impacts"):
+			start = time.perf_counter()
+			ii.impacts = ImpactIndex.build(ii.term_offsets, ii.record_ids,
+										   ii.scores)
+			result["impacts_build_seconds"] = round(
+				time.perf_counter() - start, 3)
+		latencies = []
+		start = time.perf_counter()
+		for keywords in queries:
+			query_start = time.perf_counter()
+			ii.process_query(keywords, k=k)
+			latencies.append(time.perf_counter() - query_start)
+		result[name] = batch_stats(latencies, time.perf_counter() - start)
+	result["fuzzy"] = time_fuzzy(ii.terms, num_queries)
+	return result
+
+
+if __name__ == "__main__":
+	# Options of the form --name=value.
+	options = {}
+	for arg in sys.argv[1:]:
+		if (arg.startswith("--")):
+			name, _, value = arg[2:].partition("=")
+			options[name] = value
+			sys.argv.remove(arg)
+
+	if (len(sys.argv) > 2 or (options and len(sys.argv) > 1)):
+		print("Usage: python3 benchmark.py [<num_records>]")
+		print_suite_usage()
+		sys.exit(1)
+
+	if ("suite" in options):
+		sys.exit(run_suite(bench_scale, options))
+
+	num_records = int(sys.argv[1]) if len(sys.argv) == 2 else 100000
+	random.seed(0)
+	bench_merge(num_records)
@@ -1,7 +1,43 @@
-import re
+import math
+import os
 import sys
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				os.pardir, "common"))
+
+import batch
+from Inverted_Index import InvertedIndex
+
+# Benchmark queries per task of a worker process.
+CHUNK_SIZE = 16
+
+# Names of the values returned by Evaluation.metrics (for P@k with k = 3).
+METRICS = ("P@3", "P@R", "AP", "nDCG", "RR")
+
+
+def ranked_ids(inverted_index, query, b=None, k1=None):
+	""" The record ids of the full ranking of a benchmark query. """
+	keywords = inverted_index.tokenizer.tokens(query)
+	result = inverted_index.process_query(keywords, b=b, k1=k1)
+	return [doc_id for doc_id, score in result]
+
+
+def evaluate_chunk(items, b=None, k1=None, inverted_index=None):
+	"""
+	The metrics of each (query, relevant docs) item. Runs in a worker
+	process, on the index loaded by batch.start_worker unless one is given.
+	"""
+	if (inverted_index is None):
+		inverted_index = batch.worker_index
+	eeval = Evaluation()
+	return [eeval.metrics(ranked_ids(inverted_index, query, b, k1), relevant_docs)
+			for query, relevant_docs in items]
 
-from test import  InvertedIndex
 
 class Evaluation:
 
@@ -46,17 +82,69 @@ class Evaluation:
 		>>> eval.average_precision([7, 17, 9, 42, 5], {5, 7, 12, 42})
 		0.525
 		"""
-		total_avg_prec = 0
+		return self.metrics(result_ids, relevant_docs)[2]
 
-		for i in range(0, len(result_ids)):
-			if result_ids[i] in relevant_docs:
-				total_avg_prec += self.precision_at_k(result_ids, relevant_docs, i + 1)
-				# print(total_avg_prec)
-		total_avg_prec /= len(relevant_docs)
-		return total_avg_prec
+	def metrics(self, result_ids, relevant_docs, k=3):
+		"""
+		P@k, P@R, average precision, nDCG (binary relevance) and reciprocal
+		rank of one ranked list, in one pass over it. The pass stops at the
+		last relevant doc, since no later rank changes any of the values.
 
-	def evaluate(self, inverted_index, benchmark_query):
+		>>> eval = Evaluation()
+		>>> [round(x, 3) for x in eval.metrics([7, 17, 9, 42, 5], {5, 7, 12, 42})]
+		[0.333, 0.5, 0.525, 0.71, 1.0]
+		>>> eval.metrics([1, 2], {3})
+		(0.0, 0.0, 0.0, 0.0, 0)
 		"""
+		# The ranks (from 1) of the relevant docs in the list.
+		ranks = []
+		r = len(relevant_docs)
+		for rank, doc_id in enumerate(result_ids, 1):
+			if doc_id in relevant_docs:
+				ranks.append(rank)
+				if (len(ranks) == r):
+					break
+
+		precision_at_k = bisect_right(ranks, k) / k if k > 0 else 0
+		precision_at_r = bisect_right(ranks, r) / r
+		avg_precision = sum(i / rank for i, rank in enumerate(ranks, 1)) / r
+		dcg = sum(1 / math.log2(rank + 1) for rank in ranks)
+		ideal_dcg = sum(1 / math.log2(rank + 1) for rank in range(1, r + 1))
+		reciprocal_rank = 1 / ranks[0] if ranks else 0
+		return (precision_at_k, precision_at_r, avg_precision, dcg / ideal_dcg,
+				reciprocal_rank)
+
+	def evaluate_queries(self, inverted_index, benchmark_query, b=None, k1=None,
+						 executor=None):
+		"""
+		The metrics of each benchmark query, as (query, metrics) in the order
+		of the benchmark. With an executor whose workers were started with
+		batch.start_worker, the queries are fanned out over its processes.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> eval = Evaluation()
+		>>> bench = eval.read_benchmark("ex_bench.txt")
+		>>> for query, values in eval.evaluate_queries(ii, bench):
+		...     print(query, [round(val, 3) for val in values])
+		animated film [0.667, 0.667, 0.389, 0.531, 0.5]
+		short film [0.667, 1.0, 1.0, 1.0, 1.0]
+		"""
+		items = list(benchmark_query.items())
+		if (executor is None):
+			metrics = evaluate_chunk(items, b, k1, inverted_index)
+		else:
+			chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+			metrics = chain.from_iterable(
+				executor.map(evaluate_chunk, chunks, repeat(b), repeat(k1)))
+		return [(query, values) for (query, _), values in zip(items, metrics)]
+
+	def evaluate(self, inverted_index, benchmark_query, b=None, k1=None, executor=None):
+		"""
+		Mean P@3, P@R, average precision, nDCG and reciprocal rank over all
+		benchmark queries. With b or k1, the index scores the queries with
+		these BM25 parameters.
+
 		>>> ii = InvertedIndex()
 		>>> ii.read_from_file("example.txt")
 		>>> eval = Evaluation()
@@ -66,62 +154,146 @@ class Evaluation:
 		>>> for val in values:
 		...		res.append(round(val, 3))
 		>>> res
-		[0.667, 0.833, 0.694]
+		[0.667, 0.833, 0.694, 0.765, 0.75]
+		>>> values = eval.evaluate(ii , b, b=0.75, k1=1.75)
+		>>> [round(val, 3) for val in values]
+		[0.667, 0.833, 0.694, 0.765, 0.75]
 		"""
-		no_of_queries = len(benchmark_query)
-		total_avg_p = 0
-		total_p3 = 0
-		total_pr = 0
-
-		for query, relevant_docs in benchmark_query.items():
-			#print(query, relevant_docs)
-			#print("Processing.")
-			doc_ids = []
-			r = len(relevant_docs)
-			keywords = [x.lower().strip() for x in re.split("[^a-zA-Z]+", query)]
-			for doc_id in inverted_index.process_query(keywords):
-				doc_ids.append(doc_id[0])
-			# print(keywords)
-			# print(doc_ids)
-
-			precision_at_3 = self.precision_at_k(doc_ids, relevant_docs, 3)
-			total_p3 += precision_at_3
-			# print(precision_at_3)
-			precision_at_r = self.precision_at_k(doc_ids, relevant_docs, r)
-			total_pr += precision_at_r
-			# print(precision_at_r)
-
-			avg_precision = self.average_precision(doc_ids, relevant_docs)
-			total_avg_p += avg_precision
-			# print(avg_precision)
-
-			mean_p_3 = total_p3 / no_of_queries
-			mean_p_r = total_pr / no_of_queries
-			mean_avg_p = total_avg_p / no_of_queries
-
-		return mean_p_3, mean_p_r, mean_avg_p
+		per_query = self.evaluate_queries(inverted_index, benchmark_query, b, k1,
+										  executor)
+		no_of_queries = len(per_query)
+		return tuple(sum(column) / no_of_queries
+					 for column in zip(*(values for query, values in per_query)))
+
+	def sweep(self, inverted_index, benchmark_query, b_values, k_values, executor=None):
+		"""
+		Evaluate every (b, k) pair of the grid on the same index (and worker
+		pool), without re-indexing. Returns (b, k, (P@3, P@R, MAP, nDCG, MRR))
+		for each pair.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> eval = Evaluation()
+		>>> bench = eval.read_benchmark("ex_bench.txt")
+		>>> for b, k, values in eval.sweep(ii, bench, [0, 0.75], [1.75]):
+		...		print(b, k, [round(val, 3) for val in values])
+		0 1.75 [0.667, 0.583, 0.611, 0.725, 0.75]
+		0.75 1.75 [0.667, 0.833, 0.694, 0.765, 0.75]
+		"""
+		results = []
+		for b in b_values:
+			for k in k_values:
+				values = self.evaluate(inverted_index, benchmark_query, b=b, k1=k,
+									   executor=executor)
+				results.append((b, k, values))
+		return results
+
+	def quantized(self, inverted_index, benchmark_query, bits_values):
+		"""
+		Evaluate the index with exact scores and then with its scores
+		quantized to each number of bits (see InvertedIndex.quantize), in
+		this process. Returns (bits, (P@3, P@R, MAP, nDCG, MRR)) for each,
+		with None for the exact scores, which the index has again after.
+
+		>>> ii = InvertedIndex()
+		>>> ii.read_from_file("example.txt")
+		>>> eval = Evaluation()
+		>>> bench = eval.read_benchmark("ex_bench.txt")
+		>>> for bits, values in eval.quantized(ii, bench, [8, 16]):
+		...		print(bits, [round(val, 3) for val in values])
+		None [0.667, 0.833, 0.694, 0.765, 0.75]
+		8 [0.667, 0.833, 0.694, 0.765, 0.75]
+		16 [0.667, 0.833, 0.694, 0.765, 0.75]
+		"""
+		results = []
+		for bits in [None] + list(bits_values):
+			inverted_index.quantize(bits)
+			results.append((bits, self.evaluate(inverted_index, benchmark_query)))
+		inverted_index.quantize(None)
+		return results
 
 if __name__ == '__main__':
 
-	if len(sys.argv) < 3:
-		print("Usage: python3 evaluate.py movies.txt benchmark.txt")
+	#Options of the form --name[=value]
+	options = {}
+	for arg in sys.argv[1:]:
+		if (arg.startswith("--")):
+			name, _, value = arg[2:].partition("=")
+			options[name] = value
+			sys.argv.remove(arg)
+
+	if len(sys.argv) not in (3, 5):
+		print("Usage: python3 evaluate.py movies.txt benchmark.txt "
+			  "[<b-values> <k-values>] [--index=<index-file>] "
+			  "[--processes=<n>] [--per-query]")
+		print("       [--quantize=<bits>,...]")
+		print("With comma-separated b and k values, e.g. 0.5,0.75,1 1.2,1.75, "
+			  "every (b, k) pair is evaluated on the same index.")
+		print("The queries are evaluated by a pool of processes sharing the "
+			  "memory-mapped index (loaded from <index-file> if it exists,")
+		print("otherwise built and saved there or in a temporary file). With "
+			  "--per-query, the metrics of every query are printed too.")
+		print("With --quantize, e.g. 8,16, the exact scores and the scores "
+			  "quantized to each number of bits are evaluated, in this process.")
 		sys.exit()
 
 	file_name = sys.argv[1]
 	benchmark_file = sys.argv[2]
-
-	print("Reading and creating Indexes.")
+	index_file = options.get("index")
+	processes = int(options.get("processes", os.cpu_count()))
 
 	ii = InvertedIndex()
-	ii.read_from_file(file_name)
+	if (index_file is not None and os.path.exists(index_file)):
+		print("Loading index from '%s' ." % index_file)
+		ii.load(index_file)
+	else:
+		print("Reading and creating Indexes.")
+		ii.read_from_file(file_name, processes=processes)
+		if (index_file is None and processes > 1):
+			temp_dir = tempfile.TemporaryDirectory()
+			index_file = os.path.join(temp_dir.name, "index.seg")
+		if (index_file is not None):
+			ii.save(index_file)
 
 	print("Indexes has been built. Now Reading benchmark file.")
 	eeval = Evaluation()
 	benchmark_queries = eeval.read_benchmark(benchmark_file)
 
-	values = eeval.evaluate(ii, benchmark_queries)
+	executor = None
+	if (processes > 1):
+		executor = ProcessPoolExecutor(processes, initializer=batch.start_worker,
+									   initargs=(InvertedIndex, index_file))
+
+	if "per-query" in options:
+		print("query\t%s" % "\t".join(METRICS))
+		for query, values in eeval.evaluate_queries(ii, benchmark_queries,
+													executor=executor):
+			print("%s\t%s" % (query, "\t".join(str(round(x, 3)) for x in values)))
+
+	if "quantize" in options:
+		bits_values = [int(x) for x in options["quantize"].split(",")]
+		print("bits\tP@3\tP@R\tMAP\tnDCG\tMRR")
+		for bits, values in eeval.quantized(ii, benchmark_queries, bits_values):
+			print("%s\t%s" % (bits or "exact",
+								"\t".join(str(round(x, 3)) for x in values)))
+		sys.exit()
+
+	if len(sys.argv) == 5:
+		b_values = [float(x) for x in sys.argv[3].split(",")]
+		k_values = [float(x) for x in sys.argv[4].split(",")]
+		results = eeval.sweep(ii, benchmark_queries, b_values, k_values, executor)
+		print("b\tk\tP@3\tP@R\tMAP\tnDCG\tMRR")
+		for b, k, values in results:
+			print("%s\t%s\t%s" % (b, k, "\t".join(str(round(x, 3)) for x in values)))
+		b, k, values = max(results, key=lambda result: result[2][2])
+		print("Best MAP = %s for b = %s, k = %s" % (round(values[2], 3), b, k))
+		sys.exit()
+
+	values = eeval.evaluate(ii, benchmark_queries, executor=executor)
 
 	print("Results:")
 	print("Mean Precision at 3 = %s" % round(values[0], 3))
 	print("Mean Precision at R =%s" % round(values[1], 3))
-	print("Mean Average Precision =%s" % round(values[2], 3))
\ No newline at end of file
+	print("Mean Average Precision =%s" % round(values[2], 3))
+	print("Mean nDCG =%s" % round(values[3], 3))
+	print("Mean Reciprocal Rank =%s" % round(values[4], 3))
\ No newline at end of file
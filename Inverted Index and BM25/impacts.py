@@ -0,0 +1,173 @@
+from array import array
+
+import numpy
+
+# Number of impact levels (one byte): a score is quantized to its level,
+# score / step rounded up, with the same step for all terms.
+IMPACT_LEVELS = 256
+
+
+class ImpactIndex:
+	"""
+	The postings of every term ordered by decreasing score (impact) rather
+	than by record id, for score-at-a-time ranking with early termination
+	(see top_records). Scores are quantized to IMPACT_LEVELS levels; the
+	postings of a term with the same level form a block, in record id
+	order, and the blocks of a term go from its highest level down. Kept as
+	flat arrays (the record ids and scores in impact order, the start and
+	level of each block, the first block of each term), which are saved
+	with an index and memory-mapped.
+
+	>>> impacts = ImpactIndex.build(numpy.array([0, 3, 5]),
+	...     numpy.array([1, 2, 3, 2, 4], dtype=numpy.uint32),
+	...     numpy.array([0.5, 2.0, 1.0, 0.25, 3.0]))
+	>>> impacts.record_ids.tolist(), impacts.block_levels.tolist()
+	([2, 3, 1, 4, 2], [170, 85, 43, 255, 22])
+	>>> impacts.top_records([0, 1], 2, 5).tolist()
+	[2, 4]
+	>>> impacts.top_records([0], 1, 5).tolist()
+	[2]
+	>>> impacts = ImpactIndex.from_arrays(impacts.to_arrays())
+	>>> impacts.top_records([0], 1, 5).tolist()
+	[2]
+	"""
+
+	def __init__(self, record_ids, scores, block_offsets, block_levels,
+				 term_blocks, step):
+		""" The index over the given arrays (see build). """
+
+		self.record_ids = record_ids
+		self.scores = scores
+		self.block_offsets = block_offsets
+		self.block_levels = block_levels
+		self.term_blocks = term_blocks
+		self.step = step
+		# Free (scores, seen) arrays of top_records, all zeros (False).
+		self.accumulators = []
+
+	@classmethod
+	def build(cls, term_offsets, record_ids, scores, levels=IMPACT_LEVELS):
+		"""
+		Order the postings of each term (from term_offsets[i] to
+		term_offsets[i + 1] in the record ids and scores, NumPy arrays in
+		record order) by decreasing level, keeping record order within a
+		level.
+		"""
+
+		scores = numpy.asarray(scores, dtype=numpy.float64)
+		largest = float(scores.max()) if len(scores) > 0 else 0.0
+		step = largest / (levels - 1) if largest > 0 else 1.0
+		level = numpy.minimum(numpy.ceil(scores / step), levels - 1)
+		level = level.astype(numpy.uint8)
+		term_offsets = numpy.asarray(term_offsets, dtype=numpy.int64)
+		num_postings = numpy.diff(term_offsets)
+		term_column = numpy.repeat(numpy.arange(len(num_postings)),
+								   num_postings)
+		# A stable sort by term, then by level from the highest.
+		order = numpy.lexsort((-level.astype(numpy.int16), term_column))
+		level, term_column = level[order], term_column[order]
+		starts = numpy.flatnonzero((numpy.diff(term_column) != 0)
+								   | (numpy.diff(level) != 0)) + 1
+		block_offsets = numpy.concatenate(
+			([0], starts, [len(order)])).astype(numpy.int64)
+		if (len(order) == 0):
+			block_offsets = block_offsets[:1]
+		term_blocks = numpy.zeros(len(num_postings) + 1, dtype=numpy.int64)
+		numpy.cumsum(numpy.bincount(term_column[block_offsets[:-1]],
+									minlength=len(num_postings)),
+					 out=term_blocks[1:])
+		return cls(numpy.asarray(record_ids)[order], scores[order],
+				   block_offsets, level[block_offsets[:-1]], term_blocks,
+				   step)
+
+	def top_records(self, terms, k, size, weights=None, slack=0.0):
+		"""
+		The sorted ids of the k records with the highest sums of scores
+		over the lists of the given terms (positions in the lexicon), each
+		list's scores times its weight, and of any record whose partial sum
+		is within slack of the k-th one's. Blocks are read across all
+		lists from the highest bound (level * step * weight) down, adding
+		their scores to their records, until no record outside the k best
+		so far can reach them with the bounds of the blocks left, so long
+		lists are mostly not read. Record ids must be below size. The
+		arrays of the partial sums are reused by later calls, reset only at
+		the records that were read.
+		"""
+
+		if (k <= 0):
+			return numpy.zeros(0, dtype=numpy.uint32)
+		bounds, blocks = [], []
+		for position, term in enumerate(terms):
+			weight = 1.0 if weights is None else weights[position]
+			first = int(self.term_blocks[term])
+			last = int(self.term_blocks[term + 1])
+			levels = self.block_levels[first:last].astype(numpy.float64)
+			term_bounds = (levels * (self.step * weight)).tolist()
+			bounds.append(term_bounds + [0.0])
+			blocks.extend((bound, position, block) for bound, block
+						  in zip(term_bounds, range(first, last)))
+		blocks.sort(key=lambda block: -block[0])
+
+		weights = [1.0] * len(terms) if weights is None else weights
+		# Taken from the free ones by pop, so concurrent calls never share.
+		scores, seen = self.accumulators.pop() if self.accumulators else (
+			numpy.zeros(0), numpy.zeros(0, dtype=bool))
+		if (len(scores) < size):
+			scores, seen = numpy.zeros(size), numpy.zeros(size, dtype=bool)
+		cursors = [0] * len(terms)  # The next block of each list.
+		candidates, fresh = numpy.zeros(0, dtype=numpy.uint32), []
+		num_seen, unchecked = 0, 0
+		for _, position, block in blocks:
+			start, end = self.block_offsets[block:block + 2]
+			record_ids = self.record_ids[start:end]
+			scores[record_ids] += self.scores[start:end] * weights[position]
+			new = record_ids[~seen[record_ids]]
+			seen[new] = True
+			fresh.append(new)
+			num_seen += len(new)
+			unchecked += end - start
+			cursors[position] += 1
+			# Checking costs a pass over the candidates, so it is done once
+			# at least half as many postings were read since the last one.
+			if (num_seen < k or 2 * unchecked < num_seen):
+				continue
+			candidates = numpy.concatenate([candidates] + fresh)
+			fresh, unchecked = [], 0
+			partial = scores[candidates]
+			if (len(candidates) > k):
+				partial = numpy.partition(partial, (-k - 1, -k))
+				outside, kth = partial[-k - 1], partial[-k]
+			else:
+				outside, kth = 0.0, partial.min()
+			remaining = sum(term_bounds[cursor] for term_bounds, cursor
+							in zip(bounds, cursors))
+			if (outside + remaining + slack < kth):
+				break
+
+		candidates = numpy.concatenate([candidates] + fresh)
+		partial = scores[candidates]
+		scores[candidates] = 0.0
+		seen[candidates] = False
+		self.accumulators.append((scores, seen))
+		if (len(candidates) > k):
+			kth = numpy.partition(partial, -k)[-k]
+			candidates = candidates[partial >= kth - slack]
+		return numpy.sort(candidates)
+
+	def to_arrays(self):
+		""" The arrays for write_segment. """
+
+		return {"impact_ids": self.record_ids,
+				"impact_scores": self.scores,
+				"impact_blocks": self.block_offsets,
+				"impact_levels": self.block_levels,
+				"impact_terms": self.term_blocks,
+				"impact_step": array("d", [self.step])}
+
+	@classmethod
+	def from_arrays(cls, arrays):
+		""" The index over the (memory-mapped) arrays of an index segment. """
+
+		return cls(*(numpy.asarray(arrays[name]) for name in (
+			"impact_ids", "impact_scores", "impact_blocks", "impact_levels",
+			"impact_terms")), arrays["impact_step"][0])
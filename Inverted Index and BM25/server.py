@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				os.pardir, "common"))
+
+import batch
+from Inverted_Index import InvertedIndex
+from positions import parse_query
+
+# Number of results if the request does not give k, and the largest k.
+DEFAULT_K = 10
+MAX_K = 1000
+
+# Bytes of an unused request body read at a time.
+DRAIN_SIZE = 65536
+
+# Approximate length of the snippet of a description, in characters.
+SNIPPET_LENGTH = 160
+
+def snippet(text, keywords, length=SNIPPET_LENGTH):
+	"""
+	A part of the text of at most the given length, starting a bit before
+	the first occurrence of a keyword, with "..." where the text was cut.
+	Words are not cut.
+
+	>>> snippet("A short film about a long day at sea.", ["day"], 20)
+	'...long day at sea.'
+	>>> snippet("A short film about a long day at sea, and a night.", ["film"], 20)
+	'...short film about a...'
+	>>> snippet("A short film.", ["film"], 20)
+	'A short film.'
+	"""
+
+	if (len(text) <= length):
+		return text
+	match = None
+	if (len(keywords) > 0):
+		pattern = "\\b(%s)\\b" % "|".join(re.escape(x) for x in keywords)
+		match = re.search(pattern, text, re.IGNORECASE)
+	start = max(0, match.start() - length // 3) if match else 0
+	end = min(len(text), start + length)
+	if (start > 0):
+		start = text.find(" ", start - 1) + 1
+	if (end < len(text) and text.rfind(" ", start, end + 1) > start):
+		end = text.rfind(" ", start, end + 1)
+	return "%s%s%s" % ("..." if start > 0 else "", text[start:end],
+					   "..." if end < len(text) else "")
+
+
+def search(query, k, ii=None):
+	"""
+	The top-k records for the query (which may contain phrases, see
+	positions.parse_query) as dicts with the record id, score, title and a
+	snippet of the description. Runs in a worker process, on
+	the index loaded by batch.start_worker unless one is given.
+
+	>>> ii = InvertedIndex()
+	>>> ii.read_from_file("example.txt")
+	>>> hits = search("short film", 2, ii)
+	>>> [(hit["id"], hit["title"], hit["snippet"]) for hit in hits]
+	[(4, 'Movie', 'Short animated short film.'), (3, 'Movie', 'Short animation.')]
+	"""
+
+	ii = batch.worker_index if ii is None else ii
+	keywords, phrases = parse_query(query, ii.tokenizer)
+	hits = []
+	for record_id, score in ii.process_query(keywords, k=k, phrases=phrases):
+		title, _, description = ii.documents.get(record_id).partition("\t")
+		hits.append({"id": record_id, "score": score, "title": title,
+					 "snippet": snippet(description, keywords)})
+	return hits
+
+
+async def drain(reader, length):
+	""" Read and drop the next length bytes of the stream. """
+
+	while (length > 0):
+		data = await reader.readexactly(min(length, DRAIN_SIZE))
+		length -= len(data)
+
+
+class SearchServer:
+	"""
+	An HTTP server answering GET /search?q=<query>&k=<k> with JSON. The
+	event loop only parses requests and writes responses; the scoring runs
+	in a pool of worker processes, which all map the same index file.
+	Connections are kept alive (HTTP/1.1), so one client can send many
+	requests.
+	"""
+
+	def __init__(self, index_file, processes=None):
+		self.executor = ProcessPoolExecutor(
+			processes, initializer=batch.start_worker,
+			initargs=(InvertedIndex, index_file))
+
+	async def respond(self, method, target):
+		""" The status and the JSON body for a request. """
+
+		url = urlsplit(target)
+		if (url.path != "/search"):
+			return 404, {"error": "not found: %s" % url.path}
+		if (method != "GET"):
+			return 405, {"error": "method not allowed: %s" % method}
+		params = parse_qs(url.query)
+		query = params.get("q", [""])[0]
+		try:
+			k = int(params.get("k", [DEFAULT_K])[0])
+		except ValueError:
+			return 400, {"error": "k must be an integer"}
+		if (len(query.strip()) == 0 or k < 1 or k > MAX_K):
+			return 400, {"error": "need a query q and 1 <= k <= %d" % MAX_K}
+
+		start = time.perf_counter()
+		hits = await asyncio.get_running_loop().run_in_executor(
+			self.executor, search, query, k)
+		return 200, {"query": query, "k": k, "results": hits,
+					 "took_ms": round(1000 * (time.perf_counter() - start), 3)}
+
+	async def handle(self, reader, writer):
+		""" Serve the requests of one connection. """
+
+		try:
+			while (True):
+				request_line = await reader.readline()
+				if (len(request_line) == 0):
+					break
+				headers = {}
+				while (True):
+					line = await reader.readline()
+					if (line in (b"\r\n", b"\n", b"")):
+						break
+					name, _, value = line.decode("latin-1").partition(":")
+					headers[name.strip().lower()] = value.strip()
+
+				# A request body is not used, but must be read, so that the
+				# next request on the connection starts after it.
+				length = headers.get("content-length", "0")
+				if (length.isdigit()):
+					await drain(reader, int(length))
+
+				parts = request_line.decode("latin-1").split()
+				if (len(parts) != 3):
+					status, body = 400, {"error": "bad request line"}
+					keep_alive = False
+				elif (not length.isdigit() or "transfer-encoding" in headers):
+					status, body = 400, {"error": "need no body or a Content-Length"}
+					keep_alive = False
+				else:
+					method, target, version = parts
+					try:
+						status, body = await self.respond(method, target)
+					except Exception as error:
+						status, body = 500, {"error": "internal error: %r" % error}
+					keep_alive = (version == "HTTP/1.1" and
+								  headers.get("connection", "").lower() != "close")
+
+				data = json.dumps(body).encode("utf-8")
+				writer.write(("HTTP/1.1 %d %s\r\n"
+							  "Content-Type: application/json\r\n"
+							  "Content-Length: %d\r\n"
+							  "Connection: %s\r\n\r\n"
+							  % (status, STATUS_TEXT[status], len(data),
+								 "keep-alive" if keep_alive else "close")
+							  ).encode("latin-1") + data)
+				await writer.drain()
+				if (not keep_alive):
+					break
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def serve(self, host, port):
+		""" Accept connections until cancelled. """
+
+		server = await asyncio.start_server(self.handle, host, port)
+		print("Serving http://%s:%d/search?q=...&k=..." % (host, port))
+		async with server:
+			await server.serve_forever()
+
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found",
+			   405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+if __name__ == "__main__":
+	if (len(sys.argv) < 2 or len(sys.argv) > 4):
+		print("Usage: python3 server.py <index-file> [<port>] [<processes>]")
+		print("The index file is written by Inverted_Index.py; the default port "
+			  "is 8080 and the default number of worker processes the number "
+			  "of CPUs.")
+		sys.exit()
+
+	index_file = sys.argv[1]
+	port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+	processes = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+
+	server = SearchServer(index_file, processes)
+	try:
+		asyncio.run(server.serve("127.0.0.1", port))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.executor.shutdown()
@@ -0,0 +1,276 @@
+import heapq
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from itertools import chain, islice
+from multiprocessing import Pipe, Process
+
+import numpy
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				os.pardir, "common"))
+
+from batch import batch_stats, read_chunks
+from docstore import split_file
+from impacts import ImpactIndex
+from Inverted_Index import MAX_EXPANSIONS, InvertedIndex
+from positions import PositionIndex, is_wildcard
+from tokenizer import Tokenizer
+
+
+def serve_shard(connection, file_name, start, end, b, k, positions, impacts,
+				tokenizer):
+	"""
+	Run one shard in a worker process: read the records in the byte range
+	of the file, send their number, total length, lexicon and document
+	frequencies, receive the shift of its record ids and the statistics
+	of the whole collection, score with them and then answer the requests
+	of ShardedIndex until None. Record ids are local in the shard and
+	shifted in the replies.
+	"""
+
+	ii = InvertedIndex(tokenizer=tokenizer)
+	ii.positions = PositionIndex() if positions else None
+	num_records = ii.read_range(file_name, start, end)
+	connection.send((num_records,
+					 int(numpy.sum(ii.length_of_docs, dtype=numpy.int64)),
+					 ii.terms, numpy.diff(ii.term_offsets)))
+	shift, num_docs, total_length, doc_freqs = connection.recv()
+	ii.set_collection(num_docs, total_length, doc_freqs)
+	ii.score(b, k)
+	if (impacts):
+		ii.impacts = ImpactIndex.build(ii.term_offsets, ii.record_ids,
+									   ii.scores)
+	connection.send(num_records)
+
+	while (True):
+		request = connection.recv()
+		if (request is None):
+			break
+		if (request[0] == "rank"):
+			started = time.perf_counter()
+			result = ii.rank(*request[1:])
+			seconds = time.perf_counter() - started
+			connection.send(([(record_id + shift, score)
+							  for record_id, score in result], seconds))
+		elif (request[0] == "expand"):
+			connection.send([ii.expand(pattern) for pattern in request[1]])
+		elif (request[0] == "document"):
+			connection.send(ii.documents.get(request[1] - shift))
+	connection.close()
+
+
+class ShardedIndex:
+	"""
+	A BM25 index partitioned by record into shards, each one an
+	InvertedIndex in its own worker process, connected by a pipe. The file
+	is split into one byte range of records per shard (see split_file);
+	the shards read their ranges in parallel, then score with the number
+	of records, average length and document frequencies of the whole
+	collection (see InvertedIndex.set_collection). A query is sent to all
+	shards at once, which rank their records like process_query does, in
+	the same keyword order, so every record gets the very same score as
+	in a single index of the file; the coordinator merges the sorted
+	results (top-k of each shard, with k). Each shard reports the time it
+	spent on the query (see shard_stats).
+
+	Wildcards are expanded over the words of all shards first, so they
+	stand for the same words as in a single index. Shards have no
+	FuzzyIndex and cannot add or delete records.
+
+	>>> single = InvertedIndex()
+	>>> single.read_from_file("example.txt", positions=True)
+	>>> sharded = ShardedIndex(2)
+	>>> sharded.read_from_file("example.txt", positions=True)
+	>>> keywords = ["short", "film"]
+	>>> sharded.process_query(keywords) == single.process_query(keywords)
+	True
+	>>> keywords = ["film", "animat*"]
+	>>> sharded.process_query(keywords, k=2) == single.process_query(keywords, k=2)
+	True
+	>>> sharded.process_query(["short", "film"], b=0, k1=1.2,
+	...                       phrases=[(("short", "film"), 0)])
+	[(4, 2.375)]
+	>>> sharded.document(4)
+	'Movie\\tShort animated short film.'
+	>>> [stats["queries"] for stats in sharded.shard_stats(1.0)]
+	[3, 3]
+	>>> sharded.close()
+	"""
+
+	def __init__(self, num_shards, tokenizer=None):
+		"""
+		Start without shards; read_from_file starts up to num_shards
+		worker processes. Records are split into words by the tokenizer (a
+		default Tokenizer if not given).
+		"""
+
+		self.num_shards = num_shards
+		self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
+		self.positions = False
+		self.connections = []
+		self.processes = []
+		self.first_ids = []  # Record id of the first record of each shard.
+		# Seconds spent by each shard on each query, see shard_stats.
+		self.latencies = []
+
+	def read_from_file(self, file_name, b=None, k=None, positions=False,
+					   impacts=False):
+		"""
+		Start the shards over the records of the file and compute the BM25
+		scores with b and k (see InvertedIndex.read_from_file). With
+		positions, phrases can be queried; with impacts, each shard ranks
+		the top-k with an ImpactIndex.
+		"""
+
+		if (b is None):
+			b, k = 0.75, 1.75
+		self.close()
+		self.positions = positions
+		for start, end in split_file(file_name, self.num_shards):
+			connection, worker_connection = Pipe()
+			process = Process(target=serve_shard, daemon=True, args=(
+				worker_connection, file_name, start, end, b, k, positions,
+				impacts, self.tokenizer))
+			process.start()
+			worker_connection.close()
+			self.connections.append(connection)
+			self.processes.append(process)
+
+		shards = [connection.recv() for connection in self.connections]
+		doc_freqs = Counter()
+		for _, _, terms, term_doc_freqs in shards:
+			doc_freqs.update(dict(zip(terms, term_doc_freqs.tolist())))
+		num_docs = sum(num_records for num_records, _, _, _ in shards)
+		total_length = sum(length for _, length, _, _ in shards)
+		first_id = 1
+		for connection, (num_records, _, terms, _) in zip(self.connections,
+														 shards):
+			connection.send((first_id - 1, num_docs, total_length,
+							 numpy.array([doc_freqs[word] for word in terms],
+										 dtype=numpy.int64)))
+			self.first_ids.append(first_id)
+			first_id += num_records
+		del shards, doc_freqs
+		for connection in self.connections:
+			connection.recv()
+		self.latencies = [array("d") for _ in self.connections]
+
+	def scatter(self, request):
+		""" Send the request to all shards, then gather their replies. """
+
+		for connection in self.connections:
+			connection.send(request)
+		return [connection.recv() for connection in self.connections]
+
+	def expand(self, patterns):
+		"""
+		The words of all shards that match each pattern with wildcards, the
+		first MAX_EXPANSIONS in order (see InvertedIndex.expand).
+		"""
+
+		expansions = zip(*self.scatter(("expand", patterns)))
+		return [sorted(set(chain.from_iterable(words)))[:MAX_EXPANSIONS]
+				for words in expansions]
+
+	def process_query(self, query_Keywords, k=None, b=None, k1=None,
+					  phrases=()):
+		"""
+		The result of InvertedIndex.process_query for an index of all
+		records (without the result cache): the records containing at
+		least one keyword, by the sum of their scores, only the top-k with
+		k.
+		"""
+
+		keywords = sorted(keyword for keyword in query_Keywords
+						  if len(keyword) > 0)
+		phrases = tuple((tuple(words), slop) for words, slop in phrases) \
+			if self.positions else ()
+		patterns = [keyword for keyword in keywords if is_wildcard(keyword)]
+		if (len(patterns) > 0):
+			expansions = dict(zip(patterns, self.expand(patterns)))
+			keywords = list(dict.fromkeys(chain.from_iterable(
+				expansions.get(keyword, [keyword]) for keyword in keywords)))
+
+		replies = self.scatter(("rank", keywords, k, b, k1, phrases))
+		for latencies, (_, seconds) in zip(self.latencies, replies):
+			latencies.append(seconds)
+		# Each result is sorted by score, ties by record id.
+		merged = heapq.merge(*(result for result, _ in replies),
+							 key=lambda hit: (-hit[1], hit[0]))
+		return list(merged if k is None else islice(merged, k))
+
+	def document(self, record_id):
+		""" The record with the given id, fetched from its shard. """
+
+		shard = bisect_right(self.first_ids, record_id) - 1
+		connection = self.connections[shard]
+		connection.send(("document", record_id))
+		return connection.recv()
+
+	def render_output(self, result, keywords, k=3):
+		"""
+		Print the top-k records like InvertedIndex.render_output, and the
+		time each shard spent on the last query.
+		"""
+
+		for record_id, _ in result[:k]:
+			title, _, description = self.document(record_id).partition("\t")
+			print("\n%s\n%s" % (title, description))
+		print("\n# total hits: %s." % len(result))
+		print("# shard latency: %s" % ", ".join(
+			"%.3f ms" % (1000 * latencies[-1])
+			for latencies in self.latencies if len(latencies) > 0))
+
+	def shard_stats(self, seconds):
+		"""
+		The statistics of batch_stats of each shard, over all queries so
+		far, given the wall time they took.
+		"""
+
+		return [batch_stats(latencies, seconds)
+				for latencies in self.latencies]
+
+	def close(self):
+		""" Stop the shards. """
+
+		for connection in self.connections:
+			connection.send(None)
+			connection.close()
+		for process in self.processes:
+			process.join()
+		self.connections, self.processes, self.first_ids = [], [], []
+
+
+def run_batch(sharded, answer, query_file, write):
+	"""
+	Answer all queries of the file with answer(sharded, query), one after
+	the other (each one on all shards at once), and call write(query,
+	result) for each. Return the statistics of batch_stats, with those of
+	each shard as "shards".
+	"""
+
+	latencies = array("d")
+	start = time.perf_counter()
+	for chunk in read_chunks(query_file):
+		for query in chunk:
+			started = time.perf_counter()
+			result = answer(sharded, query)
+			latencies.append(time.perf_counter() - started)
+			write(query, result)
+	seconds = time.perf_counter() - start
+	return dict(batch_stats(latencies, seconds),
+				shards=sharded.shard_stats(seconds))
+
+
+def report_shards(stats, file=sys.stderr):
+	""" Print the latencies of each shard in stats of run_batch. """
+
+	for i, shard in enumerate(stats["shards"], 1):
+		print("shard %d: latency p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, "
+			  "max %.3f ms" % (i, shard["p50_ms"], shard["p90_ms"],
+							   shard["p99_ms"], shard["max_ms"]), file=file)
@@ -0,0 +1,159 @@
+import os
+import random
+import sys
+import time
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "common"))
+
+from batch import batch_stats
+from bench import (bench_index, print_suite_usage, run_suite, time_fuzzy,
+                   time_tokenizer)
+from inverted_index import InvertedIndex
+from posting_list import PostingList
+from synthetic import make_queries
+from tokenizer import STOPWORDS, Tokenizer
+
+
+def random_ids(num_records, density):
+    """ Sorted record ids, each record picked with the given probability. """
+
+    return [i for i in range(1, num_records + 1) if random.random() < density]
+
+
+def list_size_in_bytes(record_ids):
+    """ Memory of a plain Python list of ints, including the int objects. """
+
+    return sys.getsizeof(record_ids) + sum(sys.getsizeof(x) for x in record_ids)
+
+
+def time_intersect(intersect, pairs, repeats=3):
+    """ Best wall time of intersecting all given pairs, in seconds. """
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for list1, list2 in pairs:
+            intersect(list1, list2)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_postings(num_records):
+    """
+    Compare plain lists and PostingList in memory and intersect throughput.
+    """
+
+    ii = InvertedIndex()
+    densities = [0.5, 0.1, 0.01, 0.001]
+    lists = [random_ids(num_records, d) for d in densities]
+    compressed = [PostingList(ids) for ids in lists]
+
+    print("%-10s %12s %14s %14s %8s" % ("density", "postings",
+          "list bytes", "compressed", "ratio"))
+    for density, ids, postings in zip(densities, lists, compressed):
+        plain = list_size_in_bytes(ids)
+        packed = postings.size_in_bytes()
+        print("%-10s %12d %14d %14d %7.1fx" % (density, len(ids), plain,
+              packed, plain / max(packed, 1)))
+
+    pairs = [(lists[i], lists[j]) for i in range(4) for j in range(i + 1, 4)]
+    total = sum(len(a) + len(b) for a, b in pairs)
+    plain_time = time_intersect(ii.intersect_merge, pairs)
+    pairs = [(compressed[i], compressed[j])
+             for i in range(4) for j in range(i + 1, 4)]
+    packed_time = time_intersect(ii.intersect_merge, pairs)
+    print("\nintersect, plain lists: %.3fs (%.1fM postings/s)"
+          % (plain_time, total / plain_time / 1e6))
+    print("intersect, PostingList: %.3fs (%.1fM postings/s)"
+          % (packed_time, total / packed_time / 1e6))
+
+
+
+def bench_skewed_intersect(num_records):
+    """
+    Compare the two-pointer merge with the adaptive intersect for a long
+    list against short lists of decreasing length.
+    """
+
+    ii = InvertedIndex()
+    long_ids = random_ids(num_records, 0.5)
+    long_postings = PostingList(long_ids)
+
+    print("\n%-8s %8s %10s %12s %12s %12s" % ("ratio", "short", "long",
+          "merge", "adaptive", "speedup"))
+    for short_len in [50000, 15000, 5000, 500, 50, 5]:
+        short_ids = sorted(random.sample(range(1, num_records + 1), short_len))
+        pairs = [(short_ids, long_postings)]
+        merge_time = time_intersect(ii.intersect_merge, pairs)
+        adaptive_time = time_intersect(ii.intersect, pairs)
+        assert (ii.intersect_merge(short_ids, long_postings)
+                == ii.intersect(short_ids, long_postings))
+        print("1:%-6d %8d %10d %11.4fs %11.4fs %11.1fx"
+              % (len(long_ids) // short_len, short_len, len(long_ids),
+                 merge_time, adaptive_time, merge_time / adaptive_time))
+
+
+def bench_tokenizer(file_name):
+    """ Compare the throughput of the tokenizer options on a corpus. """
+
+    size = os.path.getsize(file_name) / 2**20
+    print("%-20s %10s %10s" % ("tokenizer", "seconds", "MB/s"))
+    for name, tokenizer in [
+            ("default", Tokenizer()),
+            ("digits", Tokenizer(digits=True)),
+            ("fold_accents", Tokenizer(fold_accents=True)),
+            ("stopwords", Tokenizer(stopwords=STOPWORDS)),
+            ("stopwords, stem", Tokenizer(stopwords=STOPWORDS, stem="plural"))]:
+        seconds = time_tokenizer(tokenizer, file_name)
+        print("%-20s %10.3f %10.1f" % (name, seconds, size / seconds))
+
+
+def bench_scale(num_records, num_queries, directory):
+    """
+    The rows of bench_index for the boolean index of a synthetic corpus
+    with num_records records, and the latencies of num_queries synthetic
+    queries on the loaded index (without the intersection cache) and of
+    the FuzzyIndex of its words. Run in a fresh process by bench_suite.
+    """
+
+    result, ii = bench_index(InvertedIndex, "boolean", num_records,
+                             directory)
+    latencies = []
+    start = time.perf_counter()
+    for query in make_queries(num_queries):
+        query_start = time.perf_counter()
+        ii.Process_Query(query)
+        latencies.append(time.perf_counter() - query_start)
+    result["queries"] = batch_stats(latencies, time.perf_counter() - start)
+    result["fuzzy"] = time_fuzzy(ii.inverted_lists.lexicon, num_queries)
+    return result
+
+
+if __name__ == "__main__":
+    # Options of the form --name=value.
+    options = {}
+    for arg in sys.argv[1:]:
+        if (arg.startswith("--")):
+            name, _, value = arg[2:].partition("=")
+            options[name] = value
+            sys.argv.remove(arg)
+
+    if (len(sys.argv) > 2 or (options and len(sys.argv) > 1)):
+        print("Usage: python3 benchmark.py [<num_records>]")
+        print("       python3 benchmark.py --tokenizer=<corpus-file>")
+        print_suite_usage()
+        sys.exit(1)
+
+    if (options.get("tokenizer")):
+        bench_tokenizer(options["tokenizer"])
+        sys.exit(0)
+
+    if ("suite" in options):
+        sys.exit(run_suite(bench_scale, options))
+
+    num_records = int(sys.argv[1]) if len(sys.argv) == 2 else 1000000
+    random.seed(0)
+    bench_postings(num_records)
+    bench_skewed_intersect(num_records)
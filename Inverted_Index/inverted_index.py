@@ -2,20 +2,325 @@
 # Chair of Algorithms and Data Structures.
 # Author: Hannah Bast <bast@cs.uni-freiburg.de>
 
-import re
+import heapq
+import os
 import sys
+import threading
+import time
+from array import array
+from collections import ChainMap
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "common"))
+
+from batch import report_stats, result_writer, run_batch
+from cache import LRUCache
+from docstore import DocumentStore, split_file
+from fuzzy import FuzzyIndex
+from metrics import Metrics
+from positions import PositionIndex, is_wildcard, parse_query
+from posting_list import ListCursor, PostingList
+from segment import Lexicon, read_segment, wildcard_regex, write_segment
+from tokenizer import STOPWORDS, Tokenizer
+
+# Report the build speed every that many records (verbose builds only).
+REPORT_EVERY = 100000
+
+# Gallop through the longer list once it is that many times longer.
+GALLOP_RATIO = 32
+
+# Number of intersections of keyword pairs kept by Process_Query.
+INTERSECTION_CACHE_SIZE = 1024
+
+# Identifies a segment file written by InvertedIndex.save.
+SEGMENT_MAGIC = b"IIBOOL02"
+
+# Most words a keyword with wildcards expands to (the first ones in order).
+MAX_EXPANSIONS = 1024
+
+# Records per in-memory segment of records added at runtime, and the number
+# of full segments at which they are merged in the background.
+SEGMENT_SIZE = 1000
+MERGE_SEGMENTS = 4
+
+
+def report_speed(num_records, start):
+    """ Print the number of records read so far and the docs/sec on stderr. """
+
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print("%d records read in %.1fs (%d docs/sec)"
+          % (num_records, seconds, num_records / seconds), file=sys.stderr)
+
+
+def build_partial_index(file_name, start, end, positions=False,
+                        tokenizer=None):
+    """
+    Build the index of the records in the given byte range of the file, with
+    record ids starting at 1 (run in a worker process by read_parallel).
+    """
+
+    ii = InvertedIndex(tokenizer=tokenizer)
+    ii.positions = PositionIndex() if positions else None
+    ii.read_range(file_name, start, end)
+    # A few flat arrays pickle much faster than one object per word.
+    return (ii.to_arrays(), ii.documents,
+            ii.positions.to_arrays() if positions else None)
+
+
+def batch_query(ii, query):
+    """
+    The record ids matching a query line (run in a worker process by
+    run_batch).
+
+    >>> ii = InvertedIndex()
+    >>> ii.read_from_file("example.txt")
+    >>> batch_query(ii, "Doc, MOVIE")
+    [1, 3]
+    """
+
+    return list(ii.Process_Query(query))
+
+
+def batch_tsv(query, result):
+    """
+    One line per result of batch_query: query, record id.
+
+    >>> list(batch_tsv("doc movie", [1, 3]))
+    ['doc movie\\t1', 'doc movie\\t3']
+    """
+
+    for record_id in result:
+        yield "%s\t%d" % (query, record_id)
+
+
+def count_intersection(args, result):
+    """ Counters of one call of InvertedIndex.intersect (see Metrics). """
+
+    return {"intersections": 1, "intersection_results": len(result),
+            "intersected_postings": len(args[0]) + len(args[1])}
+
+
+# The stages timed by InvertedIndex.enable_metrics: method name, stage
+# name, counters function, whether to keep a latency histogram.
+METRIC_STAGES = [
+    ("read_range", "build.read",
+     lambda args, result: {"records_read": result}, False),
+    ("read_parallel", "build.read_parallel", None, False),
+    ("compact", "compact", None, False),
+    ("to_arrays", "save.postings", None, False),
+    ("save", "save", None, False),
+    ("load", "load", None, False),
+    ("Process_Query", "query", lambda args, result: {"queries": 1}, True),
+    ("expand", "query.expand", None, False),
+    ("correct", "query.correct", None, False),
+    ("intersect_keywords", "query.intersect_keywords", None, False),
+    ("intersect_pair", "query.intersect_pair", None, False),
+    ("intersect", "query.intersect", count_intersection, False),
+]
+
+
+class MemorySegment:
+    """
+    The inverted lists of records added at runtime, which have consecutive
+    ids starting at first_id. Once full, a segment is only read.
+
+    >>> segment = MemorySegment(5)
+    >>> segment.add(["a", "movie"]), segment.add(["a", "film"])
+    (5, 6)
+    >>> sorted(segment.inverted_lists.items())
+    [('a', [5, 6]), ('film', [6]), ('movie', [5])]
+    """
+
+    def __init__(self, first_id):
+        self.first_id = first_id
+        self.num_records = 0
+        self.inverted_lists = {}
+
+    def add(self, words):
+        """ Add the next record, given its distinct words, and return its id. """
+
+        record_id = self.first_id + self.num_records
+        for word in words:
+            postings = self.inverted_lists.get(word)
+            if (postings is None):
+                postings = self.inverted_lists[word] = PostingList()
+            postings.append(record_id)
+        self.num_records += 1
+        return record_id
+
+    def __len__(self):
+        return self.num_records
+
+    @classmethod
+    def merge(cls, segments, deleted):
+        """
+        One segment with the records of consecutive segments, leaving out the
+        postings of deleted records.
+
+        >>> first, second = MemorySegment(1), MemorySegment(3)
+        >>> ids = first.add(["a"]), first.add(["a", "b"]), second.add(["b"])
+        >>> merged = MemorySegment.merge([first, second], {2})
+        >>> len(merged), sorted(merged.inverted_lists.items())
+        (3, [('a', [1]), ('b', [3])])
+        """
+
+        merged = cls(segments[0].first_id)
+        for segment in segments:
+            merged.num_records += segment.num_records
+            for word, postings in segment.inverted_lists.items():
+                target = merged.inverted_lists.get(word)
+                if (target is None):
+                    target = merged.inverted_lists[word] = PostingList()
+                append_postings(target, postings, deleted)
+        merged.inverted_lists = {word: postings for word, postings
+                                 in merged.inverted_lists.items()
+                                 if len(postings) > 0}
+        return merged
+
+
+def append_postings(target, postings, deleted):
+    """
+    Append postings with larger record ids to the target list, except the
+    deleted ones. Without deleted records, the encoded bytes are copied.
+    """
+
+    if (len(deleted) == 0):
+        target.extend(postings)
+        return
+    for record_id in postings:
+        if (record_id not in deleted):
+            target.append(record_id)
+
+
+def expand_words(inverted_lists, pattern, limit=MAX_EXPANSIONS):
+    """
+    The words of the inverted lists (a dict or SegmentInvertedLists) that
+    match a pattern with wildcards, in sorted order; at most limit of them.
+
+    >>> expand_words({"film": [2], "films": [1], "movie": [1]}, "fil*")
+    ['film', 'films']
+    """
+
+    if (isinstance(inverted_lists, SegmentInvertedLists)):
+        return inverted_lists.lexicon.expand(pattern, limit)
+    return sorted(filter(wildcard_regex(pattern).fullmatch,
+                         inverted_lists))[:limit]
+
+
+class SegmentInvertedLists(Mapping):
+    """
+    Read-only inverted lists backed by the flat arrays of a segment, memory-
+    mapped or, after a build, in memory (see InvertedIndex.freeze). The
+    words are in a front-coded Lexicon, and a PostingList is only wrapped
+    around the bytes when its word is looked up.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.lexicon = Lexicon(arrays["terms"], arrays["term_offsets"])
+
+    def postings(self, i):
+        """ The inverted list of the i-th word of the lexicon. """
+
+        arrays = self.arrays
+        data_offsets, skip_starts = arrays["data_offsets"], arrays["skip_starts"]
+        skips = slice(skip_starts[i], skip_starts[i + 1])
+        return PostingList.from_buffers(
+            arrays["data"][data_offsets[i]:data_offsets[i + 1]],
+            arrays["lengths"][i], arrays["last_ids"][i],
+            arrays["skip_ids"][skips], arrays["skip_offsets"][skips])
+
+    def __getitem__(self, word):
+        i = self.lexicon.index(word)
+        if (i < 0):
+            raise KeyError(word)
+        return self.postings(i)
+
+    def __contains__(self, word):
+        return self.lexicon.index(word) >= 0
+
+    def __iter__(self):
+        return iter(self.lexicon)
+
+    def __len__(self):
+        return len(self.lexicon)
+
 
 class InvertedIndex:
     """ A simple inverted index, as explained in L1. """
 
-    def __init__(self):
-        """ Start with an empty index. """
+    def __init__(self, cache_size=INTERSECTION_CACHE_SIZE, tokenizer=None):
+        """
+        Start with an empty index, caching up to cache_size intersections.
+        Records and queries are split into words by the tokenizer (a default
+        Tokenizer if not given), which is saved with the index.
+        """
 
+        self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
         self.inverted_lists = {}
+        self.documents = DocumentStore()
+        # Records added and deleted at runtime, see add_document.
+        self.segments = []
+        self.deleted = frozenset()
+        self.lock = threading.Lock()
+        self.compaction_lock = threading.Lock()
+        self.compaction = None
+        # Intersections of keyword pairs in inverted_lists, see intersect_pair.
+        self.intersections = LRUCache(cache_size)
+        self.metrics = None  # See enable_metrics.
+        # Token positions of the records, for phrases (see read_from_file).
+        self.positions = None
+        # Typo-tolerant lookup of the words (see read_from_file).
+        self.fuzzy = None
 
-    def read_from_file(self, file_name):
+    def enable_metrics(self, metrics=None):
         """
-        Construct from given file.
+        Time the stages of building and querying (see METRIC_STAGES) and
+        count records, queries and intersected postings in metrics (a new
+        Metrics by default), which is returned. Until then, and after
+        disable_metrics, no time is spent on measuring.
+
+        >>> ii = InvertedIndex()
+        >>> metrics = ii.enable_metrics()
+        >>> ii.read_from_file("example.txt")
+        >>> ii.Process_Query("doc movie")
+        [1, 3]
+        >>> stats = metrics.to_dict()
+        >>> stats["timers"]["query"]["calls"], stats["counters"]
+        ... # doctest: +NORMALIZE_WHITESPACE
+        (1, {'intersected_postings': 5, 'intersection_results': 2,
+             'intersections': 1, 'queries': 1, 'records_read': 3})
+        >>> ii.disable_metrics()
+        >>> ii.Process_Query("doc a"), metrics.to_dict()["counters"]["queries"]
+        ([1, 2], 1)
+        """
+
+        self.disable_metrics()
+        self.metrics = Metrics() if metrics is None else metrics
+        for name, stage, counters, histogram in METRIC_STAGES:
+            self.metrics.instrument(self, name, stage, counters, histogram)
+        return self.metrics
+
+    def disable_metrics(self):
+        """ Stop measuring (the measurements stay in the Metrics object). """
+
+        if (self.metrics is not None):
+            self.metrics.uninstrument(self)
+            self.metrics = None
+
+    def read_from_file(self, file_name, verbose=False, processes=1,
+                       positions=False, fuzzy=False):
+        """
+        Construct from given file. Records are read in order, so a record id
+        only has to be compared with the last id of an inverted list. With
+        verbose, the build speed is reported on stderr. With more than one
+        process, the file is indexed in parallel, see read_parallel. With
+        positions, the positions of the words in each record are kept too,
+        for phrase queries; with fuzzy, a FuzzyIndex of the words, for
+        misspelled queries (see Process_Query).
 
         >>> ii = InvertedIndex()
         >>> ii.read_from_file("example.txt")
@@ -23,46 +328,374 @@ class InvertedIndex:
         [('a', [1, 2]), ('doc', [1, 2, 3]), ('film', [2]), ('movie', [1, 3])]
         """
 
+        start = time.perf_counter()
+        self.positions = PositionIndex() if positions else None
+        self.segments, self.deleted = [], frozenset()
+        self.intersections.clear()
+        if (processes > 1):
+            num_records = self.read_parallel(file_name, processes)
+        else:
+            num_records = self.read_range(file_name, verbose=verbose)
+        self.inverted_lists = self.freeze(self.inverted_lists)
+        self.fuzzy = None
+        if (fuzzy):
+            self.fuzzy = FuzzyIndex.build(self.inverted_lists.lexicon)
+        if (verbose):
+            report_speed(num_records, start)
+
+    def read_range(self, file_name, start=0, end=None, verbose=False):
+        """
+        Construct from the records in the given byte range of the file, and
+        return their number.
+        """
+
+        self.inverted_lists = {}
+        start_time = time.perf_counter()
+        positions = self.positions
+        tokens = self.tokenizer.tokens
+
+        record_id = 0
+        for line in self.documents.read_lines(file_name, start, end):
+            record_id += 1
+            words = tokens(line)
+            if (positions is not None):
+                positions.add(record_id, words)
+            for word in words:
+                postings = self.inverted_lists.get(word)
+                if (postings is None):
+                    postings = self.inverted_lists[word] = PostingList()
+                if (postings.last_id != record_id):
+                    postings.append(record_id)
+            if (verbose and record_id % REPORT_EVERY == 0):
+                report_speed(record_id, start_time)
+        return record_id
+
+    def read_parallel(self, file_name, processes):
+        """
+        Split the file into one byte range per process, index the ranges in
+        a process pool and merge the partial indexes in file order, shifting
+        their record ids by the number of records before them. The encoded
+        postings are concatenated without decoding them. Gives the same
+        index as a serial build, and return the number of records.
+
+        >>> ii = InvertedIndex()
+        >>> ii.read_from_file("example.txt", processes=2)
+        >>> sorted(list(ii.inverted_lists.items()))
+        [('a', [1, 2]), ('doc', [1, 2, 3]), ('film', [2]), ('movie', [1, 3])]
+        >>> ii.documents.get(3)
+        'Doc\\tMovie.'
+        """
+
+        chunks = split_file(file_name, processes)
+        self.inverted_lists = {}
+        self.documents = DocumentStore()
+        self.documents.file_name = file_name
+
+        num_records = 0
+        with ProcessPoolExecutor(processes) as executor:
+            for arrays, documents, position_arrays in executor.map(
+                    build_partial_index, [file_name] * len(chunks),
+                    [start for start, _ in chunks], [end for _, end in chunks],
+                    [self.positions is not None] * len(chunks),
+                    [self.tokenizer] * len(chunks)):
+                if (position_arrays is not None):
+                    self.positions.extend(
+                        PositionIndex.from_arrays(position_arrays), num_records)
+                inverted_lists = SegmentInvertedLists(arrays)
+                for i, word in enumerate(inverted_lists):
+                    merged = self.inverted_lists.get(word)
+                    if (merged is None):
+                        merged = self.inverted_lists[word] = PostingList()
+                    merged.extend(inverted_lists.postings(i), num_records)
+                self.documents.extend(documents)
+                num_records += len(documents)
+        return num_records
+
+    def add_document(self, record):
+        """
+        Add a record (a line of the corpus) at runtime and return its id. It
+        goes to the newest in-memory segment; a full segment is kept as is,
+        and once there are MERGE_SEGMENTS full ones, they are merged in a
+        background thread (see compact). Queries see the record right away.
+
+        >>> ii = InvertedIndex()
+        >>> ii.read_from_file("example.txt")
+        >>> ii.add_document("Doc\\tA new movie.")
+        4
+        >>> ii.Process_Query("a movie")
+        [1, 4]
+        >>> ii.delete_document(1)
+        >>> ii.Process_Query("a movie")
+        [4]
+        >>> ii.compact(full=True)
+        >>> sorted(ii.inverted_lists.items()) # doctest: +NORMALIZE_WHITESPACE
+        [('a', [2, 4]), ('doc', [2, 3, 4]), ('film', [2]), ('movie', [3, 4]),
+         ('new', [4])]
+        """
+
+        terms = self.tokenizer.tokens(record)
+        words = dict.fromkeys(terms)
+        with self.lock:
+            if (len(self.segments) == 0
+                    or len(self.segments[-1]) >= SEGMENT_SIZE):
+                # Replace the list, so queries can keep using the old one.
+                self.segments = self.segments + [
+                    MemorySegment(len(self.documents) + 1)]
+                if (len(self.segments) > MERGE_SEGMENTS
+                        and (self.compaction is None
+                             or not self.compaction.is_alive())):
+                    self.compaction = threading.Thread(target=self.compact,
+                                                       daemon=True)
+                    self.compaction.start()
+            record_id = self.segments[-1].add(words)
+            if (self.positions is not None):
+                self.positions.add(record_id, terms)
+            self.documents.append(record.rstrip("\r\n"))
+        return record_id
+
+    def delete_document(self, record_id):
+        """
+        Delete the record with the given id at runtime. It is only marked
+        as deleted (a tombstone) and left out of query results; its postings
+        are dropped when its segment is compacted.
+        """
+
+        with self.lock:
+            if (record_id < 1 or record_id > len(self.documents)
+                    or record_id in self.deleted):
+                raise KeyError(record_id)
+            self.deleted = self.deleted | {record_id}
+
+    def compact(self, full=False):
+        """
+        Merge the full in-memory segments into one, leaving out deleted
+        records. Queries keep using the old segments until the new one is
+        in place. With full, merge all segments into the main inverted lists
+        instead (which is what save needs).
+        """
+
+        with self.compaction_lock:
+            with self.lock:
+                segments = self.segments if full else self.segments[:-1]
+                deleted = self.deleted
+            if (full):
+                inverted_lists = {}
+                sources = [self.inverted_lists] + [
+                    segment.inverted_lists for segment in segments]
+                for source in sources:
+                    for word in source:
+                        merged = inverted_lists.get(word)
+                        if (merged is None):
+                            merged = inverted_lists[word] = PostingList()
+                        append_postings(merged, source[word], deleted)
+                inverted_lists = self.freeze(
+                    {word: postings for word, postings
+                     in inverted_lists.items() if len(postings) > 0})
+                fuzzy = None
+                if (self.fuzzy is not None):
+                    fuzzy = FuzzyIndex.build(inverted_lists.lexicon)
+            elif (len(segments) > 1):
+                merged = MemorySegment.merge(segments, deleted)
+            else:
+                return
+
+            # The postings of these deleted records are gone now, so their
+            # tombstones are no longer needed.
+            if (not full):
+                deleted = frozenset(
+                    record_id for record_id in deleted
+                    if record_id >= merged.first_id
+                    and record_id < merged.first_id + len(merged))
+            with self.lock:
+                if (full):
+                    self.inverted_lists = inverted_lists
+                    self.fuzzy = fuzzy
+                    self.segments = self.segments[len(segments):]
+                    self.intersections.clear()
+                else:
+                    self.segments = [merged] + self.segments[len(segments):]
+                self.deleted = self.deleted - deleted
+
+    def to_arrays(self, inverted_lists=None):
+        """
+        The inverted lists (ours by default) as flat arrays: the sorted
+        lexicon, and for all words (in lexicon order) the offsets into one
+        contiguous array of encoded postings and one of skip pointers.
+        """
+
+        if (inverted_lists is None):
+            inverted_lists = self.inverted_lists
+        if (isinstance(inverted_lists, SegmentInvertedLists)):
+            return {name: inverted_lists.arrays[name] for name in (
+                "terms", "term_offsets", "lengths", "last_ids", "data",
+                "data_offsets", "skip_ids", "skip_offsets", "skip_starts")}
+        terms, term_offsets = Lexicon.encode(inverted_lists)
+        lengths, last_ids = array("I"), array("I")
+        data, data_offsets = bytearray(), array("Q", [0])
+        skip_ids, skip_offsets = array("I"), array("I")
+        skip_starts = array("Q", [0])
+        for word in sorted(inverted_lists):
+            postings = inverted_lists[word]
+            lengths.append(len(postings))
+            last_ids.append(postings.last_id)
+            data += postings.data
+            data_offsets.append(len(data))
+            skip_ids.extend(postings.skip_ids)
+            skip_offsets.extend(postings.skip_offsets)
+            skip_starts.append(len(skip_ids))
+        return {
+            "terms": terms, "term_offsets": term_offsets,
+            "lengths": lengths, "last_ids": last_ids,
+            "data": data, "data_offsets": data_offsets,
+            "skip_ids": skip_ids, "skip_offsets": skip_offsets,
+            "skip_starts": skip_starts}
+
+    def freeze(self, inverted_lists):
+        """
+        The inverted lists of a dict as SegmentInvertedLists over the arrays
+        of to_arrays, kept in memory. Per word, this takes a few bytes of
+        front-coded lexicon and offsets instead of a string, a dict slot
+        and a PostingList object with three buffers.
+
+        >>> ii = InvertedIndex()
+        >>> lists = ii.freeze({"film": PostingList([2]), "a": PostingList([1, 2])})
+        >>> sorted(lists.items()), "film" in lists, "doc" in lists
+        ([('a', [1, 2]), ('film', [2])], True, False)
+        """
+
+        return SegmentInvertedLists(
+            {name: memoryview(values)
+             for name, values in self.to_arrays(inverted_lists).items()})
+
+    def save(self, file_name):
+        """
+        Write the index to a binary segment, see to_arrays. The records are
+        stored compressed along with it, so the corpus is not needed after
+        load, and so are the options of the tokenizer.
+
+        >>> import os, tempfile
+        >>> file_name = os.path.join(tempfile.mkdtemp(), "example.idx")
+        >>> ii = InvertedIndex()
+        >>> ii.read_from_file("example.txt")
+        >>> ii.save(file_name)
+        >>> ii = InvertedIndex()
+        >>> ii.load(file_name)
+        >>> sorted(ii.inverted_lists.items())
+        [('a', [1, 2]), ('doc', [1, 2, 3]), ('film', [2]), ('movie', [1, 3])]
+        >>> ii.Process_Query("doc movie")
+        [1, 3]
+        >>> ii.documents.get(3)
+        'Doc\\tMovie.'
+        """
+
+        if (len(self.segments) > 0 or len(self.deleted) > 0):
+            self.compact(full=True)
+        arrays = self.to_arrays()
+        arrays.update(self.documents.to_arrays())
+        arrays["tokenizer"] = self.tokenizer.to_config()
+        if (self.positions is not None):
+            arrays.update(self.positions.to_arrays())
+        if (self.fuzzy is not None):
+            arrays.update(self.fuzzy.to_arrays())
+        write_segment(file_name, SEGMENT_MAGIC, arrays)
 
-        with open(file_name) as file:
-            record_id = 0
-            for line in file:
-                record_id += 1
-                words = re.split("[^a-zA-Z]+", line)
-                for word in words:
-                    if (len(word) > 0):
-                        word = word.lower()
-                        # print(word)
-                        if (word not in self.inverted_lists):
-                            self.inverted_lists[word] = []
-                        if(record_id not in self.inverted_lists[word]):
-                            self.inverted_lists[word].append(record_id)
-            print(self.inverted_lists)
+    def load(self, file_name):
+        """
+        Memory-map an index written by save. This takes constant time, and
+        processes loading the same file share its pages.
+        """
+
+        arrays = read_segment(file_name, SEGMENT_MAGIC)
+        self.segments, self.deleted = [], frozenset()
+        self.intersections.clear()
+        self.inverted_lists = SegmentInvertedLists(arrays)
+        self.documents = DocumentStore.from_arrays(arrays)
+        self.tokenizer = Tokenizer()
+        if ("tokenizer" in arrays):
+            self.tokenizer = Tokenizer.from_config(arrays["tokenizer"])
+        self.positions = None
+        if ("pos_ids" in arrays):
+            self.positions = PositionIndex.from_arrays(arrays)
+        self.fuzzy = None
+        if ("fuzzy_entries" in arrays):
+            self.fuzzy = FuzzyIndex.from_arrays(arrays)
 
     def intersect(self, list1, list2):
         """
+        Intersect two sorted lists of record ids. Lists of similar length are
+        merged, otherwise we gallop through the longer one.
+
         >>> ii = InvertedIndex()
         >>> ii.intersect([1, 5, 7], [2, 4])
         []
 
         >>> ii.intersect([1, 2, 5, 7], [1, 3, 5, 6, 7, 9])
         [1, 5, 7]
+
+        >>> ii.intersect(PostingList([1, 2, 5, 7]), PostingList([5, 7, 9]))
+        [5, 7]
+
+        >>> ii.intersect([7, 500], PostingList(range(1, 1000, 3)))
+        [7]
+        """
+        if (len(list1) > len(list2)):
+            list1, list2 = list2, list1
+        if (len(list2) >= GALLOP_RATIO * len(list1)):
+            return self.intersect_galloping(list1, list2)
+        return self.intersect_merge(list1, list2)
+
+    def intersect_merge(self, list1, list2):
+        """
+        Plain two-pointer merge, linear in the total length.
+
+        >>> ii = InvertedIndex()
+        >>> ii.intersect_merge([1, 2, 5, 7], PostingList([1, 3, 5, 6, 7, 9]))
+        [1, 5, 7]
         """
         result = []
 
-        i , j =0,0
-        while(i < len(list1) and j < len(list2)):
-            if(list1[i] == list2[j]):
-                result.append(list1[i])
-                i+=1
-                j+=1
-            elif(list1[i] < list2[j]):
-                i += 1
-            else:
-                j += 1
+        # Works on plain lists as well as on PostingList, which decodes its
+        # record ids while we walk over it.
+        it1, it2 = iter(list1), iter(list2)
+        try:
+            id1, id2 = next(it1), next(it2)
+            while(True):
+                if(id1 == id2):
+                    result.append(id1)
+                    id1, id2 = next(it1), next(it2)
+                elif(id1 < id2):
+                    id1 = next(it1)
+                else:
+                    id2 = next(it2)
+        except StopIteration:
+            pass
        # print(result)
         return result
 
+    def intersect_galloping(self, short_list, long_list):
+        """
+        Look up every id of the short list in the long list by exponential
+        search (on the skip pointers of a PostingList). Costs
+        O(m log(n / m)) for lists of length m <= n.
+
+        >>> ii = InvertedIndex()
+        >>> ii.intersect_galloping([3, 9], [1, 2, 3, 4, 5, 6, 7, 8])
+        [3]
+        """
+        result = []
+
+        if (isinstance(long_list, PostingList)):
+            cursor = long_list.cursor()
+        else:
+            cursor = ListCursor(long_list)
+        for record_id in short_list:
+            found = cursor.next_geq(record_id)
+            if (found is None):
+                break
+            if (found == record_id):
+                result.append(record_id)
+        return result
+
 
     def Process_Query(self, query_Keywords):
 
@@ -79,47 +712,278 @@ class InvertedIndex:
         >>> ii.read_from_file("example.txt")
         >>> ii.Process_Query("doc movie comedy")
         []
+
+        If the index keeps positions, a quoted phrase only matches records
+        with its words in this order, and "..."~n also with up to n other
+        words between each two of them (see positions.parse_query). Only
+        records in the intersection of all keywords are checked. Without
+        positions, the quotes are ignored.
+
+        >>> ii.read_from_file("example.txt", positions=True)
+        >>> ii.Process_Query('"doc a"'), ii.Process_Query('"doc movie"')
+        ([1, 2], [3])
+        >>> ii.Process_Query('"doc movie"~1')
+        [1, 3]
+
+        A keyword with wildcards (* for any string, ? for any one character)
+        matches the records of all words it expands to, at most
+        MAX_EXPANSIONS of them (see expand). A ? at the end of a word is
+        punctuation.
+
+        >>> ii.Process_Query("*m* doc"), ii.Process_Query("doc ?ovie")
+        ([1, 2, 3], [1, 3])
+        >>> ii.Process_Query("doc movie?")
+        [1, 3]
+
+        If the index has a FuzzyIndex, a keyword that is in no inverted
+        list matches the records of the words closest to it, within
+        fuzzy.MAX_EDITS edits (see correct).
+
+        >>> ii.read_from_file("example.txt", fuzzy=True)
+        >>> ii.Process_Query("doc moive"), ii.Process_Query("dco flm")
+        ([1, 3], [2])
+
+        The query is split into words by the tokenizer of the index.
+
+        >>> ii = InvertedIndex(tokenizer=Tokenizer(stopwords=STOPWORDS))
+        >>> ii.read_from_file("example.txt")
+        >>> ii.Process_Query("The doc, a MOVIE")
+        [1, 3]
         """
 
         keywords_List  = []
         result = []
        
-        words = re.split("[^a-zA-Z]+", query_Keywords)
+        words, phrases = parse_query(query_Keywords, self.tokenizer)
         if(len(words) <= 1):
            # print("Not enough words.")
             result = []
             return result
         for keyword in words:
-            if(len(keyword) > 0):
-                keyword = keyword.lower()
-                if(keyword not in keywords_List):
-                    keywords_List.append(keyword)
+            if(keyword not in keywords_List):
+                keywords_List.append(keyword)
        
+        # Records added at runtime are in segments with larger ids, so the
+        # results of all segments, in order, are the result of the index.
+        with self.lock:
+            sources = [self.inverted_lists] + [
+                segment.inverted_lists for segment in self.segments]
+            deleted = self.deleted
+        patterns = [keyword for keyword in keywords_List if is_wildcard(keyword)]
+        corrections = {}
+        if (self.fuzzy is not None):
+            corrections = self.correct(keywords_List, sources)
+        for i, inverted_lists in enumerate(sources):
+            # Only the main lists are large and stay the same for long.
+            cache = self.intersections if i == 0 else None
+            if (len(patterns) > 0 or len(corrections) > 0):
+                # Each pattern or misspelled keyword stands for the union of
+                # the lists of its words.
+                expanded = {}
+                for pattern in patterns:
+                    postings = self.expand(inverted_lists, pattern)
+                    if (len(postings) > 0):
+                        expanded[pattern] = postings
+                for keyword, words in corrections.items():
+                    postings = self.union(inverted_lists, words)
+                    if (len(postings) > 0):
+                        expanded[keyword] = postings
+                inverted_lists = ChainMap(expanded, inverted_lists)
+            result += self.intersect_keywords(inverted_lists, keywords_List, cache)
+        if (len(deleted) > 0):
+            result = [record_id for record_id in result
+                      if record_id not in deleted]
+        if (self.positions is not None and len(phrases) > 0):
+            result = self.positions.filter(result, phrases)
+        return result
+        # print(result)
+
+    def expand(self, inverted_lists, pattern):
+        """
+        The union of the inverted lists of the words that match a pattern
+        with wildcards (see expand_words), as a sorted list of record ids.
+
+        >>> ii = InvertedIndex()
+        >>> ii.read_from_file("example.txt")
+        >>> ii.expand(ii.inverted_lists, "*i?m"), ii.expand(ii.inverted_lists, "x*")
+        ([2], [])
+        """
+
+        return self.union(inverted_lists,
+                          expand_words(inverted_lists, pattern))
+
+    def union(self, inverted_lists, words):
+        """
+        The union of the inverted lists of the words (those that have one),
+        as a sorted list of record ids.
+
+        >>> InvertedIndex().union({"a": [1, 3], "b": [2, 3]}, ["a", "b", "c"])
+        [1, 2, 3]
+        """
+
+        lists = [inverted_lists[word] for word in words
+                 if word in inverted_lists]
+        if (len(lists) == 1):
+            return lists[0]
+        return list(dict.fromkeys(heapq.merge(*lists)))
+
+    def correct(self, keywords, sources):
+        """
+        The keywords (without wildcards) that are in none of the sources
+        (inverted lists), each with the words of the FuzzyIndex closest to
+        it; keywords without any word within fuzzy.MAX_EDITS edits are left
+        out.
+
+        >>> ii = InvertedIndex()
+        >>> ii.read_from_file("example.txt", fuzzy=True)
+        >>> ii.correct(["doc", "flim", "moive", "xyzzy"], [ii.inverted_lists])
+        {'flim': ['film'], 'moive': ['movie']}
+        """
+
+        corrections = {}
+        for keyword in keywords:
+            if (is_wildcard(keyword)
+                    or any(keyword in source for source in sources)):
+                continue
+            words = [word for word, _ in self.fuzzy.closest(keyword)]
+            if (len(words) > 0):
+                corrections[keyword] = words
+        return corrections
+
+    def intersect_keywords(self, inverted_lists, keywords_List, cache=None):
+        """
+        Intersect the inverted lists of all keywords. The first two lists
+        are intersected through the cache, if given (see intersect_pair).
+
+        >>> ii = InvertedIndex()
+        >>> ii.intersect_keywords({"a": [1, 2], "b": [2, 3]}, ["a", "b"])
+        [2]
+        """
+        result = []
+
         for keyword in keywords_List:
-            if (keyword not in self.inverted_lists):
+            if (keyword not in inverted_lists):
                 result = []
                 # print("Query Keyword is not in Dictionary, therefore resulted InterSection is " + str(result))                
                 return result
             
 
+        # Intersect shortest lists first, so intermediate results stay small.
+        keywords_List = sorted(keywords_List,
+                               key=lambda keyword: len(inverted_lists[keyword]))
+
         for x in range(0, len(keywords_List)-1):
             if(x == 0):
-                temp = self.inverted_lists[keywords_List[0]]
-            result = self.intersect(temp, self.inverted_lists[keywords_List[x+1]])
+                result = self.intersect_pair(inverted_lists, keywords_List[0],
+                                             keywords_List[1], cache)
+            else:
+                result = self.intersect(temp, inverted_lists[keywords_List[x+1]])
             temp = result
+            if (len(result) == 0):
+                break
+        return result
+
+    def intersect_pair(self, inverted_lists, word1, word2, cache=None):
+        """
+        Intersect the lists of two words. With a cache, the result is looked
+        up there first and stored for the next query with both words; the
+        cache must be cleared when the lists change. The result must not be
+        modified.
+
+        >>> ii = InvertedIndex()
+        >>> ii.read_from_file("example.txt")
+        >>> ii.Process_Query("doc movie"), ii.Process_Query("movie doc")
+        ([1, 3], [1, 3])
+        >>> ii.intersections.stats()
+        {'hits': 1, 'misses': 1, 'size': 1, 'max_size': 1024}
+        """
+
+        if (cache is None):
+            return self.intersect(inverted_lists[word1], inverted_lists[word2])
+        key = (word1, word2) if word1 < word2 else (word2, word1)
+        generation = cache.generation
+        result = cache.get(key)
+        if (result is None):
+            result = self.intersect(inverted_lists[word1], inverted_lists[word2])
+            cache.put(key, result, generation)
         return result
-        # print(result)
-       
 
 
 if __name__ == "__main__":
-    if (len(sys.argv) != 2):
-        print("Usage: python3 inverted_index.py <file>")
+    # Options of the form --name=value.
+    options = {}
+    for arg in sys.argv[1:]:
+        if (arg.startswith("--")):
+            name, _, value = arg[2:].partition("=")
+            options[name] = value
+            sys.argv.remove(arg)
+    batch_file = options.get("batch")
+    metrics_file = options.get("metrics")
+    # In batch mode stdout holds the results only.
+    log = sys.stderr if batch_file is not None else sys.stdout
+
+    if (len(sys.argv) not in (2, 3)
+            or (batch_file is not None and len(sys.argv) != 3)
+            or not options.get("processes", "1").isdigit()
+            or int(options.get("processes", "1")) < 1):
+        print("Usage: python3 inverted_index.py <file> [<index-file>] "
+              "[--processes=<n>] [--batch=<query-file> [--format=tsv|jsonl]] "
+              "[--metrics=<json-file>] [--positions] [--fuzzy] [--stopwords] "
+              "[--stem]")
+        print("The index is loaded from <index-file> if it exists, otherwise "
+              "built from <file> and saved there.")
+        print("With --processes=<n>, the index is built by n processes "
+              "(default 1) and the --batch queries are answered by n "
+              "processes (default the number of CPUs).")
+        print("With --batch, the queries of <query-file> (one per line) are "
+              "answered by a pool of processes sharing the memory-mapped "
+              "<index-file>; the matching record ids are written to stdout as "
+              "TSV (query, record id) or JSON lines, the throughput and "
+              "latencies to stderr.")
+        print("With --positions, the index keeps the positions of the words, "
+              "for \"phrase\" and \"proximity\"~<n> queries.")
+        print("Query words may contain wildcards: * for any string, ? for "
+              "any one character.")
+        print("With --fuzzy, a query word that is not in the index matches "
+              "the words closest to it, within two typos.")
+        print("With --stopwords, very frequent English words are left out, "
+              "and with --stem, plurals are reduced to the singular; a "
+              "loaded index keeps the options it was built with.")
+        print("With --metrics, the time spent per stage, counters and the "
+              "query latency histogram of this process are written to "
+              "<json-file> after the build and after each query.")
         sys.exit(1)
     file_name = sys.argv[1]
-    ii = InvertedIndex()
-    ii.read_from_file(file_name)
-    print  ("Inverted Index has been built\n")
+    index_file = sys.argv[2] if len(sys.argv) == 3 else None
+    tokenizer = Tokenizer(
+        stopwords=STOPWORDS if "stopwords" in options else (),
+        stem=(options["stem"] or "plural") if "stem" in options else None)
+    ii = InvertedIndex(tokenizer=tokenizer)
+    if (metrics_file is not None):
+        ii.enable_metrics()
+    if (index_file is not None and os.path.exists(index_file)):
+        ii.load(index_file)
+        print  ("Inverted Index has been loaded\n", file=log)
+    else:
+        ii.read_from_file(file_name, verbose=True,
+                          processes=int(options.get("processes", 1)),
+                          positions="positions" in options,
+                          fuzzy="fuzzy" in options)
+        if (index_file is not None):
+            ii.save(index_file)
+        print  ("Inverted Index has been built\n", file=log)
+    if (metrics_file is not None):
+        ii.metrics.instrument(ii.documents, "get_all", "render.fetch")
+        ii.metrics.dump(metrics_file)
+
+    if (batch_file is not None):
+        del ii
+        write = result_writer(options.get("format", "tsv"), batch_tsv)
+        processes = int(options.get("processes", os.cpu_count()))
+        stats = run_batch(InvertedIndex, index_file, batch_query, batch_file,
+                          write, processes)
+        report_stats(stats)
+        sys.exit()
 
     """Process Query Part"""
     while (True):
@@ -127,15 +991,9 @@ if __name__ == "__main__":
         if(input_query == "E" or input_query == "e"):
             sys.exit(1)
         result = ii.Process_Query(input_query)
-        i = 0
-        with open(file_name) as file:
-            record_id = 0
-            for line in file:
-                record_id += 1
-                if (i == len(result) or i == 3):
-                    break
-                if(result[i] == record_id):
-                    print (line)
-                    i+=1
+        for line in ii.documents.get_all(result[:3]):
+            print (line + "\n")
+        if (metrics_file is not None):
+            ii.metrics.dump(metrics_file)
 
         print("If you want to exit enter E or e.")
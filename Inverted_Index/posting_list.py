@@ -0,0 +1,261 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+
+class PostingList:
+    """
+    A compressed inverted list. The record ids are kept sorted and only the
+    gaps between consecutive ids are stored, each one variable-byte encoded
+    (7 bits per byte, the high bit marks the last byte of a gap). Frequent
+    words have small gaps, so most postings take a single byte instead of a
+    boxed Python int plus a list slot.
+
+    >>> postings = PostingList([1, 5, 7, 300])
+    >>> postings
+    [1, 5, 7, 300]
+    >>> len(postings), len(postings.data)
+    (4, 5)
+    >>> postings == [1, 5, 7, 300]
+    True
+    """
+
+    BLOCK_SIZE = 64
+
+    def __init__(self, record_ids=()):
+        """ Start with the given (sorted) record ids. """
+
+        self.data = bytearray()
+        self.length = 0
+        self.last_id = 0
+        self.skip_ids = array("I")
+        self.skip_offsets = array("I")
+        for record_id in record_ids:
+            self.append(record_id)
+
+    @classmethod
+    def from_buffers(cls, data, length, last_id, skip_ids, skip_offsets):
+        """
+        Wrap already encoded postings, e.g. memoryviews into a segment file,
+        without copying them. Such a list is read-only.
+
+        >>> postings = PostingList([4, 9])
+        >>> PostingList.from_buffers(memoryview(postings.data), 2, 9,
+        ...     postings.skip_ids, postings.skip_offsets)
+        [4, 9]
+        """
+
+        postings = cls.__new__(cls)
+        postings.data = data
+        postings.length = length
+        postings.last_id = last_id
+        postings.skip_ids = skip_ids
+        postings.skip_offsets = skip_offsets
+        return postings
+
+    def append(self, record_id):
+        """
+        Append a record id, which must be larger than the last one.
+
+        >>> postings = PostingList([3])
+        >>> postings.append(200)
+        >>> postings.append(200)
+        Traceback (most recent call last):
+        ...
+        ValueError: record ids must be strictly increasing
+        """
+
+        gap = record_id - self.last_id
+        if (gap <= 0):
+            raise ValueError("record ids must be strictly increasing")
+        if (self.length % self.BLOCK_SIZE == 0):
+            self.skip_ids.append(self.last_id)
+            self.skip_offsets.append(len(self.data))
+        self.append_gap(gap)
+        self.last_id = record_id
+        self.length += 1
+
+    def append_gap(self, gap):
+        """ Append the variable-byte code of a gap to the data. """
+
+        while (gap >= 128):
+            self.data.append(gap & 127)
+            gap >>= 7
+        self.data.append(gap | 128)
+
+    def extend(self, postings, shift=0):
+        """
+        Append the record ids of another list, each one increased by shift.
+        Only the first gap is re-encoded; the other bytes and the skip
+        pointers are copied, so the appended list becomes a new block.
+
+        >>> postings = PostingList([1, 4])
+        >>> postings.extend(PostingList([2, 3]), shift=4)
+        >>> postings
+        [1, 4, 6, 7]
+        >>> postings = PostingList(range(1, 100))
+        >>> postings.extend(PostingList(range(1, 101)), shift=99)
+        >>> postings == list(range(1, 200)), postings.cursor().next_geq(150)
+        (True, 150)
+        """
+
+        if (len(postings) == 0):
+            return
+        data = postings.data
+        first_id, num_bytes = 0, 0
+        while (data[num_bytes] < 128):
+            first_id |= data[num_bytes] << (7 * num_bytes)
+            num_bytes += 1
+        first_id |= (data[num_bytes] & 127) << (7 * num_bytes)
+        num_bytes += 1
+        gap = first_id + shift - self.last_id
+        if (gap <= 0):
+            raise ValueError("record ids must be strictly increasing")
+
+        self.skip_ids.append(self.last_id)
+        self.skip_offsets.append(len(self.data))
+        self.append_gap(gap)
+        # The other blocks of the appended list move by this many bytes.
+        moved = len(self.data) - num_bytes
+        self.data += data[num_bytes:]
+        self.skip_ids.extend(
+            skip_id + shift for skip_id in postings.skip_ids[1:])
+        self.skip_offsets.extend(
+            offset + moved for offset in postings.skip_offsets[1:])
+        self.length += len(postings)
+        self.last_id = postings.last_id + shift
+
+    def __iter__(self):
+        """ Decode the record ids on the fly. """
+
+        record_id = 0
+        gap, shift = 0, 0
+        for byte in self.data:
+            if (byte < 128):
+                gap |= byte << shift
+                shift += 7
+            else:
+                record_id += gap | ((byte & 127) << shift)
+                yield record_id
+                gap, shift = 0, 0
+
+    def cursor(self):
+        """ A cursor for galloping over the record ids. """
+
+        return PostingCursor(self)
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def size_in_bytes(self):
+        """ Memory used by the encoded postings (excluding the object). """
+
+        return (sys.getsizeof(self.data) + sys.getsizeof(self.skip_ids)
+                + sys.getsizeof(self.skip_offsets))
+
+
+def gallop(ids, target, lo=0):
+    """
+    Exponential search: the smallest index i >= lo with ids[i] >= target,
+    or len(ids) if there is none. Costs O(log d) for a distance d from lo.
+
+    >>> gallop([1, 3, 5, 7, 9, 11], 7)
+    3
+    >>> gallop([1, 3, 5, 7, 9, 11], 12, lo=2)
+    6
+    """
+
+    step = 1
+    hi = lo
+    while (hi < len(ids) and ids[hi] < target):
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(ids, target, lo, min(hi, len(ids)))
+
+
+class ListCursor:
+    """
+    Cursor over a plain sorted list of record ids.
+
+    >>> cursor = ListCursor([2, 4, 8, 16])
+    >>> cursor.next_geq(3), cursor.next_geq(4), cursor.next_geq(17)
+    (4, 4, None)
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.index = 0
+
+    def next_geq(self, target):
+        """ Advance to the first record id >= target, None if exhausted. """
+
+        self.index = gallop(self.ids, target, self.index)
+        if (self.index == len(self.ids)):
+            return None
+        return self.ids[self.index]
+
+
+class PostingCursor:
+    """
+    Cursor over a PostingList. Galloping happens on the skip pointers, so
+    at most one block of postings is decoded per call. Blocks are found by
+    their byte offsets only, so they need not all hold BLOCK_SIZE postings.
+
+    >>> postings = PostingList(range(1, 1000, 3))
+    >>> cursor = postings.cursor()
+    >>> cursor.next_geq(500), cursor.next_geq(501), cursor.next_geq(998)
+    (502, 502, None)
+    """
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.block = 0
+        self.offset = 0     # Byte offset of the next undecoded posting.
+        self.current = 0    # Last decoded record id.
+
+    def next_geq(self, target):
+        """ Advance to the first record id >= target, None if exhausted. """
+
+        if (self.current >= target and self.offset > 0):
+            return self.current
+        postings = self.postings
+        skip_ids = postings.skip_ids
+
+        # Jump to the last block that starts before the target, unless we
+        # already decoded past its start.
+        block = gallop(skip_ids, target, self.block + 1) - 1
+        if (block > self.block):
+            self.block = block
+            if (postings.skip_offsets[block] > self.offset):
+                self.offset = postings.skip_offsets[block]
+                self.current = skip_ids[block]
+
+        # Decode from there until we reach the target.
+        data = postings.data
+        offset, record_id = self.offset, self.current
+        gap, shift = 0, 0
+        while (offset < len(data)):
+            byte = data[offset]
+            offset += 1
+            if (byte < 128):
+                gap |= byte << shift
+                shift += 7
+                continue
+            record_id += gap | ((byte & 127) << shift)
+            gap, shift = 0, 0
+            if (record_id >= target):
+                break
+        else:
+            record_id = None
+        self.offset = offset
+        if (record_id is None):
+            return None
+        self.current = record_id
+        return record_id
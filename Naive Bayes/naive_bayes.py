@@ -1,8 +1,17 @@
-import re
+import os
 import sys
 import numpy
 from scipy.sparse import csr_matrix
 
+# The modules shared by all components are in the common directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "common"))
+
+from tokenizer import Tokenizer
+
+# Words are maximal runs of letters and digits, in lowercase.
+TOKENIZER = Tokenizer(digits=True)
+
 
 def generate_vocab(filename):
     """
@@ -12,7 +21,6 @@ def generate_vocab(filename):
     """
 
     next_class_id = 0
-    next_feature_id = 0
 
     # Map from label/class to label id.
     class_vocab = dict()
@@ -27,11 +35,8 @@ def generate_vocab(filename):
             if label not in class_vocab:
                 class_vocab[label] = next_class_id
                 next_class_id += 1
-            words = re.sub("\W+", " ", text.lower()).split()
-            for w in words:
-                if w not in word_vocab:
-                    word_vocab[w] = next_feature_id
-                    next_feature_id += 1
+            # New words get the next ids.
+            TOKENIZER.term_ids(text, word_vocab)
 
     return word_vocab, class_vocab
 
@@ -61,15 +66,12 @@ def read_labeled_data(filename, class_vocab, word_vocab):
             if label in class_vocab:
                 num_examples += 1
                 labels.append(class_vocab[label])
-                words = re.sub("\W+", " ", text.lower()).split()
-                for w in words:
-                    if w in word_vocab:
-                        w_id = word_vocab[w]
-                        row.append(i)
-                        col.append(w_id)
-                        # Duplicate values at the same position
-                        # ij are summed
-                        value.append(1.0)
+                for w_id in TOKENIZER.term_ids(text, word_vocab, add=False):
+                    row.append(i)
+                    col.append(w_id)
+                    # Duplicate values at the same position
+                    # ij are summed
+                    value.append(1.0)
 
     X = csr_matrix((value, (row, col)), shape=(num_examples, num_cols))
     y = numpy.array(labels)
@@ -0,0 +1,142 @@
+import json
+import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Queries per task sent to a worker process.
+CHUNK_SIZE = 1000
+
+# The index of a worker process, loaded once by start_worker.
+worker_index = None
+
+
+def start_worker(index_class, index_file):
+    """ Load the index in a worker process (memory-mapped, so shared). """
+
+    global worker_index
+    worker_index = index_class()
+    worker_index.load(index_file)
+
+
+def answer_chunk(answer, queries):
+    """
+    Answer the queries with answer(index, query) on the worker's index, and
+    return (query, result, seconds) for each.
+    """
+
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        result = answer(worker_index, query)
+        results.append((query, result, time.perf_counter() - start))
+    return results
+
+
+def read_chunks(file_name, chunk_size=CHUNK_SIZE):
+    """
+    Yield the queries of a file in lists of chunk_size. A query is the first
+    tab-separated field of a line, so benchmark files can be replayed too;
+    empty lines are skipped.
+    """
+
+    chunk = []
+    with open(file_name, encoding="utf-8") as file:
+        for line in file:
+            query = line.rstrip("\r\n").split("\t", 1)[0]
+            if (len(query.strip()) == 0):
+                continue
+            chunk.append(query)
+            if (len(chunk) == chunk_size):
+                yield chunk
+                chunk = []
+    if (len(chunk) > 0):
+        yield chunk
+
+
+def run_batch(index_class, index_file, answer, query_file, write, processes,
+              chunk_size=CHUNK_SIZE):
+    """
+    Answer all queries of the file in a pool of worker processes, which all
+    map the same index file, and call write(query, result) for each, in the
+    order of the file. At most two chunks per process are in flight, so
+    the memory needed does not grow with the number of queries. Return the
+    statistics of batch_stats.
+    """
+
+    latencies = array("d")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(processes, initializer=start_worker,
+                             initargs=(index_class, index_file)) as executor:
+        pending = deque()
+        for chunk in read_chunks(query_file, chunk_size):
+            pending.append(executor.submit(answer_chunk, answer, chunk))
+            if (len(pending) >= 2 * processes):
+                write_results(pending.popleft().result(), write, latencies)
+        while (len(pending) > 0):
+            write_results(pending.popleft().result(), write, latencies)
+    return batch_stats(latencies, time.perf_counter() - start)
+
+
+def write_results(results, write, latencies):
+    for query, result, seconds in results:
+        write(query, result)
+        latencies.append(seconds)
+
+
+def percentile(values, p):
+    """
+    The p-th percentile of the sorted values (nearest rank).
+
+    >>> percentile([1, 2, 3, 4], 50), percentile([1, 2, 3, 4], 99)
+    (2, 4)
+    """
+
+    if (len(values) == 0):
+        return 0
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def batch_stats(latencies, seconds):
+    """
+    The number of queries, the wall time, the throughput (queries per
+    second) and the percentiles of the latency of a single query.
+
+    >>> batch_stats([0.001, 0.002, 0.004, 0.003], 0.5)["qps"]
+    8.0
+    """
+
+    latencies = sorted(latencies)
+    stats = {"queries": len(latencies), "seconds": round(seconds, 3),
+             "qps": round(len(latencies) / seconds, 1) if seconds > 0 else 0.0}
+    for p in (50, 90, 99):
+        stats["p%d_ms" % p] = round(1000 * percentile(latencies, p), 3)
+    stats["max_ms"] = round(1000 * latencies[-1], 3) if latencies else 0.0
+    return stats
+
+
+def report_stats(stats, file=sys.stderr):
+    """ Print the statistics of run_batch in one line. """
+
+    print("%d queries in %.2fs: %.1f queries/sec, latency p50 %.3f ms, "
+          "p90 %.3f ms, p99 %.3f ms, max %.3f ms"
+          % (stats["queries"], stats["seconds"], stats["qps"], stats["p50_ms"],
+             stats["p90_ms"], stats["p99_ms"], stats["max_ms"]), file=file)
+
+
+def result_writer(output_format, format_tsv, file=sys.stdout):
+    """
+    A write function for run_batch: JSON lines with the query and its
+    result, or the lines of format_tsv(query, result).
+    """
+
+    if (output_format == "jsonl"):
+        def write(query, result):
+            file.write(json.dumps({"query": query, "results": result}) + "\n")
+    elif (output_format == "tsv"):
+        def write(query, result):
+            file.writelines(line + "\n" for line in format_tsv(query, result))
+    else:
+        raise ValueError("unknown output format: %s" % output_format)
+    return write
@@ -0,0 +1,247 @@
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from batch import batch_stats
+from fuzzy import FuzzyIndex
+from metrics import peak_rss
+from segment import Lexicon
+from synthetic import cached_corpus
+
+# Number of records of the synthetic corpora of the suite, unless given.
+SUITE_SCALES = [10000, 100000, 1000000]
+
+# Relative slowdown (or growth) against a baseline that counts as regression.
+REGRESSION_TOLERANCE = 0.2
+
+
+def time_tokenizer(tokenizer, file_name, chunk_size=10000):
+    """
+    Wall time of splitting all records of the file into terms with
+    tokenize_many, chunk_size records at a time (reading them is not
+    timed), in seconds.
+    """
+
+    seconds = 0
+    with open(file_name, encoding="utf-8") as file:
+        while (True):
+            lines = list(islice(file, chunk_size))
+            if (len(lines) == 0):
+                break
+            start = time.perf_counter()
+            tokenizer.tokenize_many(lines)
+            seconds += time.perf_counter() - start
+    return seconds
+
+
+def term_bytes_per_term(terms):
+    """
+    Memory per term, in bytes, of a dict from term to id (the strings, the
+    dict and the ids), and of the front-coded Lexicon of the same terms.
+
+    >>> terms = ["film", "films", "movie"]
+    >>> dict_bytes, lexicon_bytes = term_bytes_per_term(terms)
+    >>> lexicon_bytes < dict_bytes
+    True
+    """
+
+    terms = list(terms)
+    term_ids = {term: i for i, term in enumerate(terms)}
+    dict_bytes = (sys.getsizeof(term_ids)
+                  + sum(map(sys.getsizeof, terms))
+                  + sum(map(sys.getsizeof, term_ids.values())))
+    blob, offsets = Lexicon.encode(terms)
+    lexicon_bytes = len(blob) + offsets.itemsize * len(offsets)
+    return dict_bytes / len(terms), lexicon_bytes / len(terms)
+
+
+def time_fuzzy(lexicon, num_lookups, seed=0):
+    """
+    Build a FuzzyIndex of the lexicon and look up the closest words of
+    num_lookups of its words with one character replaced: the build time,
+    the size of the index and the latencies of the lookups.
+    """
+
+    start = time.perf_counter()
+    fuzzy = FuzzyIndex.build(lexicon)
+    build_seconds = time.perf_counter() - start
+    rng = random.Random(seed)
+    words = list(lexicon)
+    typos = []
+    for word in rng.choices(words, k=num_lookups):
+        i = rng.randrange(len(word))
+        letter = "x" if word[i] == "q" else "q"
+        typos.append(word[:i] + letter + word[i + 1:])
+    latencies = []
+    start = time.perf_counter()
+    for typo in typos:
+        lookup_start = time.perf_counter()
+        fuzzy.closest(typo)
+        latencies.append(time.perf_counter() - lookup_start)
+    return {"build_seconds": round(build_seconds, 3),
+            "index_bytes": len(fuzzy.entries) * fuzzy.entries.itemsize,
+            "lookups": batch_stats(latencies, time.perf_counter() - start)}
+
+
+def bench_index(index_class, label, num_records, directory):
+    """
+    Build an index of the given class over the synthetic corpus with
+    num_records records, save it in the directory as
+    <label>-<num_records>.idx and load it again; the tokenizer of the index
+    is timed on the corpus on its own, too. The loaded index has no result
+    cache, so that queries on it time the index code. Return the
+    measurements, the first rows of a result of bench_suite, and the
+    loaded index.
+    """
+
+    corpus = cached_corpus(directory, num_records)
+    ii = index_class(cache_size=0)
+    start = time.perf_counter()
+    ii.read_from_file(corpus)
+    build_seconds = time.perf_counter() - start
+    build_rss = peak_rss()
+    tokenize_seconds = time_tokenizer(ii.tokenizer, corpus)
+
+    index_file = os.path.join(directory, "%s-%d.idx" % (label, num_records))
+    start = time.perf_counter()
+    ii.save(index_file)
+    save_seconds = time.perf_counter() - start
+    ii = index_class(cache_size=0)
+    start = time.perf_counter()
+    ii.load(index_file)
+    load_seconds = time.perf_counter() - start
+    dict_bytes, lexicon_bytes = term_bytes_per_term(ii.inverted_lists)
+
+    result = {"index": label, "records": num_records,
+              "build_seconds": round(build_seconds, 3),
+              "build_docs_per_sec": round(num_records / build_seconds),
+              "build_peak_rss_bytes": build_rss,
+              "tokenize_seconds": round(tokenize_seconds, 3),
+              "tokenize_mb_per_sec": round(
+                  os.path.getsize(corpus) / 2**20 / tokenize_seconds, 1),
+              "save_seconds": round(save_seconds, 3),
+              "load_seconds": round(load_seconds, 3),
+              "index_file_bytes": os.path.getsize(index_file),
+              "term_dict_bytes_per_term": round(dict_bytes, 1),
+              "lexicon_bytes_per_term": round(lexicon_bytes, 1)}
+    return result, ii
+
+
+def bench_suite(bench_scale, scales, num_queries, directory, output):
+    """
+    Run bench_scale(num_records, num_queries, directory) for each number of
+    records, each in its own process (so the peak RSS is that of one
+    build), and write the results to the output as JSON lines. The corpora
+    are kept in the directory and reused by later runs.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for num_records in scales:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(bench_scale, num_records, num_queries,
+                                     directory).result()
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+        results.append(result)
+    return results
+
+
+def flatten(result, prefix=""):
+    """
+    The numbers of a (nested) result dict, with dotted names.
+
+    >>> flatten({"records": 10, "queries": {"p50_ms": 0.5}})
+    {'records': 10, 'queries.p50_ms': 0.5}
+    """
+
+    values = {}
+    for name, value in result.items():
+        if (isinstance(value, dict)):
+            values.update(flatten(value, prefix + name + "."))
+        elif (isinstance(value, (int, float))):
+            values[prefix + name] = value
+    return values
+
+
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare results with the baseline results of the same index and number
+    of records. Return (name, baseline value, value) for every time or size
+    (names ending in _seconds, _ms or _bytes) that grew by more than the
+    tolerance.
+
+    >>> old = [{"index": "bm25", "records": 10, "build_seconds": 1.0}]
+    >>> new = [{"index": "bm25", "records": 10, "build_seconds": 1.5}]
+    >>> find_regressions(new, old)
+    [('bm25/10/build_seconds', 1.0, 1.5)]
+    >>> find_regressions(new, old, tolerance=0.6)
+    []
+    """
+
+    previous = {(result["index"], result["records"]): flatten(result)
+                for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result["index"], result["records"])
+        if (key not in previous):
+            continue
+        for name, value in flatten(result).items():
+            if (not name.endswith(("_seconds", "_ms", "_bytes"))):
+                continue
+            old = previous[key].get(name)
+            if (old is not None and value > old * (1 + tolerance)):
+                regressions.append(("%s/%d/%s" % (key + (name,)), old, value))
+    return regressions
+
+
+def print_suite_usage():
+    """ Print the usage of the --suite mode of the benchmarks. """
+
+    print("       python3 benchmark.py --suite[=<num_records>,...] "
+          "[--queries=<n>] [--dir=<corpus-dir>] [--output=<file>] "
+          "[--baseline=<file>]")
+    print("The suite builds and queries indexes of Zipf-distributed "
+          "synthetic corpora (default %s records) and writes the "
+          "timings and sizes as JSON lines; with a baseline from an "
+          "earlier run, it exits with status 1 if any of them grew by "
+          "more than %d%%." % (",".join(map(str, SUITE_SCALES)),
+                               100 * REGRESSION_TOLERANCE))
+
+
+def run_suite(bench_scale, options):
+    """
+    The --suite mode of the benchmarks: run bench_suite with bench_scale
+    (see bench_suite) on the scales, number of queries, corpus directory
+    and output file of the options, and compare the results with those of
+    the baseline file, if given. Return the exit status, 1 if any value
+    regressed.
+    """
+
+    scales = SUITE_SCALES
+    if (options["suite"]):
+        scales = [int(x) for x in options["suite"].split(",")]
+    directory = options.get("dir") or tempfile.mkdtemp()
+    num_queries = int(options.get("queries", 1000))
+    output = sys.stdout
+    if (options.get("output")):
+        output = open(options["output"], "w", encoding="utf-8")
+    with output:
+        results = bench_suite(bench_scale, scales, num_queries, directory,
+                              output)
+    if (options.get("baseline")):
+        with open(options["baseline"], encoding="utf-8") as file:
+            baseline = [json.loads(line) for line in file if line.strip()]
+        regressions = find_regressions(results, baseline)
+        for name, old, new in regressions:
+            print("regression: %s %s -> %s" % (name, old, new),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
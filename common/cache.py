@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A mapping of bounded size that evicts the least recently used entry,
+    with hit and miss counters. clear() starts a new generation: a value
+    computed before (e.g. a query that ran while the index changed) is not
+    stored by put, so the cache never returns stale results.
+
+    >>> cache = LRUCache(2)
+    >>> cache.put("a", 1)
+    >>> cache.put("b", 2)
+    >>> cache.get("a"), cache.get("c")
+    (1, None)
+    >>> cache.put("c", 3)  # Evicts "b", the least recently used.
+    >>> cache.get("b"), len(cache), cache.hits, cache.misses
+    (None, 2, 1, 2)
+    >>> generation = cache.generation
+    >>> cache.clear()
+    >>> cache.put("d", 4, generation)
+    >>> cache.get("d")
+    """
+
+    def __init__(self, max_size):
+        """ An empty cache for at most max_size entries (0 disables it). """
+
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ The value for the key, which becomes the most recently used. """
+
+        with self.lock:
+            if (key not in self.entries):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value, generation=None):
+        """
+        Store a value, evicting the least recently used entry if the cache
+        is full. With a generation, only store it if the cache was not
+        cleared since.
+        """
+
+        with self.lock:
+            if (self.max_size <= 0 or (generation is not None
+                                       and generation != self.generation)):
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while (len(self.entries) > self.max_size):
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """ Remove all entries, e.g. because the index changed. """
+
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        """ The counters and the size, as a dict. """
+
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.entries), "max_size": self.max_size}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,188 @@
+import os
+import zlib
+from array import array
+
+
+class DocumentStore:
+    """
+    Random access to the records (lines) of a corpus by record id. While the
+    index is built, only the byte offset of each line is remembered; a
+    record is then fetched with a single positioned read, independent of the
+    corpus size. For a saved index the records are stored compressed in the
+    segment itself, in blocks of BLOCK_SIZE records.
+
+    >>> import os, tempfile
+    >>> file_name = os.path.join(tempfile.mkdtemp(), "example.txt")
+    >>> with open(file_name, "w") as file:
+    ...     _ = file.write("Doc\\tA movie.\\nDoc\\tA film.\\nDoc\\tMovie.\\n")
+    >>> store = DocumentStore()
+    >>> lines = list(store.read_lines(file_name))
+    >>> len(store), store.get(3)
+    (3, 'Doc\\tMovie.')
+    >>> store = DocumentStore.from_arrays(store.to_arrays())
+    >>> store.get_all([3, 1])
+    ['Doc\\tMovie.', 'Doc\\tA movie.']
+    """
+
+    BLOCK_SIZE = 16
+
+    def __init__(self):
+        """ Start with an empty store. """
+
+        self.file_name = None
+        self.file_descriptor = None
+        self.offsets = array("Q", [0])
+        # Compressed records of a loaded segment.
+        self.blocks = None
+        self.block_offsets = None
+        self.num_records = 0
+        # Records added at runtime, after all others.
+        self.added = []
+
+    def read_lines(self, file_name, start=0, end=None):
+        """
+        Yield the decoded lines of the given file and remember where each
+        one starts. With start and end, only the lines in that byte range
+        are read (both must be line boundaries, see split_file).
+        """
+
+        self.__init__()
+        self.file_name = file_name
+        offsets = self.offsets
+        offsets[0] = start
+        with open(file_name, "rb") as file:
+            file.seek(start)
+            for line in file:
+                if (end is not None and offsets[-1] >= end):
+                    break
+                offsets.append(offsets[-1] + len(line))
+                yield line.decode("utf-8")
+        self.num_records = len(offsets) - 1
+
+    def extend(self, other):
+        """
+        Append the records of a store that read the byte range of the same
+        file right after ours.
+
+        >>> import os, tempfile
+        >>> file_name = os.path.join(tempfile.mkdtemp(), "example.txt")
+        >>> with open(file_name, "w") as file:
+        ...     _ = file.write("Doc\\tA movie.\\nDoc\\tA film.\\nDoc\\tMovie.\\n")
+        >>> first, second = DocumentStore(), DocumentStore()
+        >>> (start, middle), (_, end) = split_file(file_name, 2)
+        >>> lines = list(first.read_lines(file_name, start, middle))
+        >>> lines = list(second.read_lines(file_name, middle, end))
+        >>> first.extend(second)
+        >>> len(first), first.get(3)
+        (3, 'Doc\\tMovie.')
+        """
+
+        if (self.offsets[-1] != other.offsets[0]):
+            raise ValueError("records do not continue this store")
+        self.offsets.extend(other.offsets[1:])
+        self.num_records = len(self.offsets) - 1
+
+    def append(self, record):
+        """
+        Add a record (without line break) after all others, in memory, and
+        return its id.
+
+        >>> store = DocumentStore()
+        >>> store.append("Doc\\tNew.")
+        1
+        >>> store.get(1)
+        'Doc\\tNew.'
+        """
+
+        self.added.append(record)
+        self.num_records += 1
+        return self.num_records
+
+    def get(self, record_id):
+        """ The record with the given (1-based) id, without line break. """
+
+        if (record_id < 1 or record_id > self.num_records):
+            raise IndexError(record_id)
+        first_added = self.num_records - len(self.added)
+        if (record_id > first_added):
+            return self.added[record_id - first_added - 1]
+        if (self.blocks is not None):
+            block, i = divmod(record_id - 1, self.BLOCK_SIZE)
+            data = zlib.decompress(
+                self.blocks[self.block_offsets[block]:
+                            self.block_offsets[block + 1]])
+            return data.decode("utf-8").split("\n")[i]
+        if (self.file_descriptor is None):
+            self.file_descriptor = os.open(self.file_name, os.O_RDONLY)
+        start, end = self.offsets[record_id - 1], self.offsets[record_id]
+        data = os.pread(self.file_descriptor, end - start, start)
+        return data.decode("utf-8").rstrip("\r\n")
+
+    def get_all(self, record_ids):
+        """ The records with the given ids, one read each. """
+
+        return [self.get(record_id) for record_id in record_ids]
+
+    def compressed_blocks(self):
+        """ Yield the records compressed in blocks of BLOCK_SIZE. """
+
+        for first in range(1, self.num_records + 1, self.BLOCK_SIZE):
+            last = min(first + self.BLOCK_SIZE, self.num_records + 1)
+            lines = self.get_all(range(first, last))
+            yield zlib.compress("\n".join(lines).encode("utf-8"))
+
+    def to_arrays(self):
+        """
+        The records compressed in blocks, as arrays for write_segment.
+        """
+
+        blocks, block_offsets = bytearray(), array("Q", [0])
+        for block in self.compressed_blocks():
+            blocks += block
+            block_offsets.append(len(blocks))
+        return {"doc_blocks": blocks, "doc_offsets": block_offsets,
+                "doc_count": array("Q", [self.num_records])}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """ A store over the (memory-mapped) arrays written by to_arrays. """
+
+        store = cls()
+        store.blocks = arrays["doc_blocks"]
+        store.block_offsets = arrays["doc_offsets"]
+        store.num_records = arrays["doc_count"][0]
+        return store
+
+    def __len__(self):
+        return self.num_records
+
+
+def split_file(file_name, num_chunks):
+    """
+    Split the file into at most num_chunks byte ranges (start, end) of
+    about equal size, each starting and ending at a line boundary.
+
+    >>> import os, tempfile
+    >>> file_name = os.path.join(tempfile.mkdtemp(), "example.txt")
+    >>> with open(file_name, "w") as file:
+    ...     _ = file.write("Doc\\tA movie.\\nDoc\\tA film.\\nDoc\\tMovie.\\n")
+    >>> split_file(file_name, 2)
+    [(0, 25), (25, 36)]
+    >>> split_file(file_name, 100)[:2]
+    [(0, 13), (13, 25)]
+    """
+
+    size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, "rb") as file:
+        for i in range(1, num_chunks):
+            position = max(size * i // num_chunks, bounds[-1] + 1)
+            if (position >= size):
+                break
+            # Move to the start of the line after position - 1.
+            file.seek(position - 1)
+            file.readline()
+            bounds.append(min(file.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:])
+            if start < end]
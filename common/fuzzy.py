@@ -0,0 +1,198 @@
+import zlib
+from array import array
+from bisect import bisect_left
+
+from segment import Lexicon
+
+# Most edits (insertions, deletions, substitutions and transpositions of
+# two adjacent characters) by which a fuzzy match may differ from a word.
+MAX_EDITS = 2
+
+# Only the deletes of the first PREFIX_LENGTH characters of a word are
+# indexed, as in SymSpell; candidates are then checked on the whole word.
+PREFIX_LENGTH = 7
+
+
+def deletes(word, max_edits=MAX_EDITS, prefix_length=PREFIX_LENGTH):
+    """
+    The strings made by deleting up to max_edits characters from the prefix
+    of the word, as one set per number of deleted characters (from 0).
+
+    >>> [sorted(variants) for variants in deletes("film", 1)]
+    [['film'], ['fil', 'fim', 'flm', 'ilm']]
+    """
+
+    levels = [{word[:prefix_length]}]
+    for _ in range(max_edits):
+        levels.append({variant[:i] + variant[i + 1:]
+                       for variant in levels[-1] for i in range(len(variant))})
+    return levels
+
+
+def delete_key(variant):
+    """ The hash under which words with the given delete are stored. """
+
+    return zlib.crc32(variant.encode("utf-8"))
+
+
+def one_edit(word1, word2):
+    """
+    Whether the words differ by exactly one edit, in linear time.
+
+    >>> one_edit("film", "flim"), one_edit("film", "films"), one_edit("a", "abc")
+    (True, True, False)
+    """
+
+    if (word1 == word2):
+        return False
+    i, n = 0, min(len(word1), len(word2))
+    while (i < n and word1[i] == word2[i]):
+        i += 1
+    return (word1[i + 1:] == word2[i + 1:] or word1[i + 1:] == word2[i:]
+            or word1[i:] == word2[i + 1:]
+            or (word1[i:i + 2] == word2[i + 1:i + 2] + word2[i:i + 1]
+                and word1[i + 2:] == word2[i + 2:]))
+
+
+def edit_distance(word1, word2, limit=MAX_EDITS):
+    """
+    The number of edits (insertions, deletions, substitutions and
+    transpositions of adjacent characters) that turn one word into the
+    other, or limit + 1 if it is larger than limit.
+
+    >>> edit_distance("form", "from"), edit_distance("film", "films")
+    (1, 1)
+    >>> edit_distance("movie", "moive"), edit_distance("movie", "mop")
+    (1, 3)
+    """
+
+    if (abs(len(word1) - len(word2)) > limit):
+        return limit + 1
+    if (word1 == word2):
+        return 0
+    if (limit == 1):
+        return 1 if one_edit(word1, word2) else 2
+    # Distances of the prefixes of word1 to the last two prefixes of word2.
+    before, previous = None, list(range(len(word1) + 1))
+    for j, char2 in enumerate(word2, 1):
+        current = [j]
+        for i, char1 in enumerate(word1, 1):
+            distance = min(previous[i] + 1, current[i - 1] + 1,
+                           previous[i - 1] + (char1 != char2))
+            if (i > 1 and j > 1 and char1 == word2[j - 2]
+                    and word1[i - 2] == char2):
+                distance = min(distance, before[i - 2] + 1)
+            current.append(distance)
+        if (min(current) > limit):
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class FuzzyIndex:
+    """
+    Finds the words of a Lexicon within MAX_EDITS edits of a (misspelled)
+    word by symmetric delete: two words within n edits have a delete (see
+    deletes) in common that takes at most n characters from each. Every
+    word is stored under the hash of each of its deletes, as one sorted
+    array of entries (hash << 32 | characters deleted << 30 | position in
+    the lexicon), so a lookup costs a binary search per delete of the word,
+    whatever the size of the vocabulary, and an edit_distance check per
+    candidate (which also drops hash collisions). The array can be saved
+    with an index and memory-mapped.
+
+    >>> terms, term_offsets = Lexicon.encode(
+    ...     ["animated", "animation", "film", "films", "movie"])
+    >>> fuzzy = FuzzyIndex.build(Lexicon(terms, term_offsets))
+    >>> fuzzy.lookup("flim"), fuzzy.lookup("animaton")
+    ([('film', 1), ('films', 2)], [('animation', 1), ('animated', 2)])
+    >>> arrays = dict(fuzzy.to_arrays(), terms=terms,
+    ...               term_offsets=term_offsets)
+    >>> fuzzy = FuzzyIndex.from_arrays(arrays)
+    >>> fuzzy.lookup("moive"), fuzzy.lookup("doc")
+    ([('movie', 1)], [])
+    >>> fuzzy.closest("flim"), fuzzy.closest("animatde")
+    ([('film', 1)], [('animated', 1)])
+    """
+
+    def __init__(self, lexicon, entries):
+        """ The index of the given entries (see build) over the lexicon. """
+
+        self.lexicon = lexicon
+        self.entries = entries
+
+    @classmethod
+    def build(cls, lexicon):
+        """ Index the deletes of all words of the lexicon. """
+
+        if (len(lexicon) >= 1 << 30):
+            raise ValueError("too many words for a fuzzy index")
+        entries = array("Q", sorted(
+            delete_key(variant) << 32 | deleted << 30 | i
+            for i, word in enumerate(lexicon)
+            for deleted, variants in enumerate(deletes(word))
+            for variant in variants))
+        return cls(lexicon, entries)
+
+    def candidates(self, word, max_edits=MAX_EDITS):
+        """
+        The positions of the words with a delete in common with word, both
+        with at most max_edits characters deleted.
+        """
+
+        entries = self.entries
+        positions = set()
+        for variants in deletes(word, max_edits):
+            for variant in variants:
+                key = delete_key(variant) << 32
+                start = bisect_left(entries, key)
+                end = bisect_left(entries, key + (max_edits + 1 << 30), start)
+                positions.update(entry & 0x3fffffff
+                                 for entry in entries[start:end])
+        return positions
+
+    def lookup(self, word, max_edits=MAX_EDITS):
+        """
+        The words within max_edits (at most MAX_EDITS) edits of the word, as
+        (word, distance), closest first and then in sorted order.
+        """
+
+        matches = []
+        # Only the blocks of the lexicon with candidates are decoded.
+        blocks = {}
+        for i in sorted(self.candidates(word, max_edits)):
+            b, j = divmod(i, Lexicon.BLOCK_SIZE)
+            if (b not in blocks):
+                blocks[b] = self.lexicon.block(b)
+            candidate = blocks[b][j].decode("utf-8")
+            distance = edit_distance(word, candidate, max_edits)
+            if (distance <= max_edits):
+                matches.append((distance, candidate))
+        return [(candidate, distance)
+                for distance, candidate in sorted(matches)]
+
+    def closest(self, word):
+        """
+        The words closest to the word, within MAX_EDITS edits, as (word,
+        distance) in sorted order. Most typos are one edit, so those are
+        looked for first, which has far fewer candidates.
+        """
+
+        for max_edits in range(1, MAX_EDITS + 1):
+            matches = self.lookup(word, max_edits)
+            if (len(matches) > 0):
+                closest = matches[0][1]
+                return [match for match in matches if match[1] == closest]
+        return []
+
+    def to_arrays(self):
+        """ The entries as an array for write_segment (with the lexicon). """
+
+        return {"fuzzy_entries": self.entries}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """ The index over the (memory-mapped) arrays of an index segment. """
+
+        return cls(Lexicon(arrays["terms"], arrays["term_offsets"]),
+                   arrays["fuzzy_entries"])
@@ -0,0 +1,132 @@
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (in ms) of the buckets of the latency histograms; the last
+# bucket has no bound.
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                       1000, 2500, 5000, 10000)
+
+
+class Metrics:
+    """
+    Opt-in timers per stage, counters and latency histograms. A stage is a
+    method that instrument() replaces by a timed wrapper on one object, so
+    objects without metrics run their methods unchanged, at no cost. Times
+    are inclusive: a stage called by another one counts in both.
+
+    >>> class Example:
+    ...     def work(self, items):
+    ...         return len(items)
+    >>> example, metrics = Example(), Metrics()
+    >>> metrics.instrument(example, "work", "stage",
+    ...     lambda args, result: {"items": result}, histogram=True)
+    >>> example.work([1, 2, 3]), example.work([4])
+    (3, 1)
+    >>> stats = metrics.to_dict()
+    >>> stats["timers"]["stage"]["calls"], stats["counters"]
+    (2, {'items': 4})
+    >>> sum(stats["histograms"]["stage"]["counts"])
+    2
+    >>> metrics.uninstrument(example)
+    >>> "work" in vars(example)
+    False
+    """
+
+    def __init__(self):
+        """ Start with no measurements. """
+
+        self.timers = {}      # Stage -> [number of calls, total seconds].
+        self.counters = {}
+        self.histograms = {}  # Stage -> number of calls per bucket.
+        self.instrumented = []
+        self.lock = threading.Lock()
+
+    def add_time(self, stage, seconds, histogram=False):
+        """ Record one call of the stage that took the given time. """
+
+        with self.lock:
+            timer = self.timers.setdefault(stage, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            if (histogram):
+                counts = self.histograms.setdefault(
+                    stage, [0] * (len(HISTOGRAM_BOUNDS_MS) + 1))
+                counts[bisect_left(HISTOGRAM_BOUNDS_MS, 1000 * seconds)] += 1
+
+    def count(self, counter, n=1):
+        """ Add n to the counter. """
+
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def instrument(self, obj, name, stage, counters=None, histogram=False):
+        """
+        Time every call of the method name of obj as the stage (and add it
+        to the stage's latency histogram, if histogram is true). With
+        counters, the dict counters(args, result) is added to the counters
+        after each call.
+        """
+
+        method = getattr(obj, name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            self.add_time(stage, time.perf_counter() - start, histogram)
+            if (counters is not None):
+                for counter, n in counters(args, result).items():
+                    self.count(counter, n)
+            return result
+
+        setattr(obj, name, timed)
+        self.instrumented.append((obj, name))
+
+    def uninstrument(self, obj):
+        """ Restore the methods of obj instrumented by this object. """
+
+        for instrumented, name in self.instrumented:
+            if (instrumented is obj):
+                delattr(obj, name)
+        self.instrumented = [(instrumented, name) for instrumented, name
+                             in self.instrumented if instrumented is not obj]
+
+    def reset(self):
+        """ Drop all measurements, but keep the instrumentation. """
+
+        with self.lock:
+            self.timers, self.counters, self.histograms = {}, {}, {}
+
+    def to_dict(self):
+        """ All measurements, as a dict that can be written as JSON. """
+
+        with self.lock:
+            timers = {stage: {"calls": calls, "seconds": round(seconds, 6),
+                              "mean_ms": round(1000 * seconds / calls, 4)}
+                      for stage, (calls, seconds)
+                      in sorted(self.timers.items())}
+            histograms = {stage: {"le_ms": list(HISTOGRAM_BOUNDS_MS) + ["inf"],
+                                  "counts": list(counts)}
+                          for stage, counts in sorted(self.histograms.items())}
+            return {"timers": timers,
+                    "counters": dict(sorted(self.counters.items())),
+                    "histograms": histograms}
+
+    def dump(self, file_name):
+        """ Write the measurements to a JSON file. """
+
+        with open(file_name, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+            file.write("\n")
+
+
+def peak_rss():
+    """ The peak resident set size of this process so far, in bytes. """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,326 @@
+import re
+from array import array
+from bisect import bisect_left
+
+from segment import Lexicon
+from tokenizer import Tokenizer
+
+# A quoted phrase, optionally followed by ~<slop>.
+PHRASE_PATTERN = re.compile('"([^"]*)"(?:~([0-9]+))?')
+
+# A word with wildcards: * for any string, ? for any one character. A ?
+# is a wildcard only before more of the word, so that a question mark at
+# the end of a word (or query) is punctuation.
+WILDCARD = r"(?:\*|\?+(?=[\w*]))"
+WILDCARD_PATTERN = re.compile(r"(?:\w|%s)*%s(?:\w|%s)*"
+                              % (WILDCARD, WILDCARD, WILDCARD))
+
+
+def is_wildcard(keyword):
+    """
+    Whether a keyword of parse_query is a pattern with wildcards.
+
+    >>> is_wildcard("sh?rt"), is_wildcard("film?"), is_wildcard("anim*")
+    (True, False, True)
+    """
+
+    return WILDCARD_PATTERN.search(keyword) is not None
+
+
+def parse_query(query, tokenizer=None):
+    """
+    The keywords of a query (the terms of the given tokenizer, in order)
+    and its phrases, as (words, slop) for each quoted group of at least two
+    words. A phrase "..."~slop also matches with up to slop other words
+    between each two consecutive words. Words with wildcards, like anim*,
+    are kept as they are (normalized, but not split or stemmed), for the
+    index to expand them.
+
+    >>> parse_query('"Short film"~2 animated "a"')
+    (['short', 'film', 'animated', 'a'], [(('short', 'film'), 2)])
+    >>> parse_query("Anim* sh?rt, film")
+    (['anim*', 'sh?rt', 'film'], [])
+    >>> parse_query("short film?")
+    (['short', 'film'], [])
+    """
+
+    if (tokenizer is None):
+        tokenizer = Tokenizer()
+    phrases = []
+    for match in PHRASE_PATTERN.finditer(query):
+        words = tuple(tokenizer.tokens(match.group(1)))
+        if (len(words) > 1):
+            phrases.append((words, int(match.group(2) or 0)))
+    if (not is_wildcard(query)):
+        return tokenizer.tokens(query), phrases
+    keywords, start = [], 0
+    for match in WILDCARD_PATTERN.finditer(query):
+        keywords += tokenizer.tokens(query[start:match.start()])
+        keywords.append(tokenizer.normalize(match.group()))
+        start = match.end()
+    return keywords + tokenizer.tokens(query[start:]), phrases
+
+
+def encode_positions(positions, data):
+    """
+    Append increasing positions (from 0) to data as gaps, variable-byte
+    encoded like the postings of posting_list (the high bit ends a gap).
+    """
+
+    previous = -1
+    for position in positions:
+        gap = position - previous
+        while (gap >= 128):
+            data.append(gap & 127)
+            gap >>= 7
+        data.append(gap | 128)
+        previous = position
+
+
+def decode_positions(data):
+    """
+    The positions encoded by encode_positions.
+
+    >>> data = bytearray()
+    >>> encode_positions([0, 3, 300], data)
+    >>> len(data), decode_positions(data)
+    (4, [0, 3, 300])
+    """
+
+    positions = []
+    position = -1
+    gap, shift = 0, 0
+    for byte in data:
+        if (byte < 128):
+            gap |= byte << shift
+            shift += 7
+        else:
+            position += gap | ((byte & 127) << shift)
+            positions.append(position)
+            gap, shift = 0, 0
+    return positions
+
+
+class PositionList:
+    """
+    The positions of one word in each record that contains it: the sorted
+    record ids and, for each one, the range of its encoded positions in
+    data (offsets has one more entry than record_ids).
+
+    >>> position_list = PositionList()
+    >>> position_list.append(2, [1, 4])
+    >>> position_list.append(7, [0])
+    >>> position_list.get(2), position_list.get(7), position_list.get(3)
+    ([1, 4], [0], [])
+    """
+
+    def __init__(self, record_ids=None, offsets=None, data=None):
+        self.record_ids = array("I") if record_ids is None else record_ids
+        self.offsets = array("Q", [0]) if offsets is None else offsets
+        self.data = bytearray() if data is None else data
+
+    def append(self, record_id, positions):
+        """ Add the positions of a record with a larger id than all others. """
+
+        if (len(self.record_ids) > 0 and record_id <= self.record_ids[-1]):
+            raise ValueError("record ids must be strictly increasing")
+        # The id comes last, so a concurrent get never sees it without data.
+        encode_positions(positions, self.data)
+        self.offsets.append(len(self.data))
+        self.record_ids.append(record_id)
+
+    def get(self, record_id):
+        """ The positions of the word in the record, [] if it is not there. """
+
+        record_ids = self.record_ids
+        i = bisect_left(record_ids, record_id)
+        if (i == len(record_ids) or record_ids[i] != record_id):
+            return []
+        return decode_positions(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def copy(self):
+        """ A list that can be appended to, e.g. of a memory-mapped one. """
+
+        start = self.offsets[0]
+        offsets = array("Q", [offset - start for offset in self.offsets])
+        return PositionList(array("I", self.record_ids), offsets,
+                            bytearray(self.data[start:self.offsets[-1]]))
+
+    def __len__(self):
+        return len(self.record_ids)
+
+
+class PositionIndex:
+    """
+    The positions of every word in every record (the n-th term of a record,
+    see tokenizer.Tokenizer, has position n), to check phrases and
+    proximity for the candidates of a query. Lists of a loaded index are
+    read from the mapped segment on demand; words of records added later
+    are copied first.
+
+    >>> positions = PositionIndex()
+    >>> positions.add(1, ["doc", "a", "short", "film"])
+    >>> positions.add(2, ["doc", "a", "film", "short"])
+    >>> positions.get("short", 1), positions.get("film", 2)
+    ([2], [2])
+    >>> positions.filter([1, 2], [(("short", "film"), 0)])
+    [1]
+    >>> positions.filter([1, 2], [(("doc", "film"), 1)])
+    [2]
+    >>> positions = PositionIndex.from_arrays(positions.to_arrays())
+    >>> positions.add(3, ["doc", "short", "film"])
+    >>> positions.filter([1, 2, 3], [(("short", "film"), 0)])
+    [1, 3]
+    >>> merged = PositionIndex()
+    >>> merged.add(1, ["short", "film"])
+    >>> merged.extend(positions, 1)
+    >>> merged.filter([1, 2, 3, 4], [(("short", "film"), 0)])
+    [1, 2, 4]
+    """
+
+    def __init__(self):
+        """ Start without positions. """
+
+        self.lists = {}  # Word -> PositionList, for the lists in memory.
+        self.lexicon = None
+        self.arrays = None
+
+    def add(self, record_id, words):
+        """
+        Add the positions of the words (terms) of a record with a larger id.
+        """
+
+        positions = {}
+        for position, word in enumerate(words):
+            positions.setdefault(word, []).append(position)
+        for word, word_positions in positions.items():
+            position_list = self.lists.get(word)
+            if (position_list is None):
+                position_list = self.writable_list(word)
+            position_list.append(record_id, word_positions)
+
+    def extend(self, other, shift):
+        """
+        Append the lists of another index, each record id increased by
+        shift, which must make them larger than ours. The encoded positions
+        are copied as they are.
+        """
+
+        for word in other.words():
+            other_list = other.position_list(word)
+            position_list = self.lists.get(word)
+            if (position_list is None):
+                position_list = self.writable_list(word)
+            start, end = other_list.offsets[0], other_list.offsets[-1]
+            moved = len(position_list.data) - start
+            position_list.data += other_list.data[start:end]
+            position_list.offsets.extend(
+                offset + moved for offset in other_list.offsets[1:])
+            position_list.record_ids.extend(
+                record_id + shift for record_id in other_list.record_ids)
+
+    def writable_list(self, word):
+        """ Put a list of the word that can be appended to in self.lists. """
+
+        mapped = self.mapped_list(word)
+        position_list = PositionList() if mapped is None else mapped.copy()
+        self.lists[word] = position_list
+        return position_list
+
+    def mapped_list(self, word):
+        """ The list of the word in the mapped segment, None if not there. """
+
+        if (self.lexicon is None):
+            return None
+        i = self.lexicon.index(word)
+        if (i < 0):
+            return None
+        arrays = self.arrays
+        start, end = arrays["pos_starts"][i], arrays["pos_starts"][i + 1]
+        return PositionList(arrays["pos_ids"][start:end],
+                            arrays["pos_offsets"][start:end + 1],
+                            arrays["pos_data"])
+
+    def position_list(self, word):
+        """ The list of the word, in memory or mapped, None if none. """
+
+        position_list = self.lists.get(word)
+        if (position_list is None):
+            position_list = self.mapped_list(word)
+        return position_list
+
+    def words(self):
+        """ All words with positions, sorted. """
+
+        words = set(self.lists)
+        if (self.lexicon is not None):
+            words.update(self.lexicon)
+        return sorted(words)
+
+    def get(self, word, record_id):
+        """ The positions of the word in the record. """
+
+        position_list = self.position_list(word)
+        return [] if position_list is None else position_list.get(record_id)
+
+    def matches(self, record_id, words, slop=0):
+        """
+        Whether the record contains the words in this order, with at most
+        slop other words between each two consecutive ones.
+        """
+
+        # The positions at which a match of the words so far ends.
+        ends = self.get(words[0], record_id)
+        for word in words[1:]:
+            if (len(ends) == 0):
+                return False
+            kept = []
+            i = 0
+            for position in self.get(word, record_id):
+                while (i < len(ends) and ends[i] < position - slop - 1):
+                    i += 1
+                if (i < len(ends) and ends[i] < position):
+                    kept.append(position)
+            ends = kept
+        return len(ends) > 0
+
+    def filter(self, record_ids, phrases):
+        """ The record ids (in order) that match all (words, slop) phrases. """
+
+        return [record_id for record_id in record_ids
+                if all(self.matches(record_id, words, slop)
+                       for words, slop in phrases)]
+
+    def to_arrays(self):
+        """
+        All lists as arrays for write_segment, in the order of the sorted
+        words: the words (see Lexicon), the start of each word's postings,
+        and the record id and range of encoded positions of each posting.
+        """
+
+        words = self.words()
+        terms, term_offsets = Lexicon.encode(words)
+        starts, record_ids = array("Q", [0]), array("I")
+        offsets, data = array("Q", [0]), bytearray()
+        for word in words:
+            position_list = self.position_list(word)
+            start, end = position_list.offsets[0], position_list.offsets[-1]
+            moved = len(data) - start
+            data += position_list.data[start:end]
+            offsets.extend(
+                offset + moved for offset in position_list.offsets[1:])
+            record_ids.extend(position_list.record_ids)
+            starts.append(len(record_ids))
+        return {"pos_terms": terms, "pos_term_offs": term_offsets,
+                "pos_starts": starts, "pos_ids": record_ids,
+                "pos_offsets": offsets, "pos_data": data}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """ The index over the (memory-mapped) arrays written by to_arrays. """
+
+        positions = cls()
+        positions.lexicon = Lexicon(arrays["pos_terms"],
+                                    arrays["pos_term_offs"])
+        positions.arrays = arrays
+        return positions
@@ -0,0 +1,386 @@
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+
+# Layout of a segment file: the magic, the number of arrays, then one table
+# entry per array (name, typecode, byte offset, number of items), followed by
+# the arrays themselves, each one 8-byte aligned.
+HEADER = struct.Struct("<8sI")
+ENTRY = struct.Struct("<16scQQ")
+
+
+def write_segment(file_name, magic, arrays):
+    """
+    Write the given named arrays (name -> array or bytes) to a binary file.
+
+    >>> import os, tempfile
+    >>> file_name = os.path.join(tempfile.mkdtemp(), "example.seg")
+    >>> write_segment(file_name, b"EXAMPLE1",
+    ...     {"ids": array("I", [1, 5, 7]), "blob": b"abc"})
+    >>> segment = read_segment(file_name, b"EXAMPLE1")
+    >>> segment["ids"].tolist(), bytes(segment["blob"])
+    ([1, 5, 7], b'abc')
+    """
+
+    entries = []
+    offset = HEADER.size + ENTRY.size * len(arrays)
+    for name, values in arrays.items():
+        if (len(name) > 16):
+            raise ValueError("array name too long: %s" % name)
+        offset += -offset % 8
+        values = memoryview(values)
+        entries.append((name, values, offset))
+        offset += values.nbytes
+
+    with open(file_name, "wb") as file:
+        file.write(HEADER.pack(magic, len(arrays)))
+        for name, values, offset in entries:
+            file.write(ENTRY.pack(name.encode(), values.format.encode(),
+                                  offset, len(values)))
+        for name, values, offset in entries:
+            file.write(b"\0" * (offset - file.tell()))
+            file.write(values.cast("B"))
+
+
+def read_segment(file_name, magic):
+    """
+    Memory-map a file written by write_segment and return a dict from name
+    to a read-only memoryview of each array. Nothing is copied: the pages
+    are loaded on first access and shared by all processes mapping the file.
+    """
+
+    with open(file_name, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    file_magic, num_arrays = HEADER.unpack_from(view, 0)
+    if (file_magic != magic):
+        raise ValueError("%s is not a %s segment" % (file_name, magic.decode()))
+
+    arrays = {}
+    for i in range(num_arrays):
+        name, typecode, offset, length = ENTRY.unpack_from(
+            view, HEADER.size + i * ENTRY.size)
+        values = view[offset:offset + length * array(typecode.decode()).itemsize]
+        arrays[name.rstrip(b"\0").decode()] = values.cast(typecode.decode())
+    return arrays
+
+
+class SegmentWriter:
+    """
+    Write a segment whose arrays do not fit in memory. Values are appended
+    to each array in any order and spooled to one temporary file per array
+    (next to the segment); close then lays them out like write_segment.
+
+    >>> import os, tempfile
+    >>> file_name = os.path.join(tempfile.mkdtemp(), "example.seg")
+    >>> writer = SegmentWriter(file_name, b"EXAMPLE1", {"ids": "I", "blob": "B"})
+    >>> writer.append("ids", array("I", [1, 5]))
+    >>> writer.append("blob", b"abc")
+    >>> writer.append("ids", array("I", [7]))
+    >>> writer.close()
+    >>> segment = read_segment(file_name, b"EXAMPLE1")
+    >>> segment["ids"].tolist(), bytes(segment["blob"])
+    ([1, 5, 7], b'abc')
+    """
+
+    def __init__(self, file_name, magic, typecodes):
+        """ Start the arrays with the given names and typecodes (in order). """
+
+        for name in typecodes:
+            if (len(name) > 16):
+                raise ValueError("array name too long: %s" % name)
+        self.file_name = file_name
+        self.magic = magic
+        self.typecodes = typecodes
+        directory = os.path.dirname(os.path.abspath(file_name))
+        self.spools = {name: tempfile.TemporaryFile(dir=directory)
+                       for name in typecodes}
+        self.lengths = dict.fromkeys(typecodes, 0)
+
+    def append(self, name, values):
+        """ Append the values (an array, bytes or NumPy array) to an array. """
+
+        values = memoryview(values)
+        if (values.itemsize != array(self.typecodes[name]).itemsize):
+            raise ValueError("wrong item size for %s" % name)
+        self.spools[name].write(values.cast("B"))
+        self.lengths[name] += len(values)
+
+    def close(self):
+        """ Write the segment file and remove the spooled arrays. """
+
+        entries = []
+        offset = HEADER.size + ENTRY.size * len(self.spools)
+        for name, typecode in self.typecodes.items():
+            offset += -offset % 8
+            entries.append((name, typecode, offset))
+            offset += self.lengths[name] * array(typecode).itemsize
+
+        with open(self.file_name, "wb") as file:
+            file.write(HEADER.pack(self.magic, len(entries)))
+            for name, typecode, offset in entries:
+                file.write(ENTRY.pack(name.encode(), typecode.encode(),
+                                      offset, self.lengths[name]))
+            for name, typecode, offset in entries:
+                file.write(b"\0" * (offset - file.tell()))
+                spool = self.spools[name]
+                spool.seek(0)
+                shutil.copyfileobj(spool, file)
+                spool.close()
+
+
+def encode_number(number, data):
+    """ Append the variable-byte code of a number, as in posting_list. """
+
+    while (number >= 128):
+        data.append(number & 127)
+        number >>= 7
+    data.append(number | 128)
+
+
+def decode_number(data, offset):
+    """ The number whose code starts at the offset, and the offset after it. """
+
+    number, shift = 0, 0
+    byte = data[offset]
+    while (byte < 128):
+        number |= byte << shift
+        shift += 7
+        offset += 1
+        byte = data[offset]
+    return number | ((byte & 127) << shift), offset + 1
+
+
+def wildcard_regex(pattern):
+    """
+    A regex for a pattern in which * stands for any string and ? for any
+    one character.
+
+    >>> bool(wildcard_regex("an?m*").fullmatch("animated"))
+    True
+    """
+
+    return re.compile("".join(
+        ".*" if char == "*" else "." if char == "?" else re.escape(char)
+        for char in pattern), re.DOTALL)
+
+
+class LexiconEncoder:
+    """
+    Front-code sorted terms one at a time, for a Lexicon. A new block
+    starts every BLOCK_SIZE terms; its first term is coded in full.
+
+    >>> encoder = LexiconEncoder()
+    >>> encoder.starts_block(), encoder.encode(b"film")
+    (True, bytearray(b'\\x80\\x84film'))
+    >>> encoder.starts_block(), encoder.encode(b"films")
+    (False, bytearray(b'\\x84\\x81s'))
+    """
+
+    def __init__(self):
+        self.previous = b""
+        self.num_terms = 0
+
+    def starts_block(self):
+        """ Whether the next term is the first one of a block. """
+
+        return self.num_terms % Lexicon.BLOCK_SIZE == 0
+
+    def encode(self, term):
+        """
+        The code of the next term (bytes, larger than the last one): the
+        length of the prefix it shares with the last term of the block, the
+        length of the rest and the rest.
+        """
+
+        shared = 0
+        if (not self.starts_block()):
+            shared = len(os.path.commonprefix([self.previous, term]))
+        code = bytearray()
+        encode_number(shared, code)
+        encode_number(len(term) - shared, code)
+        code += term[shared:]
+        self.previous = term
+        self.num_terms += 1
+        return code
+
+
+class Lexicon:
+    """
+    The sorted vocabulary of a segment, front-coded in blocks of BLOCK_SIZE
+    terms (see LexiconEncoder), plus the start offset of each block. Sorted
+    terms share long prefixes, so this takes a few bytes per term instead
+    of a string object and a dict slot. Looking up a term is a binary
+    search on the first terms of the blocks, directly on the (memory-mapped)
+    blob, and a scan of one block, so no dict has to be built on load. The
+    terms with a prefix are consecutive, which makes prefix and wildcard
+    patterns cheap to expand.
+
+    >>> blob, offsets = Lexicon.encode(["film", "a", "movie", "films"])
+    >>> lexicon = Lexicon(blob, offsets)
+    >>> list(lexicon), lexicon.index("film"), lexicon.index("doc")
+    (['a', 'film', 'films', 'movie'], 1, -1)
+    >>> lexicon.get("movie"), lexicon.get("doc")
+    (3, None)
+    >>> lexicon.expand("fil*"), lexicon.expand("?o*e"), lexicon.expand("x*")
+    (['film', 'films'], ['movie'], [])
+    """
+
+    BLOCK_SIZE = 16
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        num_blocks = len(offsets) - 1
+        self.length = 0
+        if (num_blocks > 0):
+            self.length = ((num_blocks - 1) * self.BLOCK_SIZE
+                           + len(self.block(num_blocks - 1)))
+
+    @staticmethod
+    def encode(terms):
+        """ Sort the terms and return the blob and the offsets array. """
+
+        blob = bytearray()
+        offsets = array("Q")
+        encoder = LexiconEncoder()
+        for term in sorted(terms):
+            if (encoder.starts_block()):
+                offsets.append(len(blob))
+            blob += encoder.encode(term.encode("utf-8"))
+        offsets.append(len(blob))
+        return blob, offsets
+
+    def block(self, b):
+        """ The terms (as bytes) of the b-th block. """
+
+        blob = self.blob
+        offset, end = self.offsets[b], self.offsets[b + 1]
+        terms = []
+        term = b""
+        while (offset < end):
+            # Both lengths almost always fit in one byte.
+            shared = blob[offset]
+            if (shared >= 128):
+                shared, offset = shared & 127, offset + 1
+            else:
+                shared, offset = decode_number(blob, offset)
+            length = blob[offset]
+            if (length >= 128):
+                length, offset = length & 127, offset + 1
+            else:
+                length, offset = decode_number(blob, offset)
+            term = term[:shared] + bytes(blob[offset:offset + length])
+            offset += length
+            terms.append(term)
+        return terms
+
+    def first_term(self, b):
+        """ The first term (as bytes) of the b-th block. """
+
+        _, offset = decode_number(self.blob, self.offsets[b])
+        length, offset = decode_number(self.blob, offset)
+        return bytes(self.blob[offset:offset + length])
+
+    def find_block(self, key):
+        """ The last block whose first term is <= key (bytes), -1 if none. """
+
+        lo, hi = 0, len(self.offsets) - 1
+        while (lo < hi):
+            mid = (lo + hi) // 2
+            if (self.first_term(mid) <= key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def term_bytes(self, i):
+        """ The i-th term in sorted order, as bytes. """
+
+        return self.block(i // self.BLOCK_SIZE)[i % self.BLOCK_SIZE]
+
+    def lower_bound(self, key):
+        """ The position of the first term >= key (bytes), len if none. """
+
+        b = self.find_block(key)
+        if (b < 0):
+            return 0
+        return b * self.BLOCK_SIZE + bisect_left(self.block(b), key)
+
+    def index(self, term):
+        """ The position of the term in sorted order, -1 if not present. """
+
+        key = term.encode("utf-8")
+        b = self.find_block(key)
+        if (b < 0):
+            return -1
+        block = self.block(b)
+        i = bisect_left(block, key)
+        if (i < len(block) and block[i] == key):
+            return b * self.BLOCK_SIZE + i
+        return -1
+
+    def get(self, term, default=None):
+        """ The position of the term, like dict.get. """
+
+        i = self.index(term)
+        return default if i < 0 else i
+
+    def prefix_range(self, prefix):
+        """
+        The positions lo, hi such that the terms lo to hi - 1 are those that
+        start with the prefix.
+
+        >>> Lexicon(*Lexicon.encode(["a", "film", "films", "movie"])
+        ...         ).prefix_range("film")
+        (1, 3)
+        """
+
+        key = prefix.encode("utf-8")
+        # The smallest key larger than all terms with the prefix (UTF-8
+        # has no 0xff bytes).
+        end = key.rstrip(b"\xff")
+        if (len(end) == 0):
+            return self.lower_bound(key), len(self)
+        end = end[:-1] + bytes([end[-1] + 1])
+        return self.lower_bound(key), self.lower_bound(end)
+
+    def terms(self, lo=0, hi=None):
+        """ Yield the terms lo to hi - 1 (as bytes), decoding whole blocks. """
+
+        hi = len(self) if hi is None else hi
+        for b in range(lo // self.BLOCK_SIZE, -(-hi // self.BLOCK_SIZE)):
+            first = b * self.BLOCK_SIZE
+            for term in self.block(b)[max(lo - first, 0):hi - first]:
+                yield term
+
+    def expand(self, pattern, limit=None):
+        """
+        The terms matching a pattern, in which * stands for any string and ?
+        for any one character, in sorted order; at most limit of them if
+        given. Only the terms starting with the part of the pattern before
+        the first wildcard are tested.
+        """
+
+        prefix = re.match("[^*?]*", pattern).group()
+        regex = wildcard_regex(pattern)
+        matches = []
+        for term in self.terms(*self.prefix_range(prefix)):
+            term = term.decode("utf-8")
+            if (regex.fullmatch(term)):
+                matches.append(term)
+                if (len(matches) == limit):
+                    break
+        return matches
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for term in self.terms():
+            yield term.decode("utf-8")
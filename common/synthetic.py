@@ -0,0 +1,110 @@
+import os
+import random
+from itertools import accumulate
+
+# Defaults of the synthetic corpora: number of distinct words, Zipf exponent
+# and the average number of words of a description.
+VOCABULARY_SIZE = 50000
+ZIPF_EXPONENT = 1.0
+WORDS_PER_DOC = 30
+TITLE_WORDS = 3
+
+
+def word(rank):
+    """
+    The synthetic word of the given rank (from 0), letters only, so that the
+    tokenizers keep it whole. Frequent words are short, like in English.
+
+    >>> [word(rank) for rank in (0, 1, 25, 26, 27, 701, 702)]
+    ['a', 'b', 'z', 'aa', 'ab', 'zz', 'aaa']
+    """
+
+    letters = []
+    rank += 1
+    while (rank > 0):
+        rank, letter = divmod(rank - 1, 26)
+        letters.append(chr(ord("a") + letter))
+    return "".join(reversed(letters))
+
+
+class ZipfSampler:
+    """
+    Draws words with a probability proportional to 1 / rank^exponent.
+
+    >>> sampler = ZipfSampler(1000, seed=0)
+    >>> words = sampler.sample(10000)
+    >>> words.count("a") > words.count("b") > words.count("z") > 0
+    True
+    """
+
+    def __init__(self, vocabulary_size=VOCABULARY_SIZE,
+                 exponent=ZIPF_EXPONENT, seed=0):
+        self.words = [word(rank) for rank in range(vocabulary_size)]
+        self.cum_weights = list(accumulate(
+            1 / (rank + 1) ** exponent for rank in range(vocabulary_size)))
+        self.random = random.Random(seed)
+
+    def sample(self, k):
+        """ k words, drawn independently. """
+
+        return self.random.choices(self.words, cum_weights=self.cum_weights,
+                                   k=k)
+
+
+def write_corpus(file_name, num_docs, vocabulary_size=VOCABULARY_SIZE,
+                 words_per_doc=WORDS_PER_DOC, seed=0):
+    """
+    Write num_docs records "<title>\\t<description>" of Zipf-distributed
+    words; the description lengths vary uniformly around words_per_doc.
+    The same arguments always give the same file.
+
+    >>> import os, tempfile
+    >>> file_name = os.path.join(tempfile.mkdtemp(), "corpus.txt")
+    >>> write_corpus(file_name, 3, vocabulary_size=100, words_per_doc=4)
+    >>> with open(file_name) as file:
+    ...     [line.count("\\t") for line in file]
+    [1, 1, 1]
+    """
+
+    sampler = ZipfSampler(vocabulary_size, seed=seed)
+    lengths = random.Random(seed + 1)
+    with open(file_name, "w", encoding="utf-8") as file:
+        for _ in range(num_docs):
+            length = lengths.randint(words_per_doc // 2,
+                                     3 * words_per_doc // 2)
+            words = sampler.sample(TITLE_WORDS + length)
+            file.write("%s\t%s.\n" % (" ".join(words[:TITLE_WORDS]),
+                                      " ".join(words[TITLE_WORDS:])))
+
+
+def make_queries(num_queries, vocabulary_size=VOCABULARY_SIZE,
+                 num_terms=(2, 3, 4), seed=1):
+    """
+    Keyword queries of Zipf-distributed words (so popular terms, and
+    whole queries, repeat like in a query log), each with a number of
+    terms drawn from num_terms.
+
+    >>> queries = make_queries(3, vocabulary_size=100)
+    >>> len(queries), all(2 <= len(query.split()) <= 4 for query in queries)
+    (3, True)
+    """
+
+    sampler = ZipfSampler(vocabulary_size, seed=seed)
+    lengths = random.Random(seed + 1)
+    return [" ".join(sampler.sample(lengths.choice(num_terms)))
+            for _ in range(num_queries)]
+
+
+def cached_corpus(directory, num_docs, **kwargs):
+    """
+    The file name of the corpus of write_corpus(num_docs, **kwargs) in the
+    directory, which is only written if it does not exist yet.
+    """
+
+    parameters = "".join("-%s%s" % item for item in sorted(kwargs.items()))
+    file_name = os.path.join(directory, "zipf-%d%s.txt" % (num_docs,
+                                                           parameters))
+    if (not os.path.exists(file_name)):
+        write_corpus(file_name + ".tmp", num_docs, **kwargs)
+        os.replace(file_name + ".tmp", file_name)
+    return file_name
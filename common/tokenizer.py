@@ -0,0 +1,177 @@
+import json
+import re
+import unicodedata
+
+# A word is a maximal run of letters, of any script; with digits, a maximal
+# run of letters and digits.
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+ALNUM_PATTERN = re.compile(r"[^\W_]+")
+
+# The same for lowercase ASCII text, which is about 1.5 times faster.
+ASCII_WORD_PATTERN = re.compile("[a-z]+")
+ASCII_ALNUM_PATTERN = re.compile("[a-z0-9]+")
+
+# Combining marks, which fold_accents removes after decomposing the text.
+COMBINING_PATTERN = re.compile(
+    "[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
+# Very frequent English words, for Tokenizer(stopwords=STOPWORDS).
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have he her his i in is it its
+    of on or she that the their them they this to was were which who will
+    with you
+""".split())
+
+
+def plural_stem(word):
+    """
+    Harman's S-stemmer: conflate plurals with their singular forms, and
+    nothing else. Only the first rule that applies is used.
+
+    >>> [plural_stem(word) for word in ["ponies", "horses", "films", "glass"]]
+    ['pony', 'horse', 'film', 'glass']
+    """
+
+    if (word.endswith("ies") and not word.endswith(("eies", "aies"))):
+        return word[:-3] + "y"
+    if (word.endswith("es") and not word.endswith(("aes", "ees", "oes"))):
+        return word[:-1]
+    if (word.endswith("s") and not word.endswith(("us", "ss"))):
+        return word[:-1]
+    return word
+
+
+# The stemmers a Tokenizer can use, by name (names are saved with an index).
+STEMMERS = {"plural": plural_stem}
+
+
+class Tokenizer:
+    """
+    Splits text into terms, the same way for indexing and for queries: the
+    text is lowercased, optionally with accents removed, split into words
+    by one precompiled pattern (a faster one for ASCII text), and
+    optionally stopwords are dropped and the words stemmed. Without
+    stopwords and stemming (the default), a text costs one lower() and one
+    findall(), both in C.
+
+    >>> Tokenizer().tokens("Doc\\tA short, short Film (café) 2018.")
+    ['doc', 'a', 'short', 'short', 'film', 'café']
+    >>> Tokenizer(digits=True, fold_accents=True).tokens("Café 2018")
+    ['cafe', '2018']
+    >>> tokenizer = Tokenizer(stopwords=STOPWORDS, stem="plural")
+    >>> tokenizer.tokens("The films of the year")
+    ['film', 'year']
+    """
+
+    def __init__(self, digits=False, fold_accents=False, stopwords=(),
+                 stem=None):
+        """
+        A tokenizer with the given options. Words include digits if digits
+        is true; stem is the name of one of STEMMERS, or None.
+        """
+
+        if (stem is not None and stem not in STEMMERS):
+            raise ValueError("unknown stemmer: %s" % stem)
+        self.digits = digits
+        self.fold_accents = fold_accents
+        self.stopwords = frozenset(stopwords)
+        self.stem = stem
+        self.pattern = ALNUM_PATTERN if digits else WORD_PATTERN
+        self.ascii_pattern = (ASCII_ALNUM_PATTERN if digits
+                              else ASCII_WORD_PATTERN)
+        self.plain = len(self.stopwords) == 0 and stem is None
+        # Word -> term (None for a stopword), for words seen before.
+        self.terms = {}
+
+    def normalize(self, text):
+        """
+        The text in lowercase, without accents if fold_accents is set.
+
+        >>> Tokenizer(fold_accents=True).normalize("Ça Déjà")
+        'ca deja'
+        """
+
+        text = text.lower()
+        if (self.fold_accents and not text.isascii()):
+            text = COMBINING_PATTERN.sub(
+                "", unicodedata.normalize("NFKD", text))
+        return text
+
+    def term(self, word):
+        """ The term of a normalized word, None for a stopword. """
+
+        if (word in self.terms):
+            return self.terms[word]
+        term = None if word in self.stopwords else word
+        if (term is not None and self.stem is not None):
+            term = STEMMERS[self.stem](term)
+        self.terms[word] = term
+        return term
+
+    def tokens(self, text):
+        """ The terms of the text, in order. """
+
+        text = self.normalize(text)
+        if (text.isascii()):
+            words = self.ascii_pattern.findall(text)
+        else:
+            words = self.pattern.findall(text)
+        if (self.plain):
+            return words
+        term = self.term
+        return [t for t in map(term, words) if t is not None]
+
+    def tokenize_many(self, texts):
+        """
+        The terms of each of the texts, like tokens, with the patterns and
+        methods looked up only once for all of them.
+
+        >>> Tokenizer().tokenize_many(["A movie.", "", "Film!"])
+        [['a', 'movie'], [], ['film']]
+        """
+
+        if (self.plain and not self.fold_accents):
+            ascii_findall = self.ascii_pattern.findall
+            findall = self.pattern.findall
+            return [ascii_findall(text) if text.isascii() else findall(text)
+                    for text in map(str.lower, texts)]
+        return [self.tokens(text) for text in texts]
+
+    def term_ids(self, text, vocabulary, add=True):
+        """
+        The ids of the terms of the text in the vocabulary (term -> id).
+        With add, a new term gets the next id, else it is left out.
+
+        >>> vocabulary = {}
+        >>> Tokenizer().term_ids("a b a", vocabulary), vocabulary
+        ([0, 1, 0], {'a': 0, 'b': 1})
+        >>> Tokenizer().term_ids("b c", vocabulary, add=False)
+        [1]
+        """
+
+        if (add):
+            setdefault = vocabulary.setdefault
+            return [setdefault(term, len(vocabulary))
+                    for term in self.tokens(text)]
+        get = vocabulary.get
+        return [i for i in map(get, self.tokens(text)) if i is not None]
+
+    def to_config(self):
+        """
+        The options as JSON (bytes), to be saved with an index.
+
+        >>> tokenizer = Tokenizer(stopwords=["the"], stem="plural")
+        >>> Tokenizer.from_config(tokenizer.to_config()).tokens("The films")
+        ['film']
+        """
+
+        return json.dumps({"digits": self.digits,
+                           "fold_accents": self.fold_accents,
+                           "stopwords": sorted(self.stopwords),
+                           "stem": self.stem}).encode("utf-8")
+
+    @classmethod
+    def from_config(cls, config):
+        """ The tokenizer with the options written by to_config. """
+
+        return cls(**json.loads(bytes(config).decode("utf-8")))